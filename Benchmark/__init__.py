@@ -0,0 +1,3 @@
+'''
+Suíte de benchmarks dos caminhos críticos do ETL e dos orçamentos de importação.
+'''
@@ -0,0 +1,367 @@
+'''
+Suíte de benchmarks dos caminhos críticos do ETL.
+
+Cada caso mede a vazão (documentos por segundo) e o pico de memória alocada em
+escalas de 1k, 10k e 100k documentos sintéticos. Os resultados são salvos em JSON
+e podem ser comparados com uma baseline anterior para identificar regressões.
+
+Uso (a partir da raiz do repositório):
+
+    python -m Benchmark.benchmark run --output Benchmark/baselines/baseline.json
+    python -m Benchmark.benchmark run --scales 1000 --cases xml --output atual.json
+    python -m Benchmark.benchmark compare Benchmark/baselines/baseline.json atual.json
+    python -m Benchmark.benchmark imports --output Benchmark/baselines/imports.json
+
+O comando imports mede o tempo de importação de cada módulo com orçamento (get_import_budgets)
+em um interpretador novo e falha quando um módulo excede o orçamento ou carrega uma
+dependência pesada que não deveria carregar.
+'''
+
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+
+
+@dataclass
+class BenchmarkCase:
+    '''
+    Caso de benchmark. setup(n_documentos, diretorio_temporario) prepara as entradas
+    fora da medição e run(entradas) executa o caminho medido, retornando a quantidade
+    de documentos processados. max_scale limita casos cujo custo torna as escalas
+    maiores inviáveis (ex.: algoritmos quadráticos).
+    '''
+    name : str
+    setup : Callable[[int, Path], Any]
+    run : Callable[[Any], int]
+    max_scale : int | None = None
+
+
+@dataclass
+class BenchmarkResult:
+    case : str
+    scale : int
+    items : int = 0
+    seconds : float = 0.0
+    items_per_second : float = 0.0
+    peak_traced_bytes : int = 0
+    # pico de memória residente do processo até o fim do caso (cumulativo: os casos seguintes ao
+    # mais pesado herdam o seu pico); a memória de cada caso é peak_traced_bytes
+    cumulative_max_rss_bytes : int = 0
+    repeats : int = 0
+    skipped : str | None = None
+
+
+@dataclass
+class ImportBudget:
+    '''
+    Orçamento de importação de um módulo: tempo máximo, em milissegundos, medido em um
+    interpretador novo, e módulos que a importação não pode carregar (ex.: pandas, albumentations).
+    '''
+    module : str
+    max_milliseconds : float
+    forbidden : tuple = ()
+
+
+@dataclass
+class ImportResult:
+    module : str
+    milliseconds : float = 0.0
+    max_milliseconds : float = 0.0
+    loaded_forbidden : list | None = None
+    error : str | None = None
+
+    @property
+    def ok(self):
+        return self.error is None and not self.loaded_forbidden and self.milliseconds <= self.max_milliseconds
+
+
+# executado em um interpretador novo: tempo da importação e módulos proibidos carregados por ela
+IMPORT_PROBE = '''
+import sys, json, time, importlib
+forbidden = json.loads(sys.argv[2])
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in forbidden if name in sys.modules]}))
+'''
+
+
+def measure_import(budget : ImportBudget, repeats : int = 5):
+    '''
+    Melhor tempo de importação entre as repetições, cada uma em um processo novo com o
+    repositório no PYTHONPATH (o cache de bytecode já aquecido pela primeira repetição).
+    '''
+    root = Path(__file__).resolve().parent.parent
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(root), os.environ.get('PYTHONPATH')])))
+
+    timings, loaded = [], []
+    for _ in range(repeats + 1):
+        process = subprocess.run([sys.executable, '-c', IMPORT_PROBE, budget.module, json.dumps(list(budget.forbidden))],
+                                 capture_output=True, text=True, env=environment, cwd=root)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f'código {process.returncode}'
+            return ImportResult(budget.module, max_milliseconds=budget.max_milliseconds, error=error)
+        measurement = json.loads(process.stdout.strip().splitlines()[-1])
+        timings.append(measurement['seconds'] * 1000)
+        loaded = measurement['loaded']
+
+    # a primeira execução compila o bytecode e não entra na medição
+    return ImportResult(budget.module, min(timings[1:]), budget.max_milliseconds, loaded)
+
+
+def check_import_budgets(budgets : Iterable[ImportBudget], repeats : int = 5):
+    results = []
+    for budget in budgets:
+        result = measure_import(budget, repeats)
+        if result.error:
+            status = f'ERRO ({result.error})'
+        elif result.ok:
+            status = 'ok'
+        else:
+            flags = []
+            if result.milliseconds > result.max_milliseconds:
+                flags.append('tempo')
+            if result.loaded_forbidden:
+                flags.append('carrega ' + ', '.join(result.loaded_forbidden))
+            status = 'ACIMA DO ORÇAMENTO (' + '; '.join(flags) + ')'
+        print(f'{budget.module:<45} {result.milliseconds:8.1f} ms / {budget.max_milliseconds:6.0f} ms | {status}', flush=True)
+        results.append(result)
+
+    return results
+
+
+def get_max_rss_bytes():
+    '''
+    Pico de memória residente do processo (high-water mark) desde o seu início, e não apenas do
+    caso atual. No Linux ru_maxrss é dado em KiB.
+    '''
+    if resource is None:
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def run_case(case : BenchmarkCase, scale : int, repeats : int = 3):
+    '''
+    Executa um caso em uma escala. O tempo é o melhor entre as repetições, medido sem o
+    tracemalloc; o pico de memória é medido em uma execução adicional com o tracemalloc ativo.
+    '''
+
+    if case.max_scale is not None and scale > case.max_scale:
+        return BenchmarkResult(case.name, scale, skipped=f'escala acima do limite do caso ({case.max_scale})')
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as workdir:
+        try:
+            inputs = case.setup(scale, Path(workdir))
+        except ImportError as error:
+            return BenchmarkResult(case.name, scale, skipped=f'dependência ausente: {error.name}')
+
+        timings = []
+        items = 0
+        for _ in range(repeats):
+            gc.collect()
+            start = time.perf_counter()
+            items = case.run(inputs)
+            timings.append(time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        case.run(inputs)
+        _, peak_traced_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    seconds = min(timings)
+
+    return BenchmarkResult(
+        case=case.name,
+        scale=scale,
+        items=items,
+        seconds=seconds,
+        items_per_second=items / seconds if seconds > 0 else float('inf'),
+        peak_traced_bytes=peak_traced_bytes,
+        cumulative_max_rss_bytes=get_max_rss_bytes(),
+        repeats=repeats
+    )
+
+
+def run_benchmarks(cases : Iterable[BenchmarkCase],
+                   scales : Iterable[int] = DEFAULT_SCALES,
+                   repeats : int = 3):
+
+    results = []
+    for case in cases:
+        for scale in scales:
+            print(f'Executando {case.name} com {scale} documentos...', flush=True)
+            result = run_case(case, scale, repeats)
+
+            if result.skipped:
+                print(f'\tignorado: {result.skipped}')
+            else:
+                print(f'\t{result.items_per_second:,.1f} docs/s | {result.seconds:.3f} s | '
+                      f'pico {result.peak_traced_bytes / 2**20:.1f} MiB')
+
+            results.append(result)
+
+    return results
+
+
+def get_metadata():
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def save_results(results : Iterable[BenchmarkResult], path : str | Path):
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    content = {'metadata': get_metadata(), 'results': [asdict(result) for result in results]}
+
+    with open(path, 'w') as file:
+        json.dump(content, file, indent=2)
+
+    print(f'\nResultados salvos em: {path}')
+
+
+def load_results(path : str | Path):
+
+    with open(path, 'r') as file:
+        content = json.load(file)
+
+    return {(result['case'], result['scale']): result for result in content['results']}
+
+
+def compare_results(baseline : dict, current : dict, tolerance : float = 0.10):
+    '''
+    Compara dois conjuntos de resultados indexados por (caso, escala). Uma regressão ocorre
+    quando a vazão cai, ou o pico de memória cresce, mais do que a tolerância relativa.
+    Retorna a lista de regressões encontradas.
+    '''
+
+    regressions = []
+
+    for key in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[key], current[key]
+
+        if old['skipped'] or new['skipped']:
+            continue
+
+        # casos sem itens (ou com tempo nulo) na baseline não têm vazão comparável
+        if not 0 < old['items_per_second'] < float('inf') or not new['items_per_second'] < float('inf'):
+            print(f'{key[0]:<55} {key[1]:>8} | não comparável (vazão da baseline: {old["items_per_second"]})')
+            continue
+
+        throughput_ratio = new['items_per_second'] / old['items_per_second']
+        memory_ratio = new['peak_traced_bytes'] / max(old['peak_traced_bytes'], 1)
+
+        flags = []
+        if throughput_ratio < 1 - tolerance:
+            flags.append('vazão')
+        if memory_ratio > 1 + tolerance:
+            flags.append('memória')
+
+        status = 'REGRESSÃO (' + ', '.join(flags) + ')' if flags else 'ok'
+        print(f'{key[0]:<55} {key[1]:>8} | vazão x{throughput_ratio:.2f} | memória x{memory_ratio:.2f} | {status}')
+
+        if flags:
+            regressions.append({'case': key[0], 'scale': key[1], 'flags': flags,
+                                'throughput_ratio': throughput_ratio, 'memory_ratio': memory_ratio})
+
+    return regressions
+
+
+def main(argv : Iterable[str] = None):
+
+    parser = argparse.ArgumentParser(description='Benchmarks dos caminhos críticos do ETL.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='executa os benchmarks e salva os resultados')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES))
+    run_parser.add_argument('--cases', nargs='+', default=None,
+                            help='filtra os casos cujo nome contém algum dos termos')
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--output', default='Benchmark/baselines/baseline.json')
+
+    compare_parser = subparsers.add_parser('compare', help='compara resultados com uma baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.10)
+
+    imports_parser = subparsers.add_parser('imports', help='verifica os orçamentos de tempo de importação')
+    imports_parser.add_argument('--modules', nargs='+', default=None,
+                                help='filtra os módulos cujo nome contém algum dos termos')
+    imports_parser.add_argument('--repeats', type=int, default=5)
+    imports_parser.add_argument('--output', default=None)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'imports':
+        from .cases import get_import_budgets
+
+        budgets = get_import_budgets()
+        if args.modules:
+            budgets = [budget for budget in budgets if any(term in budget.module for term in args.modules)]
+
+        results = check_import_budgets(budgets, args.repeats)
+        if args.output:
+            Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+            with open(args.output, 'w') as file:
+                json.dump({'metadata': get_metadata(), 'results': [asdict(result) | {'ok': result.ok} for result in results]},
+                          file, indent=2)
+
+        failures = [result for result in results if not result.ok]
+        if failures:
+            print(f'\n{len(failures)} módulo(s) acima do orçamento de importação.')
+            return 1
+
+        print('\nTodos os módulos dentro do orçamento de importação.')
+        return 0
+
+    if args.command == 'run':
+        from .cases import get_cases
+
+        cases = get_cases()
+        if args.cases:
+            cases = [case for case in cases if any(term in case.name for term in args.cases)]
+
+        results = run_benchmarks(cases, args.scales, args.repeats)
+        save_results(results, args.output)
+        return 0
+
+    regressions = compare_results(load_results(args.baseline), load_results(args.current), args.tolerance)
+
+    if regressions:
+        print(f'\n{len(regressions)} regressão(ões) encontrada(s).')
+        return 1
+
+    print('\nNenhuma regressão encontrada.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
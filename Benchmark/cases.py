@@ -0,0 +1,437 @@
+'''
+Casos de benchmark dos caminhos críticos do ETL, alimentados por corpora sintéticos.
+
+Os módulos do projeto são importados dentro do setup de cada caso para que a ausência
+de uma dependência opcional (ex.: matplotlib) ignore apenas os casos afetados.
+'''
+
+import numpy as np
+from pathlib import Path
+
+from .benchmark import BenchmarkCase, ImportBudget
+
+
+CELLS_PER_TABLE = 20
+TABLES_PER_PAGE = 2
+BOXES_PER_PAGE = 20
+PAGE_SIZE = (1000, 1400)
+TARGET_SIZE = (640, 640)
+
+
+def touch_files(dir_path : Path, n_documents : int, extensions):
+    for index in range(n_documents):
+        for extension in extensions:
+            (dir_path/f'doc_{index:06d}.{extension}').touch()
+
+
+def synthetic_generator(n_documents : int, workdir : Path):
+    from DataGenerator.synthetic_corpus import SyntheticCorpusGenerator
+    return SyntheticCorpusGenerator(workdir, n_documents, cells_per_table=CELLS_PER_TABLE,
+                                    tables_per_page=TABLES_PER_PAGE, page_size=PAGE_SIZE, render_images=False)
+
+
+def synthetic_masks(n_documents : int, workdir : Path):
+    generator = synthetic_generator(n_documents, workdir)
+    return [[cell.polygon.tolist() for table in generator.generate_page(index).tables for cell in table.cells]
+            for index in range(n_documents)]
+
+
+def write_ctdar_corpus(workdir : Path, n_documents : int):
+    output_dir = synthetic_generator(n_documents, workdir/'ctdar').generate_icdar()
+    return sorted(output_dir.glob('*.xml'))
+
+
+def synthetic_page(page_size = PAGE_SIZE, seed : int = 42):
+    random_generator = np.random.default_rng(seed)
+    width, height = page_size
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    page[random_generator.random((height, width)) < 0.02] = 0
+    return page
+
+
+# ---------------------------------------------------------------------------------------
+# DataExtractor.file_finder
+# ---------------------------------------------------------------------------------------
+
+def setup_find_files(n_documents, workdir):
+    from DataExtractor.file_finder import FileFinder
+    touch_files(workdir, n_documents, ['jpg', 'xml'])
+    return FileFinder, workdir
+
+
+def run_find_files(inputs):
+    FileFinder, workdir = inputs
+    files = FileFinder.find_files(workdir, format_list=['jpg', 'xml'])
+    return len(files) // 2
+
+
+def setup_associate_files(n_documents, workdir):
+    from DataExtractor.file_finder import FileFinder
+    touch_files(workdir, n_documents, ['jpg', 'xml'])
+    images = FileFinder.find_files(workdir, format_list=['jpg'])
+    labels = FileFinder.find_files(workdir, format_list=['xml'])
+    return FileFinder, images, labels
+
+
+def run_associate_files(inputs):
+    FileFinder, images, labels = inputs
+    return len(FileFinder.associate_files_by_name(images, labels))
+
+
+# ---------------------------------------------------------------------------------------
+# Leitura de anotações XML
+# ---------------------------------------------------------------------------------------
+
+def setup_xy_annotations(n_documents, workdir):
+    from DataExtractor.dataset_to_dataframe import ConvertICDARDatasetToDataframe
+    empty_dir = workdir/'empty'
+    empty_dir.mkdir()
+    converter = ConvertICDARDatasetToDataframe(images_path=empty_dir, labels_path=empty_dir)
+    return converter, write_ctdar_corpus(workdir, n_documents)
+
+
+def run_xy_annotations(inputs):
+    converter, xml_paths = inputs
+    for xml_path in xml_paths:
+        converter.get_xy_annotations_from_xml(xml_path)
+    return len(xml_paths)
+
+
+def setup_parse_xml(n_documents, workdir):
+    from DataVisualization.table_visualizer import TableAnnotationParser
+    return TableAnnotationParser, write_ctdar_corpus(workdir, n_documents)
+
+
+def run_parse_xml(inputs):
+    TableAnnotationParser, xml_paths = inputs
+    for xml_path in xml_paths:
+        TableAnnotationParser.parse_xml(xml_path)
+    return len(xml_paths)
+
+
+# ---------------------------------------------------------------------------------------
+# DataExtractor.polygon_simplification
+# ---------------------------------------------------------------------------------------
+
+def setup_simplify_polygons(n_documents, workdir):
+    from DataExtractor.polygon_simplification import simplify_pages
+    return simplify_pages, synthetic_masks(n_documents, workdir)
+
+
+def run_simplify_polygons(inputs):
+    simplify_pages, pages = inputs
+    # mesmo tamanho de lote da etapa simplify_polygons
+    for start in range(0, len(pages), 64):
+        simplify_pages(pages[start:start + 64], tolerance=1.0)
+    return len(pages)
+
+
+# ---------------------------------------------------------------------------------------
+# DataExtractor.yolo_converter
+# ---------------------------------------------------------------------------------------
+
+def setup_normalize_masks(n_documents, workdir):
+    from DataExtractor.yolo_converter import YOLOConverter
+    return YOLOConverter, synthetic_masks(n_documents, workdir)
+
+
+def run_normalize_masks(inputs):
+    YOLOConverter, pages = inputs
+    width, height = PAGE_SIZE
+    for masks in pages:
+        YOLOConverter.normalize_masks(masks, width, height)
+    return len(pages)
+
+
+def setup_mask_txt_content(n_documents, workdir):
+    YOLOConverter, pages = setup_normalize_masks(n_documents, workdir)
+    width, height = PAGE_SIZE
+    normalized_pages = [YOLOConverter.normalize_masks(masks, width, height) for masks in pages]
+    return YOLOConverter, normalized_pages
+
+
+def run_mask_txt_content(inputs):
+    YOLOConverter, normalized_pages = inputs
+    for normalized_masks in normalized_pages:
+        YOLOConverter.create_mask_txt_file_content(normalized_masks, [0] * len(normalized_masks))
+    return len(normalized_pages)
+
+
+def setup_fintabnet_labels(n_documents, workdir):
+    import pandas as pd
+    from DataExtractor.yolo_converter import FinTabNetYOLOConverter
+
+    random_generator = np.random.default_rng(42)
+    width, height = PAGE_SIZE
+    xy_min = random_generator.integers(0, [width - 50, height - 20], size=(n_documents * BOXES_PER_PAGE, 2))
+    xy_max = xy_min + random_generator.integers(10, [50, 20], size=xy_min.shape)
+    names = list(FinTabNetYOLOConverter.class_id_map)
+
+    annotations = pd.DataFrame({
+        'filename': np.repeat([f'doc_{index:06d}.jpg' for index in range(n_documents)], BOXES_PER_PAGE),
+        'name': random_generator.choice(names, size=len(xy_min)),
+        'xmin': xy_min[:, 0], 'ymin': xy_min[:, 1], 'xmax': xy_max[:, 0], 'ymax': xy_max[:, 1],
+        'width': width, 'height': height
+    })
+    return FinTabNetYOLOConverter, annotations, workdir/'labels'
+
+
+def run_fintabnet_labels(inputs):
+    FinTabNetYOLOConverter, annotations, labels_dir = inputs
+    return len(FinTabNetYOLOConverter.process_split(annotations, labels_dir))
+
+
+# ---------------------------------------------------------------------------------------
+# DataAugmentation.augmentation
+# ---------------------------------------------------------------------------------------
+
+def setup_page_augmentation(n_documents, workdir):
+    from DataAugmentation.augmentation import Augmentation
+    # a mesma página é reutilizada, já que ambas as operações copiam a imagem de entrada
+    return Augmentation, synthetic_page(), n_documents
+
+
+def run_salt_and_pepper(inputs):
+    Augmentation, page, n_documents = inputs
+    for index in range(n_documents):
+        Augmentation.add_salt_and_pepper_noise(page, amount_percentage=0.01, return_ndarray=True, seed=index)
+    return n_documents
+
+
+def run_resize_image(inputs):
+    Augmentation, page, n_documents = inputs
+    width, height = TARGET_SIZE
+    for _ in range(n_documents):
+        Augmentation.resize_image(page, width, height, return_ndarray=True)
+    return n_documents
+
+
+# ---------------------------------------------------------------------------------------
+# DataExtractor.maskrcnn_converter
+# ---------------------------------------------------------------------------------------
+
+def setup_process_split(n_documents, workdir):
+    from PIL import Image
+    from DataExtractor.maskrcnn_converter import YOLO2MaskRCNN
+    from DataExtractor.yolo_converter import YOLOConverter
+
+    split_path = workdir/'train'
+    images_dir, labels_dir, out_dir = split_path/'images', split_path/'labels', workdir/'out'
+    for dir_path in [images_dir, labels_dir, out_dir]:
+        dir_path.mkdir(parents=True)
+
+    # a imagem é codificada uma única vez e seus bytes replicados em todos os documentos
+    image_path = workdir/'page.jpg'
+    Image.fromarray(synthetic_page(TARGET_SIZE)).save(image_path)
+    image_bytes = image_path.read_bytes()
+
+    width, height = PAGE_SIZE
+    for index, masks in enumerate(synthetic_masks(n_documents, workdir)):
+        (images_dir/f'doc_{index:06d}.jpg').write_bytes(image_bytes)
+        masks = YOLOConverter.normalize_masks(masks, width, height)
+        content = YOLOConverter.create_mask_txt_file_content(masks, [0] * len(masks))
+        (labels_dir/f'doc_{index:06d}.txt').write_text(content)
+
+    converter = YOLO2MaskRCNN(folds_dir=workdir, output_dir=out_dir)
+    return converter, split_path, out_dir, n_documents
+
+
+def run_process_split(inputs):
+    converter, split_path, out_dir, n_documents = inputs
+    converter.process_split(split_path, 'train', [{'id': 0, 'name': 'cell'}], out_dir)
+    return n_documents
+
+
+# ---------------------------------------------------------------------------------------
+# DataExtractor.conversion_hub
+# ---------------------------------------------------------------------------------------
+
+def setup_yolo_to_coco(n_documents, workdir):
+    from DataExtractor.conversion_hub import AnnotationConverter, ImageSizeCache
+    # mesmo split de maskrcnn_converter.YOLO2MaskRCNN.process_split, sem a cópia das imagens
+    _, split_path, out_dir, n_documents = setup_process_split(n_documents, workdir)
+    return AnnotationConverter, ImageSizeCache, split_path, out_dir
+
+
+def run_yolo_to_coco(inputs):
+    AnnotationConverter, ImageSizeCache, split_path, out_dir = inputs
+    size_cache = ImageSizeCache()
+    reader = AnnotationConverter.create_reader('yolo', split_path/'labels', split_path/'images', size_cache=size_cache)
+    writer = AnnotationConverter.create_writer('coco', out_dir/'train.json')
+    return AnnotationConverter.convert(reader, writer, size_cache)
+
+
+# ---------------------------------------------------------------------------------------
+# DataVisualization.object_detection_visualization
+# ---------------------------------------------------------------------------------------
+
+def setup_draw_bounding_box(n_documents, workdir):
+    from DataVisualization.object_detection_visualization import draw_bouding_box
+
+    random_generator = np.random.default_rng(42)
+    width, height = TARGET_SIZE
+    xy_min = random_generator.integers(0, [width - 50, height - 20], size=(n_documents, BOXES_PER_PAGE, 2))
+    xy_max = xy_min + random_generator.integers(10, [50, 20], size=xy_min.shape)
+    boxes = np.concatenate([xy_min, xy_max], axis=2).tolist()
+
+    return draw_bouding_box, synthetic_page(TARGET_SIZE), boxes
+
+
+def run_draw_bounding_box(inputs):
+    draw_bouding_box, page, boxes = inputs
+    for page_boxes in boxes:
+        image = page
+        for xmin, ymin, xmax, ymax in page_boxes:
+            image = draw_bouding_box(image, xmin, ymin, xmax, ymax, bbox_class='cell')
+    return len(boxes)
+
+
+# ---------------------------------------------------------------------------------------
+# Inference.tiled
+# ---------------------------------------------------------------------------------------
+
+def setup_merge_detections(n_documents, workdir):
+    from Inference.tiled import Detections, merge_detections
+
+    # cada célula aparece duas vezes, como nas regiões de sobreposição entre tiles
+    random_generator = np.random.default_rng(42)
+    pages = []
+    for masks in synthetic_masks(n_documents, workdir):
+        boxes = np.array([[*np.min(mask, axis=0), *np.max(mask, axis=0)] for mask in masks], dtype=np.float32)
+        boxes = np.concatenate([boxes, boxes + random_generator.normal(0, 1, boxes.shape).astype(np.float32)])
+        polygons = [np.array([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]], dtype=np.float32)
+                    for xmin, ymin, xmax, ymax in boxes]
+        pages.append(Detections(boxes, random_generator.random(len(boxes)).astype(np.float32),
+                                np.zeros(len(boxes), dtype=np.int32), polygons))
+
+    return merge_detections, pages
+
+
+def run_merge_detections(inputs):
+    merge_detections, pages = inputs
+    for detections in pages:
+        merge_detections(detections)
+    return len(pages)
+
+
+# ---------------------------------------------------------------------------------------
+# Inference.ctdar_export
+# ---------------------------------------------------------------------------------------
+
+def setup_ctdar_export(n_documents, workdir):
+    import cv2
+    from Inference.ctdar_export import CTDaRExporter, PagePrediction
+
+    # máscaras na resolução de entrada do modelo; poucas páginas distintas são reutilizadas
+    # para que a memória do setup não cresça com a escala
+    scale = np.array(TARGET_SIZE) / np.array(PAGE_SIZE)
+    stacks = []
+    for masks in synthetic_masks(min(n_documents, 4), workdir):
+        stack = np.zeros((len(masks), TARGET_SIZE[1], TARGET_SIZE[0]), dtype=np.uint8)
+        for index, mask in enumerate(masks):
+            cv2.fillPoly(stack[index], [np.rint(np.array(mask) * scale).astype(np.int32)], 1)
+        stacks.append(stack.astype(bool))
+
+    pages = [PagePrediction(f'doc_{index:06d}.jpg', np.zeros(len(stacks[index % len(stacks)]), dtype=np.int64),
+                            np.linspace(1, 0.5, len(stacks[index % len(stacks)])), masks=stacks[index % len(stacks)],
+                            image_size=PAGE_SIZE)
+             for index in range(n_documents)]
+    return CTDaRExporter, pages, workdir/'ctdar_predictions'
+
+
+def run_ctdar_export(inputs):
+    CTDaRExporter, pages, output_dir = inputs
+    return CTDaRExporter(output_dir, ('cell',), workers=4).export(pages)['pages']
+
+
+# ---------------------------------------------------------------------------------------
+# Inference.server
+# ---------------------------------------------------------------------------------------
+
+def setup_inference_server(n_documents, workdir):
+    import io
+    from PIL import Image
+    from Inference.server import InferenceServer, InferenceClient, StubModel
+
+    buffer = io.BytesIO()
+    Image.fromarray(synthetic_page((500, 700))).save(buffer, format='PNG')
+    return InferenceServer, InferenceClient, StubModel, [buffer.getvalue()] * n_documents
+
+
+def run_inference_server(inputs):
+    import asyncio
+    InferenceServer, InferenceClient, StubModel, bodies = inputs
+
+    async def round_trip():
+        # start -> predict -> stop: as conexões keep-alive do cliente não podem impedir o encerramento
+        server = await InferenceServer(StubModel(batch_overhead_ms=0, image_ms=0), port=0).start()
+        client = InferenceClient(port=server.port)
+        try:
+            latencies, failures = await asyncio.get_running_loop().run_in_executor(None, client.load_test, bodies, 4)
+        finally:
+            await asyncio.wait_for(server.stop(), timeout=5)
+        if failures:
+            raise failures[0]
+        return len(latencies)
+
+    return asyncio.run(round_trip())
+
+
+# dependências cuja importação custa de centenas de milissegundos a segundos
+HEAVY_MODULES = ('pandas', 'albumentations', 'matplotlib', 'sklearn', 'torch', 'ultralytics', 'skimage', 'pycocotools')
+
+
+def get_import_budgets():
+    '''
+    Orçamentos de importação. Os pacotes e o ocr-table não carregam nem o numpy; os módulos usados
+    pelos workers de conversão de rótulos não carregam as dependências pesadas nem o tqdm.
+    '''
+    light = HEAVY_MODULES + ('numpy', 'PIL', 'cv2', 'tqdm')
+    worker = HEAVY_MODULES + ('cv2', 'tqdm')
+    return [
+        ImportBudget('CLI.main', 30, light),
+        ImportBudget('DataExtractor', 30, light),
+        ImportBudget('DataAugmentation', 30, light),
+        ImportBudget('DataVisualization', 30, light),
+        ImportBudget('DataSplitter', 30, light),
+        ImportBudget('Inference', 30, light),
+        ImportBudget('Pipeline.stages', 150, HEAVY_MODULES + ('numpy', 'cv2')),
+        ImportBudget('DataExtractor.yolo_converter', 200, worker),
+        ImportBudget('DataExtractor.label_cache', 250, worker),
+        ImportBudget('DataExtractor.annotation_validator', 250, worker),
+        ImportBudget('DataExtractor.conversion_hub', 300, worker),
+        ImportBudget('DataExtractor.dataset_to_dataframe', 250, worker),
+        ImportBudget('DataAugmentation.augmentation', 300, HEAVY_MODULES + ('cv2',)),
+        ImportBudget('DataVisualization.table_visualizer', 250, HEAVY_MODULES + ('cv2',)),
+        ImportBudget('DataSplitter.kfold', 800, ('sklearn', 'albumentations', 'matplotlib', 'torch')),
+    ]
+
+
+def get_cases():
+    return [
+        BenchmarkCase('file_finder.find_files', setup_find_files, run_find_files),
+        # a associação compara todos os pares de arquivos (O(n²)), inviável em 100k documentos
+        BenchmarkCase('file_finder.associate_files_by_name', setup_associate_files, run_associate_files,
+                      max_scale=10_000),
+        BenchmarkCase('dataset_to_dataframe.get_xy_annotations_from_xml', setup_xy_annotations, run_xy_annotations),
+        BenchmarkCase('table_visualizer.TableAnnotationParser.parse_xml', setup_parse_xml, run_parse_xml),
+        BenchmarkCase('polygon_simplification.simplify_pages', setup_simplify_polygons, run_simplify_polygons),
+        BenchmarkCase('yolo_converter.normalize_masks', setup_normalize_masks, run_normalize_masks),
+        BenchmarkCase('yolo_converter.create_mask_txt_file_content', setup_mask_txt_content, run_mask_txt_content),
+        BenchmarkCase('yolo_converter.FinTabNetYOLOConverter.process_split', setup_fintabnet_labels, run_fintabnet_labels),
+        # o ruído é aplicado pixel a pixel em Python (~100 ms por página) e o redimensionamento
+        # de páginas inteiras custa ~20 ms, o que limita as escalas desses casos
+        BenchmarkCase('augmentation.add_salt_and_pepper_noise', setup_page_augmentation, run_salt_and_pepper,
+                      max_scale=1_000),
+        BenchmarkCase('augmentation.resize_image', setup_page_augmentation, run_resize_image,
+                      max_scale=10_000),
+        BenchmarkCase('maskrcnn_converter.YOLO2MaskRCNN.process_split', setup_process_split, run_process_split),
+        BenchmarkCase('conversion_hub.AnnotationConverter.convert', setup_yolo_to_coco, run_yolo_to_coco),
+        BenchmarkCase('object_detection_visualization.draw_bouding_box', setup_draw_bounding_box,
+                      run_draw_bounding_box),
+        BenchmarkCase('tiled.merge_detections', setup_merge_detections, run_merge_detections),
+        BenchmarkCase('ctdar_export.CTDaRExporter.export', setup_ctdar_export, run_ctdar_export),
+        # cada página passa por HTTP, decodificação e StubModel (~8 ms), o que limita a escala
+        BenchmarkCase('server.InferenceServer.predict', setup_inference_server, run_inference_server,
+                      max_scale=1_000),
+    ]
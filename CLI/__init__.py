@@ -0,0 +1,3 @@
+'''
+Ponto de entrada único (ocr-table) dos comandos do projeto.
+'''
@@ -0,0 +1,68 @@
+'''
+Comando ocr-table: despacha para o main() do módulo de cada subcomando.
+
+Apenas o módulo do subcomando é importado, de modo que a inicialização não paga a importação
+das dependências dos demais (ex.: ocr-table convert não carrega o albumentations nem o pandas).
+
+Uso:
+    ocr-table --help
+    ocr-table convert ctdar coco dataset/training/TRACKB1/ground_truth dataset_coco/train.json
+    ocr-table pipeline Pipeline/configs/icdar_folds.yaml
+    python -m CLI benchmark imports
+'''
+
+import sys
+import importlib
+from typing import Iterable
+
+
+# subcomando -> (módulo com main(), descrição)
+COMMANDS = {
+    'pipeline': ('Pipeline.__main__', 'executa um pipeline de geração de dados descrito em YAML'),
+    'convert': ('DataExtractor.conversion_hub', 'converte anotações entre cTDaR, VOC, YOLO, COCO e colunar'),
+    'ingest': ('DataExtractor.ingest_watcher', 'ingestão incremental dos pares imagem/XML novos de um diretório'),
+    'validate': ('DataExtractor.annotation_validator', 'valida (e corrige) os XMLs de anotação'),
+    'simplify': ('DataExtractor.polygon_simplification', 'simplifica os polígonos das células'),
+    'image-cache': ('DataExtractor.image_cache', 'cache de imagens pré-decodificadas'),
+    'label-cache': ('DataExtractor.label_cache', 'cache binário dos rótulos YOLO'),
+    'dedup': ('DataSplitter.dedup', 'detecção de quase duplicatas por hash perceptual'),
+    'geometric': ('DataAugmentation.geometric', 'variantes geométricas das páginas com rótulos transformados'),
+    'encode': ('DataAugmentation.image_encoding', 'recodificação das imagens'),
+    'shards': ('DataArchive.shards', 'empacotamento dos folds em shards tar'),
+    'synthetic': ('DataGenerator.synthetic_corpus', 'geração de corpora sintéticos'),
+    'tiled': ('Inference.tiled', 'inferência por tiles'),
+    'ctdar-export': ('Inference.ctdar_export', 'converte predições (máscaras ou caixas) em XMLs cTDaR'),
+    'serve': ('Inference.server', 'servidor HTTP de inferência'),
+    'export-benchmark': ('Inference.export_benchmark', 'benchmark dos formatos exportados'),
+    'benchmark': ('Benchmark.benchmark', 'benchmarks do ETL e orçamentos de importação'),
+    'trace': ('Instrumentation.spans', 'exportação dos spans de instrumentação'),
+}
+
+
+def print_usage(file = sys.stdout):
+    print('uso: ocr-table <comando> [argumentos]\n\ncomandos:', file=file)
+    for command, (_, description) in COMMANDS.items():
+        print(f'  {command:<18} {description}', file=file)
+    print('\nocr-table <comando> --help exibe os argumentos de cada comando.', file=file)
+
+
+def main(argv : Iterable[str] = None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage(sys.stdout if argv else sys.stderr)
+        return 0 if argv else 2
+
+    command, arguments = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f'ocr-table: comando desconhecido: {command}\n', file=sys.stderr)
+        print_usage(sys.stderr)
+        return 2
+
+    module = importlib.import_module(COMMANDS[command][0])
+
+    # os main() dos módulos leem os argumentos de sys.argv
+    sys.argv = [f'ocr-table {command}', *arguments]
+    result = module.main()
+
+    return result if isinstance(result, int) else 0
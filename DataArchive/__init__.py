@@ -0,0 +1,11 @@
+'''
+Empacotamento dos folds em shards tar indexados.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'shards': ['ShardSample', 'ShardExporter', 'ShardReader', 'ShardUnpacker'],
+})
@@ -0,0 +1,361 @@
+'''
+Empacotamento de um fold (imagens, rótulos, dataset.yaml) em shards tar de tamanho fixo com índice.
+
+Transferir o dataset como poucos arquivos grandes evita o custo por arquivo do shutil.copytree
+entre o Drive e a VM. Cada amostra (imagem e rótulo com o mesmo nome) fica inteira em um único
+shard, com os arquivos adjacentes, e o index.json guarda o deslocamento e o tamanho de cada arquivo
+dentro do shard, permitindo leitura aleatória sem percorrer o tar.
+
+Estrutura gerada:
+    archives/fold_1/
+        index.json
+        shard_000000.tar
+        shard_000001.tar
+        ...
+
+Uso:
+    python -m DataArchive.shards pack dataset_folds/fold_1 archives/fold_1 --shard-size 256
+    python -m DataArchive.shards unpack archives/fold_1 /content/dataset/fold_1 --workers 8
+    python -m DataArchive.shards info archives/fold_1
+'''
+
+import io
+import os
+import json
+import tarfile
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List
+from tqdm import tqdm
+
+from Instrumentation.spans import instrumented, add_bytes_read, add_bytes_written, is_enabled
+
+
+INDEX_FILE_NAME = 'index.json'
+INDEX_VERSION = 1
+SAMPLE_DIRS = ('images', 'labels')
+
+
+@dataclass
+class ShardSample:
+    '''
+    key é o caminho relativo da amostra sem o diretório images/labels e sem extensão (ex.: train/cTDaR_t10001).
+    files mapeia o nome do arquivo dentro do tar (ex.: train/images/cTDaR_t10001.jpg) para o caminho em disco.
+    '''
+    key : str
+    files : Dict[str, Path] = field(default_factory=dict)
+
+    def get_size(self):
+        return sum(os.path.getsize(path) for path in self.files.values())
+
+
+class ShardExporter:
+
+    @staticmethod
+    def find_samples(fold_path : str | Path):
+        '''
+        Agrupa os arquivos do fold em amostras (imagem e rótulo com o mesmo nome em
+        <split>/images e <split>/labels) e arquivos avulsos (dataset.yaml, dataset.csv, caches).
+        '''
+        fold_path = Path(fold_path)
+        samples, extra_files = {}, {}
+
+        for dir_path, _, file_names in os.walk(fold_path):
+            relative_dir = Path(dir_path).relative_to(fold_path)
+            for file_name in sorted(file_names):
+                path = Path(dir_path)/file_name
+                name = (relative_dir/file_name).as_posix()
+
+                if relative_dir.name in SAMPLE_DIRS:
+                    key = (relative_dir.parent/Path(file_name).stem).as_posix()
+                    samples.setdefault(key, ShardSample(key)).files[name] = path
+                else:
+                    extra_files[name] = path
+
+        return [samples[key] for key in sorted(samples)], extra_files
+
+    @staticmethod
+    def plan_shards(samples : List[ShardSample], max_shard_bytes : int):
+        '''
+        Distribui as amostras, em ordem, em shards de até max_shard_bytes (uma amostra maior que o
+        limite ocupa um shard sozinha).
+        '''
+        shards, current_shard, current_size = [], [], 0
+        for sample in samples:
+            sample_size = sample.get_size()
+            if current_shard and current_size + sample_size > max_shard_bytes:
+                shards.append(current_shard)
+                current_shard, current_size = [], 0
+            current_shard.append(sample)
+            current_size += sample_size
+
+        if current_shard:
+            shards.append(current_shard)
+
+        return shards
+
+    @staticmethod
+    def add_file(tar : tarfile.TarFile, name : str, path : Path):
+        '''
+        Adiciona o arquivo ao tar e retorna [deslocamento do conteúdo no shard, tamanho].
+        '''
+        tar_info = tar.gettarinfo(path, arcname=name)
+        offset_data = tar.offset + len(tar_info.tobuf(tar.format, tar.encoding, tar.errors))
+        with open(path, 'rb') as file:
+            tar.addfile(tar_info, file)
+        return [offset_data, tar_info.size]
+
+    @staticmethod
+    def write_shard(shard_path : Path, samples : List[ShardSample], extra_files : Dict[str, Path] = None):
+        '''
+        Escreve um shard e retorna as entradas do índice: {nome: [deslocamento, tamanho]} por amostra
+        e para os arquivos avulsos.
+        '''
+        sample_entries, extra_entries = [], {}
+
+        # dereference grava os hard links e os links simbólicos como arquivos regulares: o índice
+        # aponta para o conteúdo de cada arquivo, que não existe em uma entrada de link
+        with tarfile.open(shard_path, 'w', dereference=True) as tar:
+            for name, path in (extra_files or {}).items():
+                extra_entries[name] = ShardExporter.add_file(tar, name, path)
+
+            for sample in samples:
+                files = {}
+                for name, path in sample.files.items():
+                    files[name] = ShardExporter.add_file(tar, name, path)
+                sample_entries.append({'key': sample.key, 'files': files})
+
+        if is_enabled():
+            add_bytes_written(os.path.getsize(shard_path))
+
+        return sample_entries, extra_entries
+
+    @staticmethod
+    @instrumented('shards.ShardExporter.export')
+    def export(fold_path : str | Path,
+               output_dir : str | Path,
+               max_shard_bytes : int = 256 * 2**20,
+               workers : int = 4):
+        '''
+        Empacota o fold em shards de até max_shard_bytes, escritos em paralelo. Os arquivos avulsos
+        (dataset.yaml etc.) vão no primeiro shard.
+        '''
+        output_dir = Path(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        samples, extra_files = ShardExporter.find_samples(fold_path)
+        shards = ShardExporter.plan_shards(samples, max_shard_bytes) or [[]]
+        shard_names = [f'shard_{index:06d}.tar' for index in range(len(shards))]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(ShardExporter.write_shard, output_dir/shard_name, shard_samples,
+                                       extra_files if index == 0 else None)
+                       for index, (shard_name, shard_samples) in enumerate(zip(shard_names, shards))]
+            results = [future.result() for future in tqdm(futures, desc=f'Empacotando {fold_path}')]
+
+        index = {'version': INDEX_VERSION, 'shards': shard_names, 'extra_files': {}, 'samples': []}
+        for shard_id, (sample_entries, extra_entries) in enumerate(results):
+            index['extra_files'].update({name: [shard_id, *entry] for name, entry in extra_entries.items()})
+            index['samples'].extend({'key': entry['key'], 'shard': shard_id, 'files': entry['files']}
+                                    for entry in sample_entries)
+
+        with open(output_dir/INDEX_FILE_NAME, 'w') as file:
+            json.dump(index, file)
+
+        print(f'\n{len(samples)} amostras empacotadas em {len(shard_names)} shards em: {output_dir}')
+        return output_dir
+
+
+class ShardReader:
+    '''
+    Lê as amostras dos shards sequencialmente (iterate) ou por índice (reader[i]). A leitura por
+    índice usa os deslocamentos do index.json com os.pread e pode ser feita por várias threads.
+    '''
+
+    def __init__(self, archive_dir : str | Path):
+        self.archive_dir = Path(archive_dir)
+        with open(self.archive_dir/INDEX_FILE_NAME, 'r') as file:
+            self.index = json.load(file)
+
+        self.samples = self.index['samples']
+        self.keys = {sample['key']: position for position, sample in enumerate(self.samples)}
+        self.file_descriptors = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def get_file_descriptor(self, shard_id : int):
+        with self.lock:
+            if shard_id not in self.file_descriptors:
+                self.file_descriptors[shard_id] = os.open(self.archive_dir/self.index['shards'][shard_id], os.O_RDONLY)
+            return self.file_descriptors[shard_id]
+
+    def read_file(self, shard_id : int, offset : int, size : int):
+        content = os.pread(self.get_file_descriptor(shard_id), size, offset)
+        if is_enabled():
+            add_bytes_read(len(content))
+        return content
+
+    def __getitem__(self, position : int | str):
+        '''
+        Retorna {'key': ..., nome do arquivo: bytes, ...}. Aceita a posição ou a key da amostra.
+        '''
+        if isinstance(position, str):
+            position = self.keys[position]
+
+        sample = self.samples[position]
+        content = {'key': sample['key']}
+        for name, (offset, size) in sample['files'].items():
+            content[name] = self.read_file(sample['shard'], offset, size)
+
+        return content
+
+    def read_extra_file(self, name : str):
+        shard_id, offset, size = self.index['extra_files'][name]
+        return self.read_file(shard_id, offset, size)
+
+    def iterate(self, split : str = None):
+        '''
+        Percorre os shards em ordem, em leitura sequencial, agrupando os arquivos de cada amostra.
+        '''
+        for shard_name in self.index['shards']:
+            with tarfile.open(self.archive_dir/shard_name, 'r|') as tar:
+                current = None
+                for tar_info in tar:
+                    directory, file_name = os.path.split(tar_info.name)
+                    if os.path.basename(directory) not in SAMPLE_DIRS:
+                        continue
+
+                    key = f'{os.path.dirname(directory)}/{os.path.splitext(file_name)[0]}'.lstrip('/')
+                    if current is not None and current['key'] != key:
+                        yield current
+                        current = None
+                    if split is not None and not key.startswith(f'{split}/'):
+                        continue
+
+                    content = tar.extractfile(tar_info).read()
+                    if is_enabled():
+                        add_bytes_read(len(content))
+                    current = current or {'key': key}
+                    current[tar_info.name] = content
+
+                if current is not None:
+                    yield current
+
+    def __iter__(self):
+        return self.iterate()
+
+    @staticmethod
+    def decode_image(content : bytes):
+        from PIL import Image
+        image = Image.open(io.BytesIO(content))
+        image.load()
+        return image
+
+    @staticmethod
+    def decode_label(content : bytes):
+        return [line.split() for line in content.decode().splitlines() if line.strip()]
+
+    def close(self):
+        with self.lock:
+            for file_descriptor in self.file_descriptors.values():
+                os.close(file_descriptor)
+            self.file_descriptors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ShardUnpacker:
+
+    @staticmethod
+    def extract_shard(shard_path : Path, output_dir : Path):
+        with tarfile.open(shard_path, 'r') as tar:
+            tar.extractall(output_dir, filter='data')
+        return os.path.getsize(shard_path)
+
+    @staticmethod
+    def rewrite_yaml_path(yaml_path : Path, dataset_path : Path):
+        '''
+        Atualiza a chave path do dataset.yaml para o novo local do fold.
+        '''
+        lines = yaml_path.read_text().splitlines(keepends=True)
+        lines = [f'path: {dataset_path.resolve().as_posix()}/\n' if line.startswith('path:') else line for line in lines]
+        yaml_path.write_text(''.join(lines))
+
+    @staticmethod
+    @instrumented('shards.ShardUnpacker.unpack')
+    def unpack(archive_dir : str | Path, output_dir : str | Path, workers : int = 8, rewrite_yaml : bool = True):
+        '''
+        Restaura o layout da Ultralytics (<split>/images, <split>/labels, dataset.yaml) extraindo os
+        shards em paralelo.
+        '''
+        archive_dir, output_dir = Path(archive_dir), Path(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(archive_dir/INDEX_FILE_NAME, 'r') as file:
+            shard_names = json.load(file)['shards']
+
+        total_bytes = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(ShardUnpacker.extract_shard, archive_dir/shard_name, output_dir)
+                       for shard_name in shard_names]
+            for future in tqdm(futures, desc=f'Desempacotando {archive_dir}'):
+                total_bytes += future.result()
+
+        if is_enabled():
+            add_bytes_read(total_bytes)
+
+        yaml_path = output_dir/'dataset.yaml'
+        if rewrite_yaml and yaml_path.exists():
+            ShardUnpacker.rewrite_yaml_path(yaml_path, output_dir)
+
+        print(f'\n{len(shard_names)} shards ({total_bytes / 2**20:.1f} MB) extraídos em: {output_dir}')
+        return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Empacotamento de folds em shards tar.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack')
+    pack_parser.add_argument('fold_path')
+    pack_parser.add_argument('output_dir')
+    pack_parser.add_argument('--shard-size', type=int, default=256, help='tamanho máximo de cada shard em MB')
+    pack_parser.add_argument('--workers', type=int, default=4)
+
+    unpack_parser = subparsers.add_parser('unpack')
+    unpack_parser.add_argument('archive_dir')
+    unpack_parser.add_argument('output_dir')
+    unpack_parser.add_argument('--workers', type=int, default=8)
+    unpack_parser.add_argument('--keep-yaml-path', action='store_true', help='não atualiza a chave path do dataset.yaml')
+
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('archive_dir')
+
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        ShardExporter.export(args.fold_path, args.output_dir, args.shard_size * 2**20, args.workers)
+    elif args.command == 'unpack':
+        ShardUnpacker.unpack(args.archive_dir, args.output_dir, args.workers, rewrite_yaml=not args.keep_yaml_path)
+    else:
+        with ShardReader(args.archive_dir) as reader:
+            splits = {}
+            for sample in reader.samples:
+                split = sample['key'].split('/')[0]
+                splits[split] = splits.get(split, 0) + 1
+            print(f'Shards: {len(reader.index["shards"])}')
+            print(f'Amostras: {len(reader)} {splits}')
+            print(f'Arquivos avulsos: {sorted(reader.index["extra_files"])}')
+
+
+if __name__ == '__main__':
+    main()
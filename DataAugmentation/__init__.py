@@ -0,0 +1,15 @@
+'''
+Aumento de dados e codificação das imagens.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports);
+o albumentations só é carregado quando uma transformação é construída.
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'augmentation': ['Augmentation'],
+    'augmented_dataset': ['AugmentedDataset', 'AugmentedLoader', 'AugmentedYOLODataset', 'build_augmented_trainer'],
+    'geometric': ['GeometricOptions', 'GeometricTransform', 'augment_files'],
+    'image_encoding': ['EncodingOptions', 'ImageEncoder', 'reencode_tree'],
+})
@@ -1,10 +1,18 @@
 import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
-import albumentations as A
 
+import os
 import shutil
 from pathlib import Path 
-from typing import Iterable, Tuple, Any
+from typing import Iterable, Tuple, Any, TYPE_CHECKING
+
+from Instrumentation.spans import instrumented, add_bytes_written, is_enabled
+from .image_encoding import EncodingOptions, ImageEncoder, is_single_channel, convert_grayscale
+
+# o albumentations (e, com ele, o torch e o cv2) só é usado como tipo: as transformações são
+# construídas por quem as aplica (ex.: Pipeline.stages.build_albumentations_transforms)
+if TYPE_CHECKING:
+    import albumentations as A
 
 class Augmentation: 
 
@@ -18,6 +26,50 @@ class Augmentation:
         return isinstance(image, np.ndarray)
     
     @staticmethod
+    def is_grayscale(image : Image.Image | np.ndarray, **kwargs):
+        '''
+        Verifica se a imagem tem, na prática, um único canal (ver image_encoding.is_single_channel).
+        '''
+        return is_single_channel(image, **kwargs)
+
+    @staticmethod
+    def load_image(image_path : str | Path, image_cache : Any = None, grayscale : bool | str = False):
+        '''
+        Retorna a visão pré-decodificada da imagem quando ela está no image_cache 
+        (DataExtractor.image_cache.ImageCache) e, caso contrário, decodifica o arquivo.
+        Com grayscale 'auto', as imagens cinzas na prática são devolvidas em L (um canal, 2D como
+        array) e as demais operações as processam assim; com True, todas são convertidas. Com
+        grayscale False, as páginas de um cache em L são devolvidas em RGB, como nos arquivos.
+        '''
+
+        if image_cache is not None and image_path in image_cache:
+            image = image_cache[image_path]
+            if not grayscale and image.ndim == 2:
+                return Augmentation.expand_channels(image)
+            return convert_grayscale(image, grayscale)
+
+        with Image.open(image_path) as image:
+            image.load()
+
+        return convert_grayscale(image, grayscale)
+
+    @staticmethod
+    def expand_channels(image : Image.Image | np.ndarray):
+        '''
+        Array (altura, largura, 3) para a entrada do modelo: as imagens de um canal só são
+        replicadas nos três canais neste ponto. Imagens RGB são devolvidas sem cópia.
+        '''
+        if Augmentation.is_pil_image(image):
+            image = np.asarray(image if image.mode in ('RGB', 'L') else image.convert('RGB'))
+
+        if image.ndim == 3 and image.shape[-1] >= 3:
+            return image[..., :3]
+
+        image = image.reshape(image.shape[:2])
+        return np.repeat(image[..., None], 3, axis=2)
+    
+    @staticmethod
+    @instrumented('augmentation.add_salt_and_pepper_noise')
     def add_salt_and_pepper_noise(image : Image.Image | np.ndarray, 
                                   amount_percentage : float = 0.05, 
                                   salt_vs_pepper_percentage : float =0.5,
@@ -52,6 +104,7 @@ class Augmentation:
 
 
     @staticmethod
+    @instrumented('augmentation.add_gaussian_blur')
     def add_gaussian_blur(image : Image.Image | np.ndarray, 
                           amount : int = 3,
                           return_ndarray = False,
@@ -69,6 +122,7 @@ class Augmentation:
         return new_image
     
     @staticmethod
+    @instrumented('augmentation.set_brightness')
     def set_brightness(image : Image.Image | np.ndarray, 
                        factor : float = 1.5,
                        return_ndarray = False,
@@ -127,6 +181,7 @@ class Augmentation:
     
     
     @staticmethod
+    @instrumented('augmentation.resize_image')
     def resize_image(image : Image.Image | np.ndarray,
                  new_width : int,
                  new_height: int,
@@ -155,8 +210,9 @@ class Augmentation:
     
     
     @staticmethod
+    @instrumented('augmentation.apply_albumentation_tranform')
     def apply_albumentation_tranform(image : Image.Image | np.ndarray, 
-                                     transform : A.BasicTransform, 
+                                     transform : 'A.BasicTransform', 
                                      **kwargs) -> dict:
         
         if Augmentation.is_pil_image(image):
@@ -168,9 +224,27 @@ class Augmentation:
 
 
     @staticmethod
-    def save_image(image : Image.Image | np.ndarray, path : str | Path):
-        
-        if Augmentation.is_ndarray(image):
-            image = Image.fromarray(image)
+    @instrumented('augmentation.save_image')
+    def save_image(image : Image.Image | np.ndarray, path : str | Path, options : EncodingOptions = None):
+        '''
+        Sem options, grava com os parâmetros padrão do Pillow para a extensão do arquivo.
+        '''
         
-        image.save(path)
\ No newline at end of file
+        bytes_written = ImageEncoder.save(image, path, options)
+
+        if is_enabled():
+            add_bytes_written(bytes_written)
+
+
+    @staticmethod
+    @instrumented('augmentation.save_images', items=lambda images_written: images_written)
+    def save_images(images : Iterable[Tuple[Image.Image | np.ndarray, str | Path]], 
+                    options : EncodingOptions = None, 
+                    workers : int = None,
+                    use_processes : bool = False):
+        '''
+        Codifica e grava os pares (imagem, caminho) em paralelo, retornando a quantidade de imagens gravadas.
+        '''
+
+        with ImageEncoder(options, workers=workers, use_processes=use_processes) as encoder:
+            return encoder.save_many(images)
\ No newline at end of file
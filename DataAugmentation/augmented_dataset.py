@@ -0,0 +1,328 @@
+'''
+Aumento de dados em tempo de carregamento, sem materializar as cópias _var_N em disco.
+
+Cada imagem base gera len(transforms) variantes (mais a original, por padrão). A transformação
+da variante v da imagem i na época e é semeada por (seed, i, e, v), portanto o resultado é
+determinístico e reprodutível, mas muda de uma época para outra.
+
+Uso com a Ultralytics:
+
+    from ultralytics.models.yolo.segment import SegmentationTrainer
+    trainer = build_augmented_trainer(SegmentationTrainer, transforms=[A.GaussianBlur(p=1.0, blur_limit=(2, 3))])
+    model.train(data='dataset_folds/fold_1/dataset.yaml', trainer=trainer, cache='ram')
+
+Uso independente (ex.: inspeção ou outros frameworks):
+
+    dataset = AugmentedDataset(image_paths, label_paths, transforms)
+    for batch in AugmentedLoader(dataset, batch_size=32, num_workers=8).iterate_epoch(epoch):
+        ...
+'''
+
+import os
+import random
+import multiprocessing
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from collections import OrderedDict
+from typing import Iterable, Tuple, Any
+
+from .augmentation import Augmentation
+from .image_encoding import SINGLE_CHANNEL_MODES, convert_grayscale
+
+
+def get_variant_seed(seed : int, image_index : int, epoch : int, variant : int):
+    return int(np.random.SeedSequence([seed, image_index, epoch, variant]).generate_state(1)[0])
+
+
+def apply_seeded_transform(image : np.ndarray, transform : Any, seed : int):
+    '''
+    Aplica uma transformação do albumentations de forma determinística.
+    '''
+    if hasattr(transform, 'set_random_seed'):
+        transform.set_random_seed(seed)
+    else:
+        # versões antigas do albumentations utilizam os geradores globais
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+
+    return Augmentation.apply_albumentation_tranform(image, transform)['image']
+
+
+def read_yolo_label(label_path : str | Path):
+    '''
+    Lê um rótulo YOLO (detecção ou segmentação), retornando os class_ids e os pontos normalizados de cada linha.
+    '''
+    class_ids, points = [], []
+    if label_path is None or not os.path.exists(label_path):
+        return class_ids, points
+
+    with open(label_path, 'r') as file:
+        for line in file:
+            values = line.split()
+            if not values:
+                continue
+            class_ids.append(int(values[0]))
+            points.append(np.array(values[1:], dtype=np.float32).reshape(-1, 2))
+
+    return class_ids, points
+
+
+class AugmentedDataset:
+
+    def __init__(self,
+                 image_paths : Iterable[str | Path],
+                 label_paths : Iterable[str | Path] = None,
+                 transforms : Iterable[Any] = (),
+                 seed : int = 42,
+                 include_original : bool = True,
+                 cache_size : int = 256,
+                 image_cache_path : str | Path = None,
+                 grayscale : bool | str = False,
+                 expand_channels : bool = True):
+        '''
+        cache_size define quantas imagens base decodificadas são mantidas em memória (LRU) por processo.
+        Com image_cache_path (DataExtractor.image_cache), as imagens base são lidas do cache mapeado
+        em memória, sem decodificação e sem ocupar o LRU. Com grayscale 'auto' (ou True), as imagens
+        cinzas são decodificadas, mantidas no LRU e transformadas com um canal; expand_channels as
+        replica nos três canais apenas no item entregue ao modelo.
+        '''
+
+        self.image_paths = [str(path) for path in image_paths]
+        self.label_paths = [str(path) for path in label_paths] if label_paths is not None else [None] * len(self.image_paths)
+        self.transforms = list(transforms)
+        self.seed = seed
+        self.include_original = include_original
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.epoch = 0
+        self.image_cache_path = image_cache_path
+        self.image_cache = None
+        self.grayscale = grayscale
+        self.expand_channels = expand_channels
+
+    def __getstate__(self):
+        # o cache mapeado é reaberto em cada processo, em vez de ter o conteúdo serializado
+        state = self.__dict__.copy()
+        state['image_cache'] = None
+        return state
+
+    def get_image_cache(self):
+        if self.image_cache is None and self.image_cache_path is not None:
+            from DataExtractor.image_cache import ImageCache
+            self.image_cache = ImageCache(self.image_cache_path)
+        return self.image_cache
+
+    @property
+    def n_variants(self):
+        return len(self.transforms) + int(self.include_original)
+
+    def __len__(self):
+        return len(self.image_paths) * self.n_variants
+
+    def set_epoch(self, epoch : int):
+        self.epoch = epoch
+
+    def get_base_image(self, image_index : int):
+
+        image_cache = self.get_image_cache()
+        if image_cache is not None and self.image_paths[image_index] in image_cache:
+            return image_cache[self.image_paths[image_index]]
+
+        if image_index in self.cache:
+            self.cache.move_to_end(image_index)
+            return self.cache[image_index]
+
+        with Image.open(self.image_paths[image_index]) as image:
+            image = image.convert('L' if image.mode in SINGLE_CHANNEL_MODES and self.grayscale else 'RGB')
+            image = np.asarray(convert_grayscale(image, self.grayscale))
+
+        self.cache[image_index] = image
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return image
+
+    def get_item(self, index : int, epoch : int = None):
+
+        epoch = self.epoch if epoch is None else epoch
+        image_index, variant = divmod(index, self.n_variants)
+        image = self.get_base_image(image_index)
+
+        transform_index = variant - int(self.include_original)
+        if transform_index >= 0:
+            seed = get_variant_seed(self.seed, image_index, epoch, variant)
+            image = apply_seeded_transform(image, self.transforms[transform_index], seed)
+
+        class_ids, points = read_yolo_label(self.label_paths[image_index])
+
+        return {
+            'image': Augmentation.expand_channels(image) if self.expand_channels else image,
+            'class_ids': class_ids,
+            'points': points,
+            'image_path': self.image_paths[image_index],
+            'label_path': self.label_paths[image_index],
+            'variant': variant,
+            'epoch': epoch
+        }
+
+    def __getitem__(self, index : int):
+        return self.get_item(index)
+
+
+# dataset de cada processo trabalhador do AugmentedLoader (com o seu próprio cache)
+_worker_dataset = None
+
+
+def _initialize_worker(dataset : AugmentedDataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _load_item(task : Tuple[int, int]):
+    index, epoch = task
+    return _worker_dataset.get_item(index, epoch)
+
+
+class AugmentedLoader:
+    '''
+    Carrega os itens de um AugmentedDataset em lotes utilizando processos trabalhadores persistentes.
+    '''
+
+    def __init__(self,
+                 dataset : AugmentedDataset,
+                 batch_size : int = 32,
+                 num_workers : int = None,
+                 shuffle : bool = True,
+                 chunk_size : int = 8):
+
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+        self.pool = None
+
+    def get_indices(self, epoch : int):
+        indices = np.arange(len(self.dataset))
+        if self.shuffle:
+            indices = np.random.default_rng([self.dataset.seed, epoch]).permutation(indices)
+        return indices.tolist()
+
+    def iterate_epoch(self, epoch : int):
+
+        tasks = [(index, epoch) for index in self.get_indices(epoch)]
+
+        if self.num_workers <= 0:
+            items = (self.dataset.get_item(index, epoch) for index, epoch in tasks)
+        else:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.num_workers, initializer=_initialize_worker, initargs=(self.dataset,))
+            items = self.pool.imap(_load_item, tasks, chunksize=self.chunk_size)
+
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ---------------------------------------------------------------------------------------
+# Integração com a Ultralytics
+# ---------------------------------------------------------------------------------------
+
+class AugmentedYOLODataset:
+    '''
+    Envolve um YOLODataset da Ultralytics expondo len(transforms) variantes de cada imagem.
+    As transformações fotométricas são aplicadas sobre a imagem já carregada (e, com cache='ram',
+    já decodificada) antes das transformações da própria Ultralytics. Os demais atributos são
+    repassados ao dataset original.
+
+    A época é compartilhada com os processos do DataLoader por memória compartilhada. Como o
+    DataLoader da Ultralytics antecipa alguns lotes, os primeiros itens de uma época podem ser
+    gerados com a semente da época anterior.
+    '''
+
+    def __init__(self, dataset : Any, transforms : Iterable[Any], seed : int = 42, include_original : bool = True):
+        self.dataset = dataset
+        self.augmentation_transforms = list(transforms)
+        self.seed = seed
+        self.include_original = include_original
+        self.shared_epoch = multiprocessing.Value('i', 0)
+
+    def __getattr__(self, name : str):
+        # evita recursão durante a desserialização, quando dataset ainda não foi atribuído
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    @property
+    def n_variants(self):
+        return len(self.augmentation_transforms) + int(self.include_original)
+
+    def set_epoch(self, epoch : int):
+        self.shared_epoch.value = epoch
+
+    def __len__(self):
+        return len(self.dataset) * self.n_variants
+
+    def __getitem__(self, index : int):
+        image_index, variant = divmod(index, self.n_variants)
+        label = self.dataset.get_image_and_label(image_index)
+
+        transform_index = variant - int(self.include_original)
+        if transform_index >= 0:
+            seed = get_variant_seed(self.seed, image_index, self.shared_epoch.value, variant)
+            label['img'] = apply_seeded_transform(label['img'], self.augmentation_transforms[transform_index], seed)
+
+        return self.dataset.transforms(label)
+
+
+def _synchronize_epoch(trainer):
+    dataset = trainer.train_loader.dataset
+    if isinstance(dataset, AugmentedYOLODataset):
+        dataset.set_epoch(trainer.epoch)
+
+
+def build_augmented_trainer(trainer_class : type,
+                            transforms : Iterable[Any],
+                            seed : int = 42,
+                            include_original : bool = True):
+    '''
+    Cria uma subclasse do trainer da Ultralytics (DetectionTrainer, SegmentationTrainer, ...) cujo
+    dataset de treino gera as variantes em memória. Deve ser passada em model.train(trainer=...).
+    '''
+    transforms = list(transforms)
+
+    class AugmentedTrainer(trainer_class):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.add_callback('on_train_epoch_start', _synchronize_epoch)
+
+        def build_dataset(self, img_path, mode = 'train', batch = None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            if mode != 'train':
+                return dataset
+            return AugmentedYOLODataset(dataset, transforms, seed, include_original)
+
+    AugmentedTrainer.__name__ = f'Augmented{trainer_class.__name__}'
+    AugmentedTrainer.__qualname__ = AugmentedTrainer.__name__
+
+    return AugmentedTrainer
@@ -0,0 +1,314 @@
+'''
+Aumento de dados geométrico com transformação vetorizada dos rótulos.
+
+Cada variante de uma página é descrita por uma única matriz 3x3 (afim ou homografia) composta por
+rotação, escala e cisalhamento em torno do centro, perspectiva e recorte. A imagem é reamostrada
+uma vez (cv2.warpPerspective) e os polígonos de todas as páginas de um lote, empacotados como em
+PolygonSimplifier (pontos (n, 2) e contagem de pontos por polígono), são transformados por uma
+única multiplicação matricial em coordenadas homogêneas. Em seguida, também de forma vetorizada:
+
+    - os pontos são limitados à imagem (como na Ultralytics, sem recorte exato das arestas);
+    - são descartados os polígonos degenerados (área menor que min_area pixels²) e os que ficaram
+      majoritariamente fora da imagem (área visível menor que min_visibility da área transformada).
+
+As caixas dos rótulos de detecção (linhas com 4 valores) são transformadas pelos quatro cantos e
+voltam a ser a caixa envolvente do resultado.
+
+Uso:
+    python -m DataAugmentation.geometric dataset_completo/train --variants 2 --rotation 2 --perspective 0.00005 --crop 0.05
+'''
+
+import os
+import zlib
+import argparse
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
+
+from .augmentation import Augmentation
+from .image_encoding import EncodingOptions
+from Instrumentation.spans import instrumented
+
+
+@dataclass(frozen=True)
+class GeometricOptions:
+    '''
+    rotation e shear em graus (sorteados em ±valor), scale como (mínimo, máximo), perspective como
+    a magnitude dos termos projetivos por pixel (ex.: 0.00005) e crop como a fração máxima removida
+    de cada borda antes de a região ser ampliada de volta ao tamanho da página. fill é o valor das
+    áreas descobertas (branco, o fundo dos documentos).
+    '''
+    rotation : float = 2.0
+    scale : Tuple[float, float] = (0.95, 1.05)
+    shear : float = 1.0
+    perspective : float = 0.0
+    crop : float = 0.0
+    fill : int = 255
+    min_area : float = 4.0
+    min_visibility : float = 0.5
+
+
+class GeometricTransform:
+
+    @staticmethod
+    def sample_matrix(width : int, height : int, options : GeometricOptions, random_generator : np.random.Generator):
+        '''
+        Homografia 3x3 de uma variante da página de dimensões (width, height).
+        '''
+        center = np.array([[1, 0, -width / 2], [0, 1, -height / 2], [0, 0, 1]], dtype=np.float64)
+
+        angle = np.radians(random_generator.uniform(-options.rotation, options.rotation))
+        scale = random_generator.uniform(*options.scale)
+        rotation = np.array([[scale * np.cos(angle), -scale * np.sin(angle), 0],
+                             [scale * np.sin(angle), scale * np.cos(angle), 0],
+                             [0, 0, 1]])
+
+        shear_x, shear_y = np.tan(np.radians(random_generator.uniform(-options.shear, options.shear, size=2)))
+        shear = np.array([[1, shear_x, 0], [shear_y, 1, 0], [0, 0, 1]])
+
+        perspective_x, perspective_y = random_generator.uniform(-options.perspective, options.perspective, size=2)
+        perspective = np.array([[1, 0, 0], [0, 1, 0], [perspective_x, perspective_y, 1]])
+
+        uncenter = np.array([[1, 0, width / 2], [0, 1, height / 2], [0, 0, 1]], dtype=np.float64)
+
+        # recorte: uma janela com cada borda reduzida em até crop da dimensão é ampliada para a página
+        left, top, right, bottom = random_generator.uniform(0, options.crop, size=4) * [width, height, width, height]
+        crop = np.array([[width / (width - left - right), 0, 0], [0, height / (height - top - bottom), 0], [0, 0, 1]]) \
+               @ np.array([[1, 0, -left], [0, 1, -top], [0, 0, 1]])
+
+        return crop @ uncenter @ perspective @ shear @ rotation @ center
+
+    @staticmethod
+    def transform_points(points : np.ndarray, matrices : np.ndarray, page_ids : np.ndarray = None):
+        '''
+        Aplica as homografias aos pontos (n, 2). Com page_ids, matrices é (páginas, 3, 3) e cada ponto
+        usa a matriz da sua página; todos os pontos do lote são transformados em uma única operação.
+        '''
+        homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+        if page_ids is None:
+            transformed = homogeneous @ matrices.T
+        else:
+            transformed = np.einsum('nij,nj->ni', matrices[page_ids], homogeneous)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return transformed[:, :2] / transformed[:, 2:]
+
+    @staticmethod
+    def clip_polygons(points : np.ndarray, counts : np.ndarray, sizes : np.ndarray, page_ids : np.ndarray,
+                      min_area : float = 4.0, min_visibility : float = 0.5):
+        '''
+        Limita os pontos às dimensões da página de cada um (sizes é (páginas, 2)) e retorna
+        (pontos, contagens, máscara dos polígonos mantidos).
+        '''
+        from DataExtractor.polygon_simplification import PolygonSimplifier
+
+        next_indices = PolygonSimplifier.get_next_indices(counts)
+        polygon_ids = np.repeat(np.arange(len(counts)), counts)
+
+        finite = np.isfinite(points).all(axis=1)
+        finite_polygons = np.bincount(polygon_ids, weights=~finite, minlength=len(counts)) == 0
+        points = np.where(finite[:, None], points, 0.0)
+
+        areas = PolygonSimplifier.polygon_areas(points, counts, next_indices)
+        clipped = np.clip(points, 0, sizes[page_ids])
+        clipped_areas = PolygonSimplifier.polygon_areas(clipped, counts, next_indices)
+
+        keep = finite_polygons & (counts >= 3) & (clipped_areas >= min_area) & \
+               (clipped_areas >= min_visibility * np.maximum(areas, 1e-12))
+
+        return clipped[np.repeat(keep, counts)], counts[keep], keep
+
+    @staticmethod
+    @instrumented('geometric.GeometricTransform.transform_labels', items=len)
+    def transform_labels(labels : List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                         matrices : np.ndarray,
+                         sizes : np.ndarray,
+                         options : GeometricOptions):
+        '''
+        Transforma os rótulos YOLO de várias páginas de uma vez. Cada rótulo é (classes, contagens,
+        pontos normalizados), como em conversion_hub.read_yolo_file (caixas como dois cantos), e
+        sizes é (páginas, 2) com largura e altura. Retorna, por página, (classes, polígonos ou caixas
+        (xcentral, ycentral), (largura, altura) normalizados, polígonos em pixels inteiros).
+        '''
+        from DataExtractor.conversion_hub import make_document
+
+        n_pages = len(labels)
+        object_page_ids = np.repeat(np.arange(n_pages), [len(counts) for _, counts, _ in labels])
+        if not len(object_page_ids):
+            return [([], [], []) for _ in range(n_pages)]
+
+        class_ids = np.concatenate([class_ids for class_ids, _, _ in labels])
+        counts = np.concatenate([counts for _, counts, _ in labels])
+        points = np.concatenate([points for _, _, points in labels]) * sizes[np.repeat(object_page_ids, counts)]
+        is_box = counts == 2
+
+        # as caixas viram quatro cantos (AnnotationDocument.get_polygons) e passam pela mesma transformação
+        points, counts = make_document('', class_ids.astype(str), counts, points, np.full(len(counts), -1)).get_polygons()
+        point_page_ids = np.repeat(object_page_ids, counts)
+
+        transformed = GeometricTransform.transform_points(points, matrices, point_page_ids)
+        transformed, counts, keep = GeometricTransform.clip_polygons(transformed, counts, sizes, point_page_ids,
+                                                                     options.min_area, options.min_visibility)
+        class_ids, object_page_ids, is_box = class_ids[keep], object_page_ids[keep], is_box[keep]
+        if not len(counts):
+            return [([], [], []) for _ in range(n_pages)]
+
+        # caixas: envolvente dos cantos transformados, em (xcentral, ycentral), (largura, altura)
+        starts = np.cumsum(counts) - counts
+        page_sizes = sizes[object_page_ids]
+        minimums, maximums = np.minimum.reduceat(transformed, starts), np.maximum.reduceat(transformed, starts)
+        yolo_boxes = np.stack([(minimums + maximums) / 2, maximums - minimums], axis=1) / page_sizes[:, None]
+        normalized_points = transformed / sizes[np.repeat(object_page_ids, counts)]
+
+        # em pixels inteiros, como a coluna xy produzida por Augmentation.resize_image
+        polygons = np.split(np.rint(transformed).astype(np.int64), starts[1:])
+        normalized_polygons = np.split(normalized_points, starts[1:])
+
+        results = [([], [], []) for _ in range(n_pages)]
+        for class_id, page_id, box, yolo_box, normalized, polygon in zip(class_ids.tolist(), object_page_ids.tolist(),
+                                                                          is_box, yolo_boxes, normalized_polygons, polygons):
+            results[page_id][0].append(class_id)
+            results[page_id][1].append((yolo_box if box else normalized).tolist())
+            results[page_id][2].append(polygon.tolist())
+
+        return results
+
+    @staticmethod
+    def warp_image(image : np.ndarray, matrix : np.ndarray, fill : int = 255):
+        import cv2
+
+        height, width = image.shape[:2]
+        border_value = fill if image.ndim == 2 else (fill,) * image.shape[2]
+        return cv2.warpPerspective(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
+
+
+def get_variant_path(path : str | Path, variant : int):
+    path = Path(path)
+    return path.with_name(f'{path.stem}_geo_{variant}{path.suffix}')
+
+
+def get_page_seed(seed : int, image_path : str | Path, variant : int):
+    # semente estável entre execuções e processos (o hash() do Python varia por processo)
+    return [seed, zlib.crc32(Path(image_path).stem.encode()), variant]
+
+
+def augment_batch(jobs : List[Tuple[str, str, int, int, dict, dict, bool]]):
+    '''
+    Gera as variantes de um lote de páginas (executado nos processos do pool). Cada job é
+    (image_path, label_path, variants, seed, options, encoding, grayscale). Os rótulos de todas as
+    variantes de todas as páginas do lote são transformados juntos. Retorna, por variante,
+    (image_path, label_path, yolo_xy, xy).
+    '''
+    from DataExtractor.conversion_hub import read_yolo_file
+    from DataExtractor.yolo_converter import YOLOConverter
+
+    images, labels, matrices, sizes, outputs = [], [], [], [], []
+    for image_path, label_path, variants, seed, options, encoding, grayscale in jobs:
+        geometric_options = GeometricOptions(**options)
+        image = np.asarray(Augmentation.load_image(image_path, grayscale=grayscale))
+        height, width = image.shape[:2]
+        if os.path.exists(label_path):
+            page_label = read_yolo_file(label_path)
+        else:
+            page_label = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, 2))
+
+        for variant in range(1, variants + 1):
+            random_generator = np.random.default_rng(get_page_seed(seed, image_path, variant))
+            matrices.append(GeometricTransform.sample_matrix(width, height, geometric_options, random_generator))
+            sizes.append((width, height))
+            images.append(image)
+            labels.append(page_label)
+            outputs.append((get_variant_path(image_path, variant), get_variant_path(label_path, variant),
+                            geometric_options, encoding))
+
+    if not outputs:
+        return []
+
+    matrices = np.stack(matrices)
+    # os parâmetros de filtragem são os do primeiro job; um lote usa as mesmas opções
+    transformed_labels = GeometricTransform.transform_labels(labels, matrices, np.array(sizes, dtype=np.float64),
+                                                             outputs[0][2])
+
+    results = []
+    for image, matrix, (class_ids, normalized, polygons), (image_path, label_path, options, encoding) \
+            in zip(images, matrices, transformed_labels, outputs):
+        warped = GeometricTransform.warp_image(image, matrix, options.fill)
+        Augmentation.save_image(warped, image_path, EncodingOptions(**encoding) if encoding else None)
+        YOLOConverter.save_file(YOLOConverter.create_mask_txt_file_content(normalized, class_ids), label_path)
+        results.append((image_path.as_posix(), label_path.as_posix(), normalized, polygons))
+
+    return results
+
+
+@instrumented('geometric.augment_files', items=len)
+def augment_files(pairs : Iterable[Tuple[str | Path, str | Path]],
+                  variants : int = 2,
+                  options : GeometricOptions = None,
+                  seed : int = 42,
+                  encoding : EncodingOptions = None,
+                  grayscale : bool | str = False,
+                  batch_size : int = 16,
+                  workers : int = 4):
+    '''
+    Gera variants variantes _geo_N de cada par (imagem, rótulo YOLO), ao lado dos originais, em
+    lotes de batch_size páginas distribuídos entre workers processos. Retorna, na ordem dos pares,
+    as listas de (image_path, label_path, yolo_xy, xy) das variantes.
+    '''
+    options = asdict(options if options is not None else GeometricOptions())
+    encoding = asdict(encoding) if encoding is not None else None
+    jobs = [(str(image_path), str(label_path), variants, seed, options, encoding, grayscale)
+            for image_path, label_path in pairs]
+    batches = [jobs[start:start + batch_size] for start in range(0, len(jobs), batch_size)]
+
+    if workers <= 1:
+        batch_results = map(augment_batch, batches)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        batch_results = executor.map(augment_batch, batches)
+
+    try:
+        results = [result for batch_result in batch_results for result in batch_result]
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    return [results[index * variants:(index + 1) * variants] for index in range(len(jobs))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera variantes geométricas das páginas de um split YOLO.')
+    parser.add_argument('split_dir', help='diretório com images/ e labels/ (ex.: dataset_completo/train)')
+    parser.add_argument('--variants', type=int, default=2)
+    parser.add_argument('--rotation', type=float, default=2.0)
+    parser.add_argument('--scale', type=float, nargs=2, default=(0.95, 1.05))
+    parser.add_argument('--shear', type=float, default=1.0)
+    parser.add_argument('--perspective', type=float, default=0.0)
+    parser.add_argument('--crop', type=float, default=0.0)
+    parser.add_argument('--min-visibility', type=float, default=0.5)
+    parser.add_argument('--grayscale', choices=['auto', 'always'], default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from DataExtractor.file_finder import FileFinder
+
+    images_dir, labels_dir = Path(args.split_dir)/'images', Path(args.split_dir)/'labels'
+    image_paths = [path for path in FileFinder.find_files(images_dir, ['jpg', 'jpeg', 'png'])
+                   if '_geo_' not in Path(path).stem]
+    pairs = [(image_path, labels_dir/f'{Path(image_path).stem}.txt') for image_path in image_paths
+             if os.path.exists(labels_dir/f'{Path(image_path).stem}.txt')]
+
+    options = GeometricOptions(rotation=args.rotation, scale=tuple(args.scale), shear=args.shear,
+                               perspective=args.perspective, crop=args.crop, min_visibility=args.min_visibility)
+    results = augment_files(pairs, args.variants, options, args.seed, grayscale=args.grayscale or False,
+                            batch_size=args.batch_size, workers=args.workers)
+
+    print(f'\n{sum(len(result) for result in results)} variantes geradas para {len(pairs)} páginas em: {args.split_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,489 @@
+'''
+Codificação configurável e paralela das imagens dos conjuntos de dados.
+
+EncodingOptions define o formato e os parâmetros de compressão (qualidade e modo progressivo do
+JPEG, nível de compressão do PNG, WebP com ou sem perdas). ImageEncoder codifica e grava as
+imagens por um pool de threads (o Pillow libera o GIL durante a codificação) ou de processos.
+
+Uso:
+    # compara tamanho, tempo e PSNR de cada configuração em uma amostra das imagens
+    python -m DataAugmentation.image_encoding report dataset_folds/fold_1/train/images --sample 50
+
+    # recodifica uma árvore de diretórios existente, mantendo a extensão de cada arquivo
+    python -m DataAugmentation.image_encoding reencode dataset_folds/ --quality 85 --progressive --optimize
+
+    # converte para WebP, removendo os arquivos originais
+    python -m DataAugmentation.image_encoding reencode dataset_folds/ --format webp --quality 90
+
+    # mede a economia de disco, decodificação e memória ao guardar as páginas cinzas com um canal
+    python -m DataAugmentation.image_encoding grayscale dataset_completo/train/images --sample 50
+
+    # regrava com um canal (L) as imagens RGB que são, na prática, cinzas
+    python -m DataAugmentation.image_encoding reencode dataset_completo/ --grayscale auto
+'''
+
+import io
+import os
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, asdict, replace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterable, Tuple, Dict, List
+from tqdm import tqdm
+
+from Instrumentation.spans import instrumented, add_bytes_written, is_enabled
+
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp', 'bmp', 'tif', 'tiff']
+
+FORMAT_BY_EXTENSION = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP',
+                       'bmp': 'BMP', 'tif': 'TIFF', 'tiff': 'TIFF'}
+
+# modos do Pillow que já têm um único canal
+SINGLE_CHANNEL_MODES = ('1', 'L', 'I;16', 'I', 'F')
+
+
+def is_single_channel(image : Image.Image | np.ndarray,
+                      tolerance : int = 8,
+                      max_color_fraction : float = 0.001,
+                      sample_size : int = 512):
+    '''
+    Verifica se a imagem é, na prática, de um canal: sempre para os modos de um canal e, para as
+    imagens coloridas, quando no máximo max_color_fraction dos pixels têm diferença entre os canais
+    acima de tolerance (margem para os artefatos de croma do JPEG). Apenas uma grade de até
+    sample_size pixels por lado é inspecionada.
+    '''
+    if isinstance(image, Image.Image):
+        if image.mode in SINGLE_CHANNEL_MODES:
+            return True
+        image = np.asarray(image if image.mode in ('RGB', 'RGBA') else image.convert('RGB'))
+
+    if image.ndim == 2 or image.shape[-1] == 1:
+        return True
+
+    step = max(1, max(image.shape[:2]) // sample_size)
+    sample = image[::step, ::step, :3]
+    spread = sample.max(axis=2).astype(np.int16) - sample.min(axis=2)
+
+    return bool(np.count_nonzero(spread > tolerance) <= max_color_fraction * spread.size)
+
+
+def convert_grayscale(image : Image.Image | np.ndarray, grayscale : bool | str = 'auto'):
+    '''
+    grayscale True (ou 'always') converte a imagem para L (8 bits, um canal); 'auto' converte apenas
+    as imagens de um canal na prática (is_single_channel); False a mantém. Retorna o mesmo tipo da entrada.
+    '''
+    if not grayscale:
+        return image
+    if grayscale not in (True, 'auto', 'always'):
+        raise ValueError(f'Modo de tons de cinza inválido: {grayscale}')
+    if grayscale == 'auto' and not is_single_channel(image):
+        return image
+
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        return np.asarray(Image.fromarray(image[..., :3] if image.shape[-1] > 1 else image[..., 0]).convert('L'))
+
+    return image if image.mode == 'L' else image.convert('L')
+
+
+@dataclass(frozen=True)
+class EncodingOptions:
+    '''
+    format None usa o formato indicado pela extensão do arquivo. quality vale para JPEG e WebP,
+    progressive e optimize para JPEG, optimize e compress_level (0 a 9) para PNG, lossless e
+    method (0 a 6, mais lento e menor) para WebP. subsampling do JPEG: 0 (4:4:4), 1 (4:2:2) ou 2 (4:2:0).
+    grayscale grava em L (um canal): True (ou 'always') para todas as imagens, 'auto' apenas para
+    as que são cinzas na prática (ver convert_grayscale).
+    '''
+    format : str = None
+    quality : int = 95
+    progressive : bool = False
+    optimize : bool = False
+    compress_level : int = 6
+    lossless : bool = False
+    method : int = 4
+    subsampling : int = None
+    grayscale : bool | str = False
+
+    def get_format(self, path : str | Path):
+        if self.format is not None:
+            return FORMAT_BY_EXTENSION.get(self.format.lower(), self.format.upper())
+        return FORMAT_BY_EXTENSION.get(Path(path).suffix[1:].lower())
+
+    def get_save_kwargs(self, image_format : str):
+        if image_format == 'JPEG':
+            kwargs = {'quality': self.quality, 'progressive': self.progressive, 'optimize': self.optimize}
+            if self.subsampling is not None:
+                kwargs['subsampling'] = self.subsampling
+            return kwargs
+        if image_format == 'PNG':
+            return {'optimize': self.optimize, 'compress_level': self.compress_level}
+        if image_format == 'WEBP':
+            return {'quality': self.quality, 'lossless': self.lossless, 'method': self.method}
+        return {}
+
+
+class ImageEncoder:
+
+    @staticmethod
+    def prepare_image(image : Image.Image | np.ndarray, image_format : str):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        # JPEG não aceita canal alfa nem paleta
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        return image
+
+    @staticmethod
+    def encode(image : Image.Image | np.ndarray, options : EncodingOptions, image_format : str):
+        '''
+        Codifica a imagem em memória, retornando os bytes.
+        '''
+        buffer = io.BytesIO()
+        image = convert_grayscale(image, options.grayscale)
+        ImageEncoder.prepare_image(image, image_format).save(buffer, format=image_format,
+                                                             **options.get_save_kwargs(image_format))
+        return buffer.getvalue()
+
+    @staticmethod
+    def save(image : Image.Image | np.ndarray, path : str | Path, options : EncodingOptions = None):
+        '''
+        Grava a imagem com as opções informadas. Sem opções, mantém o comportamento padrão do Pillow.
+        Retorna a quantidade de bytes gravados.
+        '''
+        if options is None:
+            if isinstance(image, np.ndarray):
+                image = Image.fromarray(image)
+            image.save(path)
+            return os.path.getsize(path) if is_enabled() else 0
+
+        image_format = options.get_format(path)
+        content = ImageEncoder.encode(image, options, image_format)
+        with open(path, 'wb') as file:
+            file.write(content)
+
+        return len(content)
+
+    def __init__(self, options : EncodingOptions = None, workers : int = None, use_processes : bool = False):
+        '''
+        Pool de codificação. Com use_processes=True, as imagens são serializadas para os processos
+        trabalhadores, o que só compensa para formatos lentos (ex.: WebP com method=6 ou PNG com optimize).
+        '''
+        self.options = options
+        self.workers = workers if workers is not None else os.cpu_count()
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=self.workers)
+        self.pending = deque()
+        self.bytes_written = 0
+        self.images_written = 0
+
+    def collect(self, max_pending : int):
+        while len(self.pending) > max_pending:
+            self.bytes_written += self.pending.popleft().result()
+            self.images_written += 1
+
+    def submit(self, image : Image.Image | np.ndarray, path : str | Path):
+        '''
+        Agenda a gravação da imagem. Bloqueia quando há mais de 2 * workers imagens pendentes,
+        limitando a memória ocupada por imagens ainda não gravadas.
+        '''
+        self.pending.append(self.executor.submit(ImageEncoder.save, image, path, self.options))
+        self.collect(2 * self.workers)
+
+    def save_many(self, images : Iterable[Tuple[Image.Image | np.ndarray, str | Path]]):
+        for image, path in images:
+            self.submit(image, path)
+        self.collect(0)
+        return self.images_written
+
+    def close(self):
+        try:
+            self.collect(0)
+        finally:
+            self.executor.shutdown()
+            if is_enabled():
+                add_bytes_written(self.bytes_written)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ---------------------------------------------------------------------------------------
+# Relatório de tamanho e tempo por configuração
+# ---------------------------------------------------------------------------------------
+
+DEFAULT_SETTINGS = {
+    'jpeg_q75 (padrão Pillow)': EncodingOptions(format='jpeg', quality=75),
+    'jpeg_q95': EncodingOptions(format='jpeg', quality=95),
+    'jpeg_q90_progressive_optimize': EncodingOptions(format='jpeg', quality=90, progressive=True, optimize=True),
+    'jpeg_q85_progressive_optimize': EncodingOptions(format='jpeg', quality=85, progressive=True, optimize=True),
+    'png_level6': EncodingOptions(format='png', compress_level=6),
+    'png_level9_optimize': EncodingOptions(format='png', optimize=True, compress_level=9),
+    'webp_q90': EncodingOptions(format='webp', quality=90),
+    'webp_lossless': EncodingOptions(format='webp', lossless=True, quality=80),
+}
+
+
+def compute_psnr(original : np.ndarray, decoded : np.ndarray):
+    mse = np.mean((original.astype(np.float32) - decoded.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def measure_setting(images : List[np.ndarray], options : EncodingOptions):
+    image_format = options.get_format('')
+    start = time.perf_counter()
+    encoded_images = [ImageEncoder.encode(image, options, image_format) for image in images]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded_images = [np.asarray(Image.open(io.BytesIO(content)).convert(ImageEncoder.prepare_image(image, image_format).mode))
+                      for image, content in zip(images, encoded_images)]
+    decode_seconds = time.perf_counter() - start
+
+    return {
+        'bytes': sum(len(content) for content in encoded_images),
+        'encode_ms': 1000 * encode_seconds / len(images),
+        'decode_ms': 1000 * decode_seconds / len(images),
+        'psnr': float(np.mean([compute_psnr(image, decoded) for image, decoded in zip(images, decoded_images)]))
+    }
+
+
+@instrumented('image_encoding.encoding_report')
+def encoding_report(images : Iterable[Image.Image | np.ndarray],
+                    settings : Dict[str, EncodingOptions] = None):
+    '''
+    Codifica as imagens com cada configuração e retorna, por configuração, o tamanho total, o
+    tamanho relativo à primeira configuração, os tempos médios de codificação e decodificação e o
+    PSNR médio (inf para codificação sem perdas). As configurações são medidas uma de cada vez,
+    para que os tempos não sofram interferência entre si.
+    '''
+    settings = settings if settings is not None else DEFAULT_SETTINGS
+    images = [np.asarray(image) for image in images]
+
+    results = {name: measure_setting(images, options) for name, options in settings.items()}
+
+    reference_bytes = next(iter(results.values()))['bytes'] if results else 0
+    for name, result in results.items():
+        result['relative_size'] = result['bytes'] / reference_bytes if reference_bytes else 0.0
+        result['options'] = asdict(settings[name])
+
+    return results
+
+
+def print_report(results : dict, n_images : int):
+    print(f'\nConfiguração{"":<26} {"MB":>9} {"relativo":>9} {"cod. ms":>9} {"dec. ms":>9} {"PSNR":>7}')
+    for name, result in results.items():
+        print(f'{name:<38} {result["bytes"] / 2**20:>9.2f} {result["relative_size"]:>9.2f} '
+              f'{result["encode_ms"]:>9.2f} {result["decode_ms"]:>9.2f} {result["psnr"]:>7.2f}')
+    print(f'\n{n_images} imagens; tempos médios por imagem, em uma única thread.')
+
+
+@instrumented('image_encoding.grayscale_report', items=len)
+def grayscale_report(image_paths : Iterable[str | Path], options : EncodingOptions = None):
+    '''
+    Compara, para as imagens de um canal na prática, o armazenamento em RGB e em L: tamanho
+    codificado (com options; padrão JPEG de qualidade 95), tempo médio de decodificação e memória
+    dos arrays decodificados (o que ocupa um cache em RAM ou um ImageCache).
+    '''
+    options = options if options is not None else EncodingOptions(format='jpeg', quality=95)
+    image_format = options.get_format('')
+    totals = {mode: {'bytes': 0, 'decode_seconds': 0.0, 'memory_bytes': 0} for mode in ('RGB', 'L')}
+    n_images, n_single_channel = 0, 0
+
+    for image_path in image_paths:
+        with Image.open(image_path) as image:
+            image = image.convert('RGB')
+        n_images += 1
+        if not is_single_channel(image):
+            continue
+        n_single_channel += 1
+
+        for mode, variant in (('RGB', image), ('L', image.convert('L'))):
+            content = ImageEncoder.encode(variant, replace(options, grayscale=False), image_format)
+            start = time.perf_counter()
+            with Image.open(io.BytesIO(content)) as decoded:
+                array = np.asarray(decoded)
+            totals[mode]['decode_seconds'] += time.perf_counter() - start
+            totals[mode]['bytes'] += len(content)
+            totals[mode]['memory_bytes'] += array.nbytes
+
+    results = {'images': n_images, 'single_channel': n_single_channel}
+    for mode, total in totals.items():
+        results[mode] = {'bytes': total['bytes'], 'memory_bytes': total['memory_bytes'],
+                         'decode_ms': 1000 * total['decode_seconds'] / max(n_single_channel, 1)}
+    return results
+
+
+def print_grayscale_report(results : dict):
+    rgb, gray = results['RGB'], results['L']
+    print(f'\n{results["single_channel"]} de {results["images"]} imagens são de um canal na prática.')
+    print(f'\n{"":<20} {"RGB":>10} {"L":>10} {"L/RGB":>7}')
+    for label, key, scale in (('disco (MB)', 'bytes', 2**20), ('memória (MB)', 'memory_bytes', 2**20),
+                              ('decodificação (ms)', 'decode_ms', 1)):
+        ratio = gray[key] / rgb[key] if rgb[key] else 0.0
+        print(f'{label:<20} {rgb[key] / scale:>10.2f} {gray[key] / scale:>10.2f} {ratio:>7.2f}')
+
+
+# ---------------------------------------------------------------------------------------
+# Recodificação de árvores de diretórios
+# ---------------------------------------------------------------------------------------
+
+def find_images(root : str | Path):
+    return sorted(Path(dir_path)/file_name
+                  for dir_path, _, file_names in os.walk(root)
+                  for file_name in file_names
+                  if file_name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS)
+
+
+def reencode_file(path : Path, options : EncodingOptions):
+    '''
+    Recodifica um arquivo de forma atômica (arquivo temporário + os.replace). Quando o formato muda,
+    a imagem é gravada com a nova extensão e o original é removido. Retorna (bytes antes, bytes depois).
+    '''
+    new_path = path.with_suffix(f'.{options.format.lower()}') if options.format is not None else path
+    temporary_path = new_path.with_name(f'.{new_path.name}.tmp')
+
+    size_before = path.stat().st_size
+    with Image.open(path) as image:
+        image.load()
+        size_after = ImageEncoder.save(image, temporary_path, replace(options, format=options.get_format(new_path)))
+
+    os.replace(temporary_path, new_path)
+    if new_path != path:
+        os.remove(path)
+
+    return size_before, size_after
+
+
+def group_hard_links(paths : Iterable[Path]):
+    '''
+    Agrupa os caminhos que são hard links de um mesmo arquivo (mesmo dispositivo e inode), na ordem de paths.
+    '''
+    groups = {}
+    for path in paths:
+        stat = path.stat()
+        groups.setdefault((stat.st_dev, stat.st_ino), []).append(path)
+    return list(groups.values())
+
+
+def relink_file(path : Path, source : Path, options : EncodingOptions):
+    '''
+    Substitui path, de forma atômica, por um hard link para source (outro link do mesmo arquivo, já
+    recodificado por reencode_file), trocando a extensão quando o formato muda.
+    '''
+    new_path = path.with_suffix(f'.{options.format.lower()}') if options.format is not None else path
+    temporary_path = new_path.with_name(f'.{new_path.name}.tmp')
+
+    temporary_path.unlink(missing_ok=True)
+    os.link(source, temporary_path)
+    os.replace(temporary_path, new_path)
+    if new_path != path:
+        os.remove(path)
+
+
+def reencode_tree(root : str | Path, options : EncodingOptions, workers : int = None, use_processes : bool = True):
+    '''
+    Recodifica todas as imagens da árvore em paralelo. Os rótulos YOLO são associados às imagens
+    pelo nome do arquivo, portanto a troca de extensão não os afeta; CSVs de metadados que guardam
+    os caminhos das imagens precisam ser regenerados nesse caso.
+
+    A recodificação grava um novo arquivo (novo inode). Os hard links dentro da árvore (ex.: os
+    folds de export_folds, que compartilham as imagens) são recodificados uma única vez e refeitos
+    para o novo arquivo, sem duplicar as imagens no disco; links para fora da árvore continuam
+    apontando para o arquivo original.
+    '''
+    paths = find_images(root)
+    groups = group_hard_links(paths)
+    primary_paths = [group[0] for group in groups]
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    total_before, total_after = 0, 0
+    with executor_class(max_workers=workers) as executor:
+        for size_before, size_after in tqdm(executor.map(reencode_file, primary_paths, [options] * len(primary_paths),
+                                                         chunksize=16),
+                                            total=len(primary_paths), desc=f'Recodificando {root}'):
+            total_before += size_before
+            total_after += size_after
+
+    for group in groups:
+        source = group[0].with_suffix(f'.{options.format.lower()}') if options.format is not None else group[0]
+        for path in group[1:]:
+            relink_file(path, source, options)
+
+    print(f'\n{len(paths)} imagens ({len(primary_paths)} arquivos distintos) recodificadas: '
+          f'{total_before / 2**20:.1f} MB -> {total_after / 2**20:.1f} MB ({100 * total_after / max(total_before, 1):.1f}%)')
+
+    return total_before, total_after
+
+
+def add_encoding_arguments(parser : argparse.ArgumentParser):
+    parser.add_argument('--format', default=None, choices=['jpg', 'jpeg', 'png', 'webp'])
+    parser.add_argument('--quality', type=int, default=95)
+    parser.add_argument('--progressive', action='store_true')
+    parser.add_argument('--optimize', action='store_true')
+    parser.add_argument('--compress-level', type=int, default=6)
+    parser.add_argument('--lossless', action='store_true')
+    parser.add_argument('--method', type=int, default=4)
+    parser.add_argument('--subsampling', type=int, choices=[0, 1, 2], default=None,
+                        help='subamostragem de croma do JPEG: 0 (4:4:4), 1 (4:2:2) ou 2 (4:2:0)')
+    parser.add_argument('--grayscale', choices=['auto', 'always'], default=None,
+                        help='grava em L (um canal) as imagens cinzas na prática (auto) ou todas (always)')
+
+
+def get_encoding_options(args : argparse.Namespace):
+    return EncodingOptions(format=args.format, quality=args.quality, progressive=args.progressive,
+                           optimize=args.optimize, compress_level=args.compress_level,
+                           lossless=args.lossless, method=args.method, subsampling=args.subsampling,
+                           grayscale=args.grayscale or False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Codificação das imagens dos conjuntos de dados.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = subparsers.add_parser('report', help='compara tamanho e tempo de cada configuração')
+    report_parser.add_argument('root')
+    report_parser.add_argument('--sample', type=int, default=50)
+    report_parser.add_argument('--seed', type=int, default=42)
+
+    grayscale_parser = subparsers.add_parser('grayscale', help='mede a economia de guardar as imagens cinzas em L')
+    grayscale_parser.add_argument('root')
+    grayscale_parser.add_argument('--sample', type=int, default=50)
+    grayscale_parser.add_argument('--seed', type=int, default=42)
+
+    reencode_parser = subparsers.add_parser('reencode', help='recodifica as imagens de uma árvore de diretórios')
+    reencode_parser.add_argument('root')
+    reencode_parser.add_argument('--workers', type=int, default=None)
+    reencode_parser.add_argument('--threads', action='store_true', help='usa threads em vez de processos')
+    add_encoding_arguments(reencode_parser)
+
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        paths = find_images(args.root)
+        random_generator = np.random.default_rng(args.seed)
+        sample = random_generator.choice(len(paths), size=min(args.sample, len(paths)), replace=False)
+        images = []
+        for index in sorted(sample):
+            with Image.open(paths[index]) as image:
+                images.append(np.asarray(image.convert('RGB')))
+        print_report(encoding_report(images), len(images))
+    elif args.command == 'grayscale':
+        paths = find_images(args.root)
+        sample = np.random.default_rng(args.seed).choice(len(paths), size=min(args.sample, len(paths)), replace=False)
+        print_grayscale_report(grayscale_report([paths[index] for index in sorted(sample)]))
+    else:
+        reencode_tree(args.root, get_encoding_options(args), workers=args.workers, use_processes=not args.threads)
+
+
+if __name__ == '__main__':
+    main()
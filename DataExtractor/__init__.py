@@ -0,0 +1,25 @@
+'''
+Extração e conversão dos conjuntos de dados (ICDAR 2019 cTDaR e FinTabNet.c).
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'annotation_validator': ['AnnotationValidator', 'ParsedFile'],
+    'chunked_table': ['ChunkedTableWriter', 'ChunkedTableReader', 'write_table'],
+    'conversion_hub': ['AnnotationConverter', 'AnnotationDocument', 'ImageSizeCache', 'XMLReader', 'YOLOReader',
+                       'COCOReader', 'ColumnarReader', 'CTDaRWriter', 'VOCWriter', 'YOLOWriter', 'COCOWriter',
+                       'ColumnarWriter'],
+    'dataset_to_dataframe': ['ConvertICDARDatasetToDataframe', 'ConvertFinTabNetDatasetToTable'],
+    'downloader': ['download_dataset'],
+    'file_finder': ['FileFinder'],
+    'image_cache': ['ImageCache', 'ImageCacheBuilder'],
+    'ingest_watcher': ['IngestWatcher', 'IngestManifest'],
+    'label_cache': ['LabelCache', 'LabelCacheExporter', 'YOLOLabelWriter'],
+    'maskrcnn_converter': ['YOLO2MaskRCNN'],
+    'polygon_simplification': ['PolygonSimplifier', 'SimplificationReport', 'simplify_pages'],
+    'xml_handler': ['XMLHandler'],
+    'yolo_converter': ['YOLOConverter', 'ICDARYOLOConverter', 'FinTabNetYOLOConverter'],
+})
@@ -0,0 +1,395 @@
+'''
+Validação em lote das anotações (XML cTDaR do ICDAR 2019 e XML PASCAL VOC do FinTabNet.c).
+
+Os XMLs são lidos em paralelo por um pool de processos, e cada arquivo é reduzido a arrays
+(tipo e pai de cada objeto, contagem de pontos e os pontos). As verificações são então feitas de
+uma só vez sobre todos os objetos do conjunto:
+
+    missing_image        imagem da anotação não encontrada (cTDaR)
+    parse_error          XML inválido
+    out_of_image         algum ponto fora dos limites da imagem
+    inverted_box         xmin > xmax ou ymin > ymax (VOC)
+    few_points           polígono com menos de 3 pontos (cTDaR)
+    zero_area            polígono ou caixa de área nula
+    outside_parent       célula fora da sua tabela (cTDaR) ou objeto fora da tabela do recorte (VOC)
+
+Com fix='clip', as coordenadas são limitadas à imagem (e à tabela, no caso de outside_parent) e
+as caixas invertidas, corrigidas; com fix='drop', os objetos com problemas são removidos. Em
+ambos os casos, objetos que continuam degenerados são removidos, e os XMLs corrigidos são
+gravados em output_dir, em paralelo, para serem usados por YOLOConverter e YOLO2MaskRCNN.
+
+Uso:
+    python -m DataExtractor.annotation_validator dataset/training/TRACKB1/ground_truth --report issues.csv
+    python -m DataExtractor.annotation_validator fin_tab_net_dataset/train --fix clip --output-dir fin_tab_net_fixed/train
+'''
+
+import os
+import csv
+import argparse
+import numpy as np
+import xml.etree.ElementTree as ET
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Literal
+
+from .polygon_simplification import PolygonSimplifier
+from Instrumentation.spans import instrumented
+
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'tif', 'tiff', 'bmp', 'webp']
+
+# tipos de objeto
+TABLE, CELL, VOC_OBJECT = 0, 1, 2
+
+FILE_ISSUES = ['parse_error', 'missing_image']
+OBJECT_ISSUES = ['out_of_image', 'inverted_box', 'few_points', 'zero_area', 'outside_parent']
+
+
+def find_image(xml_path : Path, images_dir : Path):
+    for extension in IMAGE_EXTENSIONS:
+        for candidate in (images_dir/f'{xml_path.stem}.{extension}', images_dir/f'{xml_path.stem}.{extension.upper()}'):
+            if candidate.exists():
+                return candidate
+    return None
+
+
+def iterate_objects(root : ET.Element):
+    '''
+    Percorre os elementos anotados na mesma ordem usada na leitura e na correção: (elemento com as
+    coordenadas, elemento do objeto, elemento que o contém, tipo, nome da classe no VOC).
+    '''
+    if root.tag == 'annotation':
+        for element in root.findall('object'):
+            yield element.find('bndbox'), element, root, VOC_OBJECT, element.findtext('name')
+        return
+
+    for table in root.findall('table'):
+        table_coords = table.find('Coords')
+        if table_coords is not None:
+            yield table_coords, table, root, TABLE, None
+        for cell in table.findall('cell'):
+            coords = cell.find('Coords')
+            if coords is not None:
+                yield coords, cell, table, CELL, None
+
+
+def parse_points(coords : ET.Element, kind : int):
+    if kind == VOC_OBJECT:
+        return [[float(coords.findtext('xmin')), float(coords.findtext('ymin'))],
+                [float(coords.findtext('xmax')), float(coords.findtext('ymax'))]]
+    return [list(map(float, point.split(','))) for point in coords.attrib['points'].split()]
+
+
+@dataclass
+class ParsedFile:
+    xml_path : str
+    width : float
+    height : float
+    kinds : np.ndarray
+    parents : np.ndarray
+    counts : np.ndarray
+    points : np.ndarray
+    error : str = None
+
+
+class AnnotationValidator:
+
+    @staticmethod
+    def parse_file(xml_path : str | Path, images_dir : str | Path = None):
+        '''
+        Lê um XML e devolve os seus objetos como arrays. O pai de uma célula é a sua tabela; o pai
+        de um objeto VOC que não é a tabela é o primeiro objeto 'table' do arquivo. Os índices dos
+        pais são locais ao arquivo (-1 quando não há pai).
+        '''
+        xml_path = Path(xml_path)
+        empty = ParsedFile(xml_path.as_posix(), 0, 0, np.zeros(0, np.int8), np.zeros(0, np.int64),
+                           np.zeros(0, np.int64), np.zeros((0, 2)))
+        try:
+            root = ET.parse(xml_path).getroot()
+        except (ET.ParseError, OSError) as error:
+            empty.error = f'parse_error: {error}'
+            return empty
+
+        if root.tag == 'annotation':
+            width, height = float(root.findtext('size/width') or 0), float(root.findtext('size/height') or 0)
+        else:
+            image_path = find_image(xml_path, Path(images_dir) if images_dir is not None else xml_path.parent)
+            if image_path is None:
+                empty.error = 'missing_image'
+                return empty
+            with Image.open(image_path) as image:
+                width, height = image.size
+
+        kinds, parents, counts, points = [], [], [], []
+        table_index, voc_table_index = -1, -1
+        try:
+            for index, (coords, _, _, kind, name) in enumerate(iterate_objects(root)):
+                object_points = parse_points(coords, kind)
+                if kind == TABLE:
+                    table_index = index
+                    parents.append(-1)
+                elif kind == CELL:
+                    parents.append(table_index)
+                else:
+                    if name == 'table' and voc_table_index < 0:
+                        voc_table_index = index
+                    parents.append(-1 if name == 'table' else voc_table_index)
+                kinds.append(kind)
+                counts.append(len(object_points))
+                points.extend(object_points)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            empty.error = f'parse_error: {error!r}'
+            return empty
+
+        # objetos VOC que aparecem antes da tabela no arquivo
+        parents = np.array(parents, dtype=np.int64)
+        if voc_table_index >= 0:
+            kinds_array = np.array(kinds)
+            parents[(kinds_array == VOC_OBJECT) & (parents < 0) & (np.arange(len(kinds)) != voc_table_index)] = voc_table_index
+
+        return ParsedFile(xml_path.as_posix(), width, height, np.array(kinds, dtype=np.int8), parents,
+                          np.array(counts, dtype=np.int64), np.array(points, dtype=np.float64).reshape(-1, 2))
+
+    @staticmethod
+    def parse_files(xml_paths : List[str | Path], images_dir : str | Path = None):
+        return [AnnotationValidator.parse_file(xml_path, images_dir) for xml_path in xml_paths]
+
+    @staticmethod
+    def parse_all(xml_paths : List[str | Path], images_dir : str | Path = None, workers : int = 8, chunk_size : int = 256):
+        from tqdm import tqdm
+
+        chunks = [xml_paths[start:start + chunk_size] for start in range(0, len(xml_paths), chunk_size)]
+        parsed = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(AnnotationValidator.parse_files, chunk, images_dir) for chunk in chunks]
+            with tqdm(total=len(xml_paths), desc='Lendo as anotações') as pbar:
+                for future, chunk in zip(futures, chunks):
+                    parsed.extend(future.result())
+                    pbar.update(len(chunk))
+        return parsed
+
+    @staticmethod
+    def concatenate(parsed : List[ParsedFile]):
+        '''
+        Junta os arquivos em arrays globais; os índices dos pais passam a ser globais.
+        '''
+        object_counts = np.array([len(file.kinds) for file in parsed], dtype=np.int64)
+        object_offsets = np.cumsum(object_counts) - object_counts
+        file_ids = np.repeat(np.arange(len(parsed)), object_counts)
+
+        parents = np.concatenate([file.parents for file in parsed]) if parsed else np.zeros(0, np.int64)
+        parents = np.where(parents >= 0, parents + object_offsets[file_ids], -1)
+
+        return {
+            'file_ids': file_ids,
+            'kinds': np.concatenate([file.kinds for file in parsed]) if parsed else np.zeros(0, np.int8),
+            'parents': parents,
+            'counts': np.concatenate([file.counts for file in parsed]) if parsed else np.zeros(0, np.int64),
+            'points': np.concatenate([file.points for file in parsed]) if parsed else np.zeros((0, 2)),
+            'sizes': np.array([[file.width, file.height] for file in parsed], dtype=np.float64).reshape(-1, 2)
+        }
+
+    @staticmethod
+    def get_bounds(points : np.ndarray, counts : np.ndarray):
+        '''
+        (xmin, ymin, xmax, ymax) de cada objeto com pelo menos um ponto.
+        '''
+        bounds = np.zeros((len(counts), 4))
+        non_empty = counts > 0
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        if len(starts):
+            bounds[non_empty, :2] = np.minimum.reduceat(points, starts)
+            bounds[non_empty, 2:] = np.maximum.reduceat(points, starts)
+        return bounds
+
+    @staticmethod
+    @instrumented('annotation_validator.AnnotationValidator.check', items=lambda issues: len(issues['zero_area']))
+    def check(arrays : Dict[str, np.ndarray], tolerance : float = 1.0):
+        '''
+        Máscaras booleanas (uma por problema) sobre todos os objetos. tolerance é a folga, em
+        pixels, das verificações de limites da imagem e de contenção na tabela.
+        '''
+        file_ids, kinds, parents, counts, points = (arrays[key] for key in ['file_ids', 'kinds', 'parents', 'counts', 'points'])
+        point_files = np.repeat(file_ids, counts)
+        point_objects = np.repeat(np.arange(len(counts)), counts)
+        sizes = arrays['sizes'][point_files]
+
+        outside = (points < -tolerance) | (points > sizes + tolerance)
+        out_of_image = np.bincount(point_objects[outside.any(axis=1)], minlength=len(counts)) > 0
+
+        is_voc = kinds == VOC_OBJECT
+        inverted = np.zeros(len(counts), dtype=bool)
+        voc_starts = (np.cumsum(counts) - counts)[is_voc & (counts == 2)]
+        inverted[is_voc & (counts == 2)] = (points[voc_starts] > points[voc_starts + 1]).any(axis=1)
+
+        few_points = ~is_voc & (counts < 3)
+
+        bounds = AnnotationValidator.get_bounds(points, counts)
+        areas = np.zeros(len(counts))
+        polygons = ~is_voc & (counts >= 3)
+        polygon_points = polygons[point_objects]
+        areas[polygons] = PolygonSimplifier.polygon_areas(points[polygon_points], counts[polygons])
+        areas[is_voc] = (bounds[is_voc, 2] - bounds[is_voc, 0]) * (bounds[is_voc, 3] - bounds[is_voc, 1])
+        zero_area = (areas <= 0) & ~few_points
+
+        # a contenção só é verificada quando a própria tabela é válida
+        has_parent = parents >= 0
+        parent_ids = np.where(has_parent, parents, 0)
+        invalid = out_of_image | inverted | few_points | zero_area
+        parent_bounds = bounds[parent_ids]
+        outside_parent = has_parent & ~invalid[parent_ids] & (
+            (bounds[:, :2] < parent_bounds[:, :2] - tolerance).any(axis=1) |
+            (bounds[:, 2:] > parent_bounds[:, 2:] + tolerance).any(axis=1))
+
+        return {'out_of_image': out_of_image, 'inverted_box': inverted, 'few_points': few_points,
+                'zero_area': zero_area, 'outside_parent': outside_parent}
+
+    @staticmethod
+    def fix(arrays : Dict[str, np.ndarray], issues : Dict[str, np.ndarray], mode : Literal['clip', 'drop'],
+            tolerance : float = 1.0):
+        '''
+        Retorna (pontos corrigidos, máscara dos objetos removidos). tolerance é a mesma de check.
+        '''
+        kinds, parents, counts = arrays['kinds'], arrays['parents'], arrays['counts']
+        points = arrays['points'].copy()
+        point_objects = np.repeat(np.arange(len(counts)), counts)
+        is_voc = kinds == VOC_OBJECT
+
+        if mode == 'drop':
+            dropped = np.logical_or.reduce(list(issues.values()))
+        else:
+            # inverte as caixas VOC trocadas e limita os pontos à imagem e à tabela
+            starts = np.cumsum(counts) - counts
+            voc = is_voc & (counts == 2)
+            first, second = points[starts[voc]], points[starts[voc] + 1]
+            points[starts[voc]], points[starts[voc] + 1] = np.minimum(first, second), np.maximum(first, second)
+
+            sizes = arrays['sizes'][np.repeat(arrays['file_ids'], counts)]
+            points = np.clip(points, 0, sizes)
+
+            # a contenção é verificada novamente, já com as tabelas corrigidas
+            bounds = AnnotationValidator.get_bounds(points, counts)
+            clip_to_parent = AnnotationValidator.check(arrays | {'points': points}, tolerance)['outside_parent'][point_objects]
+            parent_bounds = bounds[parents[point_objects[clip_to_parent]]]
+            points[clip_to_parent] = np.clip(points[clip_to_parent], parent_bounds[:, :2], parent_bounds[:, 2:])
+
+            fixed = arrays | {'points': points}
+            remaining = AnnotationValidator.check(fixed, tolerance)
+            dropped = remaining['few_points'] | remaining['zero_area']
+
+        # células de tabelas removidas também são removidas
+        has_parent = parents >= 0
+        dropped |= has_parent & dropped[np.where(has_parent, parents, 0)]
+        return points, dropped
+
+    @staticmethod
+    def write_fixed_file(xml_path : str | Path, output_path : str | Path, points : List[List[float]], dropped : List[bool]):
+        '''
+        Regrava um XML com as coordenadas corrigidas, removendo os objetos marcados.
+        '''
+        tree = ET.parse(xml_path)
+        for (coords, element, parent, kind, _), object_points, drop in zip(list(iterate_objects(tree.getroot())), points, dropped):
+            if drop:
+                parent.remove(element)
+                continue
+            if kind == VOC_OBJECT:
+                for name, value in zip(['xmin', 'ymin', 'xmax', 'ymax'], np.ravel(object_points)):
+                    coords.find(name).text = f'{value:g}'
+            else:
+                coords.set('points', ' '.join(f'{x:g},{y:g}' for x, y in object_points))
+
+        os.makedirs(Path(output_path).parent, exist_ok=True)
+        tree.write(output_path, encoding='utf-8', xml_declaration=True)
+        return output_path
+
+    @staticmethod
+    def write_fixed_files(jobs : List[tuple]):
+        return [AnnotationValidator.write_fixed_file(*job) for job in jobs]
+
+    @staticmethod
+    def validate(labels_path : str | Path,
+                 images_path : str | Path = None,
+                 fix : Literal['clip', 'drop'] = None,
+                 output_dir : str | Path = None,
+                 tolerance : float = 1.0,
+                 workers : int = 8,
+                 chunk_size : int = 256):
+        '''
+        Valida todos os XMLs de labels_path e, com fix, grava os XMLs corrigidos em output_dir.
+        Retorna o relatório: linhas (arquivo, índice do objeto, problema) e as contagens por problema.
+        '''
+        xml_paths = sorted(Path(labels_path).glob('*.xml'))
+        parsed = AnnotationValidator.parse_all(xml_paths, images_path, workers, chunk_size)
+        arrays = AnnotationValidator.concatenate(parsed)
+        issues = AnnotationValidator.check(arrays, tolerance)
+
+        rows = [(file.xml_path, -1, file.error.split(':')[0]) for file in parsed if file.error is not None]
+        object_offsets = np.cumsum([0] + [len(file.kinds) for file in parsed])
+        for issue in OBJECT_ISSUES:
+            for index in np.flatnonzero(issues[issue]):
+                file_id = arrays['file_ids'][index]
+                rows.append((parsed[file_id].xml_path, int(index - object_offsets[file_id]), issue))
+
+        counts = {issue: 0 for issue in FILE_ISSUES + OBJECT_ISSUES}
+        for _, _, issue in rows:
+            counts[issue] += 1
+        report = {'files': len(parsed), 'objects': len(arrays['kinds']), 'counts': counts, 'rows': rows}
+
+        if fix is not None:
+            if output_dir is None:
+                raise ValueError('Informe output_dir para gravar as anotações corrigidas')
+            points, dropped = AnnotationValidator.fix(arrays, issues, fix, tolerance)
+            object_points = np.split(points, np.cumsum(arrays['counts'])[:-1]) if len(arrays['counts']) else []
+
+            jobs = [(file.xml_path, Path(output_dir)/Path(file.xml_path).name,
+                     [polygon.tolist() for polygon in object_points[object_offsets[file_id]:object_offsets[file_id + 1]]],
+                     dropped[object_offsets[file_id]:object_offsets[file_id + 1]].tolist())
+                    for file_id, file in enumerate(parsed) if file.error is None]
+            chunks = [jobs[start:start + chunk_size] for start in range(0, len(jobs), chunk_size)]
+            from tqdm import tqdm
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(tqdm(executor.map(AnnotationValidator.write_fixed_files, chunks), total=len(chunks),
+                          desc=f'Gravando anotações corrigidas em {output_dir}'))
+
+            report['dropped'] = int(dropped.sum())
+
+        return report
+
+    @staticmethod
+    def print_report(report : dict):
+        print(f'\nArquivos: {report["files"]} | objetos: {report["objects"]}')
+        for issue, count in report['counts'].items():
+            print(f'\t{issue}: {count}')
+        if 'dropped' in report:
+            print(f'Objetos removidos na correção: {report["dropped"]}')
+
+    @staticmethod
+    def save_report(report : dict, path : str | Path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['xml_path', 'object_index', 'issue'])
+            writer.writerows(report['rows'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validação em lote das anotações cTDaR e PASCAL VOC.')
+    parser.add_argument('labels_path')
+    parser.add_argument('--images-path', default=None, help='imagens do cTDaR (padrão: o diretório dos XMLs)')
+    parser.add_argument('--fix', choices=['clip', 'drop'], default=None)
+    parser.add_argument('--output-dir', default=None, help='destino dos XMLs corrigidos')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='folga em pixels')
+    parser.add_argument('--report', default=None, help='CSV com um problema por linha')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    report = AnnotationValidator.validate(args.labels_path, args.images_path, args.fix, args.output_dir,
+                                          args.tolerance, args.workers)
+    AnnotationValidator.print_report(report)
+    if args.report is not None:
+        AnnotationValidator.save_report(report, args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+'''
+Tabelas de instâncias gravadas e lidas em blocos, com memória limitada.
+
+ChunkedTableWriter acumula as linhas de até chunk_size documentos em colunas e as descarrega de
+uma vez: no Parquet, cada descarga é um row group com tipos fixos (os do primeiro bloco ou os
+informados em dtypes); no CSV, um bloco de linhas acrescentado ao arquivo. Listas e dicionários
+são serializados em JSON, como na etapa write_metadata do pipeline, para que as duas saídas tenham
+o mesmo conteúdo. ChunkedTableReader percorre a tabela bloco a bloco (um row group do Parquet ou
+chunk_rows linhas do CSV por vez), de modo que a memória não depende do tamanho do conjunto.
+
+Uso:
+    with ChunkedTableWriter('fin_tab_net_dataset/train_dataset.parquet', chunk_size=500) as writer:
+        for rows in documentos:
+            writer.write(rows)
+
+    for chunk in ChunkedTableReader('fin_tab_net_dataset/train_dataset.parquet', columns=['filename', 'name']):
+        ...
+'''
+
+import os
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Literal
+
+from Instrumentation.spans import instrumented, add_bytes_written
+
+
+TABLE_FORMATS = ['parquet', 'csv']
+
+
+def get_table_format(path : str | Path, table_format : str = None):
+    if table_format is None:
+        table_format = Path(path).suffix[1:].lower()
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f'Formato de tabela inválido: {table_format} (use .parquet ou .csv)')
+    return table_format
+
+
+def serialize_value(value):
+    return json.dumps(value) if isinstance(value, (list, tuple, dict)) else value
+
+
+class ChunkedTableWriter:
+    '''
+    Grava linhas (dicionários) em blocos de chunk_size documentos. As colunas são as de columns
+    ou, se omitido, as do primeiro documento; chaves extras são ignoradas e as ausentes ficam vazias.
+    dtypes fixa o tipo Arrow de colunas do Parquet (ex.: {'xmin': 'float64'}); colunas sem tipo
+    informado e sem valores no primeiro bloco são gravadas como texto.
+    '''
+
+    def __init__(self,
+                 path : str | Path,
+                 chunk_size : int = 1000,
+                 columns : Iterable[str] = None,
+                 dtypes : Dict[str, str] = None,
+                 table_format : Literal['parquet', 'csv'] = None,
+                 compression : str = 'snappy'):
+
+        self.path = Path(path)
+        self.table_format = get_table_format(path, table_format)
+        self.chunk_size = chunk_size
+        self.columns = list(columns) if columns is not None else None
+        self.dtypes = dtypes or {}
+        self.compression = compression
+
+        self.buffer : Dict[str, list] = {}
+        self.buffered_documents = 0
+        self.n_rows = 0
+        self.n_chunks = 0
+
+        self.file = None
+        self.writer = None
+        self.schema = None
+
+        os.makedirs(self.path.parent, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, rows : Iterable[dict]):
+        '''
+        Acrescenta as linhas de um documento (uma lista vazia conta como documento sem linhas).
+        '''
+        for row in rows:
+            if self.columns is None:
+                self.columns = list(row.keys())
+            if not self.buffer:
+                self.buffer = {column: [] for column in self.columns}
+            for column in self.columns:
+                self.buffer[column].append(serialize_value(row.get(column)))
+
+        self.buffered_documents += 1
+        if self.buffered_documents >= self.chunk_size:
+            self.flush()
+
+    def write_row(self, row : dict):
+        self.write([row])
+
+    @instrumented('chunked_table.ChunkedTableWriter.flush')
+    def flush(self):
+        self.buffered_documents = 0
+        if not self.buffer or not len(next(iter(self.buffer.values()))):
+            return
+
+        n_rows = len(next(iter(self.buffer.values())))
+        if self.table_format == 'parquet':
+            self.flush_parquet()
+        else:
+            self.flush_csv()
+
+        self.n_rows += n_rows
+        self.n_chunks += 1
+        self.buffer = {}
+
+    def get_schema(self):
+        import pyarrow as pa
+
+        fields = []
+        for column in self.columns:
+            if column in self.dtypes:
+                data_type = pa.type_for_alias(self.dtypes[column])
+            else:
+                data_type = pa.array(self.buffer[column]).type
+                if pa.types.is_null(data_type):
+                    data_type = pa.string()
+            fields.append(pa.field(column, data_type))
+
+        return pa.schema(fields)
+
+    def flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.writer is None:
+            self.schema = self.get_schema()
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+
+        # cada descarga vira um row group com o esquema do arquivo (textos numéricos, como os
+        # valores lidos dos XMLs, são convertidos para o tipo da coluna)
+        table = pa.Table.from_pydict(self.buffer).cast(self.schema)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+
+    def flush_csv(self):
+        if self.file is None:
+            self.file = open(self.path, 'w', newline='')
+            # mesmo terminador de linha do DataFrame.to_csv, que esta escrita substitui
+            self.writer = csv.writer(self.file, lineterminator='\n')
+            self.writer.writerow(self.columns)
+
+        self.writer.writerows(zip(*(self.buffer[column] for column in self.columns)))
+
+    def close(self):
+        self.flush()
+
+        if self.writer is None and self.columns is not None:
+            # tabela vazia: apenas o esquema (Parquet) ou o cabeçalho (CSV)
+            self.buffer = {column: [] for column in self.columns}
+            if self.table_format == 'parquet':
+                import pyarrow.parquet as pq
+                self.schema = self.get_schema()
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+            else:
+                self.flush_csv()
+            self.buffer = {}
+
+        if self.file is not None:
+            self.file.close()
+        elif self.writer is not None:
+            self.writer.close()
+
+        if self.path.exists():
+            add_bytes_written(self.path.stat().st_size)
+        self.writer = self.file = None
+
+
+class ChunkedTableReader:
+    '''
+    Percorre uma tabela Parquet (um row group por vez) ou CSV (chunk_rows linhas por vez) sem
+    carregá-la inteira. Iterar produz DataFrames; iterate_rows produz dicionários.
+    '''
+
+    def __init__(self,
+                 path : str | Path,
+                 columns : Iterable[str] = None,
+                 chunk_rows : int = 50_000,
+                 table_format : Literal['parquet', 'csv'] = None):
+
+        self.path = Path(path)
+        self.table_format = get_table_format(path, table_format)
+        self.columns = list(columns) if columns is not None else None
+        self.chunk_rows = chunk_rows
+
+    def __len__(self):
+        '''
+        Quantidade de linhas (lida dos metadados do Parquet; no CSV, contada percorrendo o arquivo).
+        '''
+        if self.table_format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(self.path).metadata.num_rows
+
+        with open(self.path, 'r', newline='') as file:
+            return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+    def iterate_batches(self):
+        '''
+        Blocos da tabela como pyarrow.RecordBatch (Parquet) ou listas de dicionários (CSV).
+        '''
+        if self.table_format == 'parquet':
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(self.path)
+            for row_group in range(parquet_file.num_row_groups):
+                yield from parquet_file.read_row_group(row_group, columns=self.columns).to_batches()
+            return
+
+        with open(self.path, 'r', newline='') as file:
+            reader = csv.DictReader(file)
+            batch = []
+            for row in reader:
+                batch.append({column: row[column] for column in self.columns} if self.columns is not None else row)
+                if len(batch) >= self.chunk_rows:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def __iter__(self):
+        if self.table_format == 'parquet':
+            for batch in self.iterate_batches():
+                yield batch.to_pandas()
+            return
+
+        import pandas as pd
+        yield from pd.read_csv(self.path, usecols=self.columns, chunksize=self.chunk_rows)
+
+    def iterate_rows(self):
+        '''
+        Linhas como dicionários. No CSV, os valores são textos (como em csv.DictReader).
+        '''
+        for batch in self.iterate_batches():
+            yield from (batch.to_pylist() if self.table_format == 'parquet' else batch)
+
+
+def write_table(rows_by_document : Iterable[List[dict]], path : str | Path, chunk_size : int = 1000, **kwargs):
+    '''
+    Grava as linhas produzidas documento a documento e retorna a quantidade de linhas gravadas.
+    '''
+    with ChunkedTableWriter(path, chunk_size, **kwargs) as writer:
+        for rows in rows_by_document:
+            writer.write(rows)
+    return writer.n_rows
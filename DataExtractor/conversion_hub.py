@@ -0,0 +1,793 @@
+'''
+Conversão entre formatos de anotação (qualquer formato de entrada para qualquer formato de saída).
+
+Os leitores produzem, documento a documento, uma representação comum em arrays
+(AnnotationDocument) e os escritores a consomem, de modo que uma conversão percorre o corpus uma
+única vez, sem acumular o conjunto em memória. Formatos suportados, tanto na leitura quanto na escrita:
+
+    ctdar       XML do ICDAR 2019 cTDaR (tabelas e células poligonais)
+    voc         XML PASCAL VOC do FinTabNet.c (caixas)
+    yolo        TXT da Ultralytics, de segmentação ou de detecção
+    coco        JSON do COCO (um arquivo por split)
+    columnar    CSV com uma linha por objeto (filename, width, height, name, parent, xmin, ymin, xmax, ymax, points)
+                (ou Parquet com tipos, em row groups, quando o caminho termina em .parquet)
+
+As dimensões das imagens, necessárias para normalizar ou desnormalizar as coordenadas, são lidas
+apenas do cabeçalho e guardadas em um cache persistente (ImageSizeCache), validado pelo mtime.
+Os XMLs são lidos em paralelo por um pool de processos e os arquivos de saída, gravados por um
+pool de threads.
+
+Uso:
+    python -m DataExtractor.conversion_hub ctdar coco dataset/training/TRACKB1/ground_truth dataset_coco/train.json
+    python -m DataExtractor.conversion_hub voc yolo fin_tab_net_dataset/train labels/train --images-dir fin_tab_net_dataset/images \\
+        --task detect --classes table "table column" "table column header" "table projected row header" "table row" "table spanning cell"
+    python -m DataExtractor.conversion_hub yolo columnar dataset_folds/fold_1/train/labels fold_1_train.csv \\
+        --images-dir dataset_folds/fold_1/train/images --size-cache cache/image_sizes.json
+'''
+
+import os
+import csv
+import json
+import shutil
+import argparse
+import numpy as np
+import xml.etree.ElementTree as ET
+from PIL import Image
+from pathlib import Path
+from itertools import groupby
+from collections import deque
+from xml.sax.saxutils import escape, quoteattr
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Literal
+
+from .yolo_converter import YOLOConverter
+from .annotation_validator import IMAGE_EXTENSIONS, TABLE, CELL, iterate_objects, parse_points
+from .polygon_simplification import PolygonSimplifier
+from .chunked_table import ChunkedTableReader, ChunkedTableWriter
+from Instrumentation.spans import instrumented, add_bytes_written
+
+
+FORMATS = ['ctdar', 'voc', 'yolo', 'coco', 'columnar']
+
+# atributos estruturais das células do cTDaR preservados na conversão
+CELL_ATTRIBUTES = ('start-row', 'end-row', 'start-col', 'end-col')
+
+COLUMNAR_FIELDS = ['filename', 'width', 'height', 'name', 'parent', 'xmin', 'ymin', 'xmax', 'ymax', 'points']
+
+# tipos das colunas numéricas da saída colunar em Parquet
+COLUMNAR_DTYPES = {'width': 'float64', 'height': 'float64', 'parent': 'int64', 'xmin': 'float64', 'ymin': 'float64',
+                   'xmax': 'float64', 'ymax': 'float64', 'points': 'string'}
+
+
+@dataclass
+class AnnotationDocument:
+    '''
+    Anotações de uma imagem. Os pontos de todos os objetos ficam concatenados em points (em pixels
+    da imagem); counts[i] é a quantidade de pontos do objeto i e parents[i], o índice local do
+    objeto que o contém (a tabela de uma célula) ou -1. Objetos com 2 pontos são caixas dadas por
+    (xmin, ymin) e (xmax, ymax). width e height ficam None quando o formato de origem não os traz.
+    '''
+    name : str
+    names : np.ndarray
+    counts : np.ndarray
+    points : np.ndarray
+    parents : np.ndarray
+    width : float = None
+    height : float = None
+    image_path : str = None
+    source : str = None
+    attributes : List[dict] = None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get_bounds(self):
+        '''
+        (xmin, ymin, xmax, ymax) de cada objeto.
+        '''
+        bounds = np.zeros((len(self.counts), 4))
+        non_empty = self.counts > 0
+        starts = PolygonSimplifier.get_starts(self.counts)[non_empty]
+        if len(starts):
+            bounds[non_empty, :2] = np.minimum.reduceat(self.points, starts)
+            bounds[non_empty, 2:] = np.maximum.reduceat(self.points, starts)
+        return bounds
+
+    def get_polygons(self):
+        '''
+        (pontos, contagens) em que as caixas são substituídas pelos seus quatro cantos.
+        '''
+        is_box = self.counts == 2
+        if not is_box.any():
+            return self.points, self.counts
+
+        counts = np.where(is_box, 4, self.counts)
+        starts = PolygonSimplifier.get_starts(counts)
+        points = np.empty((counts.sum(), 2))
+
+        # posição de cada ponto original na nova concatenação
+        shift = np.repeat(starts - PolygonSimplifier.get_starts(self.counts), self.counts)
+        positions = np.arange(len(self.points)) + shift
+        kept = ~np.repeat(is_box, self.counts)
+        points[positions[kept]] = self.points[kept]
+
+        xmin, ymin, xmax, ymax = self.get_bounds()[is_box].T
+        corners = np.stack([np.stack([xmin, ymin], 1), np.stack([xmax, ymin], 1),
+                            np.stack([xmax, ymax], 1), np.stack([xmin, ymax], 1)], axis=1)
+        points[starts[is_box, None] + np.arange(4)] = corners
+
+        return points, counts
+
+    def select(self, keep : np.ndarray):
+        '''
+        Documento apenas com os objetos de keep (máscara booleana); os pais são reindexados.
+        '''
+        if keep.all():
+            return self
+        new_indices = np.cumsum(keep) - 1
+        parents = np.where(self.parents >= 0, new_indices[np.maximum(self.parents, 0)], -1)
+        parents[(self.parents >= 0) & ~keep[np.maximum(self.parents, 0)]] = -1
+
+        return AnnotationDocument(self.name, self.names[keep], self.counts[keep],
+                                  self.points[np.repeat(keep, self.counts)], parents[keep],
+                                  self.width, self.height, self.image_path, self.source,
+                                  [attributes for attributes, kept in zip(self.attributes, keep) if kept]
+                                  if self.attributes is not None else None)
+
+
+def make_document(name : str, names : list, counts : list, points : list, parents : list, **fields):
+    return AnnotationDocument(name, np.array(names, dtype=str), np.array(counts, dtype=np.int64),
+                              np.array(points, dtype=np.float64).reshape(-1, 2), np.array(parents, dtype=np.int64),
+                              **fields)
+
+
+def index_images(images_dir : str | Path):
+    '''
+    Caminho de cada imagem do diretório pelo nome sem extensão, em uma única listagem.
+    '''
+    if images_dir is None or not os.path.isdir(images_dir):
+        return {}
+    return {os.path.splitext(entry.name)[0]: entry.path for entry in os.scandir(images_dir)
+            if entry.is_file() and entry.name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS}
+
+
+def iterate_parallel(function : Callable[[list], list], items : list, workers : int = 8, chunk_size : int = 64):
+    '''
+    Aplica function a blocos de items em um pool de processos e devolve os resultados na ordem,
+    com no máximo 2 * workers blocos pendentes.
+    '''
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    if workers <= 1:
+        for chunk in chunks:
+            yield from function(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def format_number(value : float):
+    return str(int(value)) if float(value).is_integer() else f'{value:.2f}'
+
+
+class ImageSizeCache:
+    '''
+    Dimensões (largura, altura) das imagens, lidas apenas do cabeçalho e guardadas em um JSON
+    indexado pelo caminho. Uma entrada é relida quando o mtime da imagem muda.
+    '''
+
+    def __init__(self, path : str | Path = None):
+        self.path = Path(path) if path is not None else None
+        self.sizes = {}
+        self.changed = False
+        self.counters = {'hits': 0, 'misses': 0}
+
+        if self.path is not None and self.path.exists():
+            with open(self.path, 'r') as file:
+                self.sizes = json.load(file)
+
+    def get(self, image_path : str | Path):
+        key = Path(image_path).as_posix()
+        mtime = os.stat(image_path).st_mtime_ns
+        entry = self.sizes.get(key)
+
+        if entry is None or entry[0] != mtime:
+            with Image.open(image_path) as image:
+                entry = [mtime, *image.size]
+            self.sizes[key] = entry
+            self.changed = True
+            self.counters['misses'] += 1
+        else:
+            self.counters['hits'] += 1
+
+        return entry[1], entry[2]
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        os.makedirs(self.path.parent, exist_ok=True)
+        temporary_path = self.path.with_name(f'.{self.path.name}.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(self.sizes, file)
+        os.replace(temporary_path, self.path)
+        self.changed = False
+
+
+# ---------------------------------------------------------------------------------------
+# Leitores
+# ---------------------------------------------------------------------------------------
+
+def read_xml_file(xml_path : str):
+    '''
+    Lê um XML cTDaR ou VOC. No VOC, o pai de cada objeto é o primeiro objeto 'table' do arquivo,
+    como em AnnotationValidator.parse_file.
+    '''
+    root = ET.parse(xml_path).getroot()
+    names, parents, counts, points, attributes = [], [], [], [], []
+    table_indices = {}
+    voc_table_index = -1
+
+    for index, (coords, element, parent_element, kind, name) in enumerate(iterate_objects(root)):
+        object_points = parse_points(coords, kind)
+        if kind == TABLE:
+            table_indices[element] = index
+            names.append('table')
+            parents.append(-1)
+            attributes.append({})
+        elif kind == CELL:
+            names.append('cell')
+            parents.append(table_indices.get(parent_element, -1))
+            attributes.append({key: element.get(key) for key in CELL_ATTRIBUTES if element.get(key) is not None})
+        else:
+            if name == 'table' and voc_table_index < 0:
+                voc_table_index = index
+            names.append(name)
+            parents.append(-1 if name == 'table' else voc_table_index)
+        counts.append(len(object_points))
+        points.extend(object_points)
+
+    if root.tag == 'annotation':
+        parents = np.array(parents, dtype=np.int64)
+        if voc_table_index >= 0:
+            parents[(parents < 0) & (np.array(names) != 'table')] = voc_table_index
+        width, height = float(root.findtext('size/width') or 0), float(root.findtext('size/height') or 0)
+        return make_document(root.findtext('filename') or f'{Path(xml_path).stem}.jpg', names, counts, points, parents,
+                             width=width or None, height=height or None, source=xml_path)
+
+    return make_document(root.get('filename') or f'{Path(xml_path).stem}.jpg', names, counts, points, parents,
+                         source=xml_path, attributes=attributes)
+
+
+def read_xml_files(xml_paths : List[str]):
+    return [read_xml_file(xml_path) for xml_path in xml_paths]
+
+
+class XMLReader:
+    '''
+    Leitor dos XMLs cTDaR e VOC de um diretório (o formato é identificado pela raiz de cada arquivo).
+    images_path é usado apenas para localizar as imagens quando o escritor precisa das dimensões.
+    '''
+
+    def __init__(self, labels_path : str | Path, images_path : str | Path = None, workers : int = 8, chunk_size : int = 64):
+        self.xml_paths = sorted(entry.path for entry in os.scandir(labels_path) if entry.name.lower().endswith('.xml'))
+        self.images = index_images(images_path if images_path is not None else labels_path)
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.xml_paths)
+
+    def __iter__(self):
+        for document in iterate_parallel(read_xml_files, self.xml_paths, self.workers, self.chunk_size):
+            document.image_path = self.images.get(Path(document.name).stem) or self.images.get(Path(document.source).stem)
+            yield document
+
+
+def read_yolo_file(txt_path : str | Path):
+    '''
+    Lê um TXT da Ultralytics de uma só vez: devolve (classes, contagens, pontos normalizados).
+    Linhas com 4 coordenadas são caixas (xcentral, ycentral, largura, altura) e viram dois cantos.
+    '''
+    with open(txt_path, 'r') as file:
+        lines = [line for line in file.read().splitlines() if line.strip()]
+
+    lengths = np.array([len(line.split()) for line in lines], dtype=np.int64)
+    values = np.array(' '.join(lines).split(), dtype=np.float64)
+    starts = np.cumsum(lengths) - lengths
+
+    class_ids = values[starts].astype(np.int64)
+    counts = (lengths - 1) // 2
+    points = np.delete(values, starts).reshape(-1, 2)
+
+    is_box = np.repeat(counts == 2, counts)
+    if is_box.any():
+        centers, sizes = points[is_box][0::2], points[is_box][1::2]
+        points[is_box] = np.stack([centers - sizes / 2, centers + sizes / 2], axis=1).reshape(-1, 2)
+
+    return class_ids, counts, points
+
+
+class YOLOReader:
+    '''
+    Leitor de um split no formato da Ultralytics: um documento por imagem de images_path, com o
+    TXT de mesmo nome em labels_path (imagens sem TXT geram documentos vazios). class_names[i] é o
+    nome da classe i; classes fora da lista são nomeadas pelo próprio índice.
+    '''
+
+    def __init__(self, labels_path : str | Path, images_path : str | Path = None, class_names : Iterable[str] = ('cell',),
+                 size_cache : ImageSizeCache = None):
+        self.labels_path = Path(labels_path)
+        images_path = images_path if images_path is not None else self.labels_path.parent/'images'
+        self.images = sorted(index_images(images_path).items())
+        self.class_names = list(class_names)
+        self.size_cache = size_cache if size_cache is not None else ImageSizeCache()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        for stem, image_path in self.images:
+            width, height = self.size_cache.get(image_path)
+            txt_path = self.labels_path/f'{stem}.txt'
+            if txt_path.exists():
+                class_ids, counts, points = read_yolo_file(txt_path)
+            else:
+                class_ids, counts, points = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, 2))
+
+            class_names = self.class_names + [str(class_id) for class_id in range(len(self.class_names), class_ids.max(initial=-1) + 1)]
+            yield AnnotationDocument(os.path.basename(image_path), np.array(class_names, dtype=str)[class_ids],
+                                     counts, points * [width, height], np.full(len(counts), -1, dtype=np.int64),
+                                     width, height, image_path, txt_path.as_posix())
+
+
+class COCOReader:
+    '''
+    Leitor de um JSON do COCO. Usa o primeiro polígono de cada anotação ou, na ausência de
+    segmentação poligonal (RLE), a caixa.
+    '''
+
+    def __init__(self, json_path : str | Path, images_path : str | Path = None):
+        with open(json_path, 'r') as file:
+            self.coco = json.load(file)
+        self.categories = {category['id']: category['name'] for category in self.coco.get('categories', [])}
+        self.images = index_images(images_path)
+
+    def __len__(self):
+        return len(self.coco['images'])
+
+    def __iter__(self):
+        annotations = self.coco.get('annotations', [])
+        image_ids = np.array([annotation['image_id'] for annotation in annotations])
+        order = np.argsort(image_ids, kind='stable')
+        sorted_ids = image_ids[order]
+
+        for image in self.coco['images']:
+            start, end = np.searchsorted(sorted_ids, image['id'], 'left'), np.searchsorted(sorted_ids, image['id'], 'right')
+            names, counts, points = [], [], []
+            for index in order[start:end]:
+                annotation = annotations[index]
+                polygons = annotation.get('segmentation')
+                if isinstance(polygons, list) and polygons and len(polygons[0]) >= 6:
+                    object_points = polygons[0]
+                else:
+                    x, y, width, height = annotation['bbox']
+                    object_points = [x, y, x + width, y + height]
+                names.append(self.categories.get(annotation['category_id'], str(annotation['category_id'])))
+                counts.append(len(object_points) // 2)
+                points.extend(object_points)
+
+            yield make_document(image['file_name'], names, counts, points, [-1] * len(counts),
+                                width=image.get('width'), height=image.get('height'),
+                                image_path=self.images.get(Path(image['file_name']).stem))
+
+
+class ColumnarReader:
+    '''
+    Leitor do CSV com uma linha por objeto, agrupando as linhas consecutivas de uma mesma imagem.
+    Aceita também os CSVs de instâncias do FinTabNet (sem as colunas parent e points).
+    '''
+
+    def __init__(self, csv_path : str | Path, images_path : str | Path = None):
+        self.csv_path = csv_path
+        self.images = index_images(images_path)
+
+    def __iter__(self):
+        # o CSV ou o Parquet (row group a row group) é percorrido sem ser carregado inteiro
+        table_format = 'parquet' if Path(self.csv_path).suffix.lower() == '.parquet' else 'csv'
+        for filename, rows in groupby(ChunkedTableReader(self.csv_path, table_format=table_format).iterate_rows(),
+                                      key=lambda row: row['filename']):
+            names, counts, points, parents = [], [], [], []
+            width = height = None
+            for row in rows:
+                width, height = float(row.get('width') or 0) or None, float(row.get('height') or 0) or None
+                if not row.get('name'):
+                    continue
+                if row.get('points'):
+                    object_points = json.loads(row['points'])
+                else:
+                    object_points = [[float(row['xmin']), float(row['ymin'])], [float(row['xmax']), float(row['ymax'])]]
+                names.append(row['name'])
+                counts.append(len(object_points))
+                points.extend(object_points)
+                parents.append(int(row['parent']) if row.get('parent') not in (None, '') else -1)
+
+            yield make_document(filename, names, counts, points, parents, width=width, height=height,
+                                image_path=self.images.get(Path(filename).stem))
+
+
+# ---------------------------------------------------------------------------------------
+# Escritores
+# ---------------------------------------------------------------------------------------
+
+class FileWriter:
+    '''
+    Base dos escritores de um arquivo por documento: o conteúdo é formatado na thread chamadora e
+    gravado por um pool de threads, com no máximo 4 * workers arquivos pendentes.
+    '''
+    needs_size = False
+
+    def __init__(self, output_dir : str | Path, workers : int = 8):
+        self.output_dir = Path(output_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = deque()
+
+    def submit(self, file_name : str, content : str):
+        self.pending.append(self.executor.submit(YOLOConverter.save_file, content, self.output_dir/file_name))
+        if len(self.pending) >= 4 * self.workers:
+            self.pending.popleft().result()
+
+    def close(self):
+        while self.pending:
+            self.pending.popleft().result()
+        self.executor.shutdown()
+
+
+def assign_tables(cell_boxes : np.ndarray, table_boxes : np.ndarray, min_overlap : float = 0.5):
+    '''
+    Índice da tabela cuja caixa contém a maior fração da caixa de cada célula, ou -1 quando
+    nenhuma contém ao menos min_overlap. Uma única operação sobre a matriz células x tabelas.
+    '''
+    if not len(cell_boxes) or not len(table_boxes):
+        return np.full(len(cell_boxes), -1, dtype=np.int64)
+
+    top_left = np.maximum(cell_boxes[:, None, :2], table_boxes[None, :, :2])
+    bottom_right = np.minimum(cell_boxes[:, None, 2:], table_boxes[None, :, 2:])
+    intersections = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    cell_areas = np.maximum((cell_boxes[:, 2:] - cell_boxes[:, :2]).prod(axis=1), 1e-9)
+
+    fractions = intersections / cell_areas[:, None]
+    best = fractions.argmax(axis=1)
+    return np.where(fractions[np.arange(len(cell_boxes)), best] >= min_overlap, best, -1)
+
+
+class CTDaRWriter(FileWriter):
+    '''
+    Grava os objetos 'table' e os de cell_names (como células) no XML cTDaR, com coordenadas
+    inteiras. As células sem tabela (os leitores COCO, YOLO e colunar sem a coluna parent não
+    trazem a hierarquia) são atribuídas à tabela cuja caixa contém a maior fração da sua caixa ou,
+    se nenhuma contém ao menos min_overlap, à de centro mais próximo. Somente páginas sem
+    nenhuma tabela recebem uma tabela envolvente.
+    '''
+
+    def __init__(self, output_dir : str | Path, cell_names : Iterable[str] = ('cell',), workers : int = 8,
+                 min_overlap : float = 0.5):
+        super().__init__(output_dir, workers)
+        self.cell_names = list(cell_names)
+        self.min_overlap = min_overlap
+
+    @staticmethod
+    def format_polygons(points : np.ndarray, counts : np.ndarray):
+        pairs = [f'{x},{y}' for x, y in np.rint(points).astype(np.int64).tolist()]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).tolist()
+        return [' '.join(pairs[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def create_content(self, document : AnnotationDocument):
+        is_table = document.names == 'table'
+        is_cell = np.isin(document.names, self.cell_names)
+        points, counts = document.get_polygons()
+        polygons = CTDaRWriter.format_polygons(points, counts)
+
+        cell_tables = np.where(is_cell & (document.parents >= 0), document.parents, -1)
+        cell_tables[cell_tables >= 0] = np.where(is_table[cell_tables[cell_tables >= 0]], cell_tables[cell_tables >= 0], -1)
+
+        table_indices = np.flatnonzero(is_table)
+        orphans = is_cell & (cell_tables < 0)
+        if orphans.any() and len(table_indices):
+            bounds = document.get_bounds()
+            assigned = assign_tables(bounds[orphans], bounds[table_indices], self.min_overlap)
+            outside = assigned < 0
+            if outside.any():
+                cell_centers = (bounds[orphans][outside, :2] + bounds[orphans][outside, 2:]) / 2
+                table_centers = (bounds[table_indices, :2] + bounds[table_indices, 2:]) / 2
+                distances = np.linalg.norm(cell_centers[:, None] - table_centers[None], axis=2)
+                assigned[outside] = distances.argmin(axis=1)
+            cell_tables[orphans] = table_indices[assigned]
+            orphans[:] = False
+
+        tables = [(index, polygons[index]) for index in table_indices]
+        if orphans.any():
+            xmin, ymin = document.get_bounds()[orphans, :2].min(axis=0)
+            xmax, ymax = document.get_bounds()[orphans, 2:].max(axis=0)
+            tables.append((-1, CTDaRWriter.format_polygons(np.array([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]]), [4])[0]))
+
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<document filename={quoteattr(document.name)}>']
+        for table_number, (table_index, table_polygon) in enumerate(tables, start=1):
+            lines.append(f'  <table id="Table_{table_number}">')
+            lines.append(f'    <Coords points="{table_polygon}"/>')
+            for cell_number, cell_index in enumerate(np.flatnonzero(is_cell & (cell_tables == table_index)), start=1):
+                attributes = document.attributes[cell_index] if document.attributes is not None else {}
+                attributes = ''.join(f' {key}="{attributes[key]}"' for key in CELL_ATTRIBUTES if key in attributes)
+                lines.append(f'    <cell id="TableCell_{table_number}_{cell_number}"{attributes}>')
+                lines.append(f'      <Coords points="{polygons[cell_index]}"/>')
+                lines.append('    </cell>')
+            lines.append('  </table>')
+        lines.append('</document>')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, document : AnnotationDocument):
+        self.submit(f'{Path(document.name).stem}.xml', self.create_content(document))
+
+
+class VOCWriter(FileWriter):
+    '''
+    Grava a caixa envolvente de cada objeto no XML PASCAL VOC, como no FinTabNet.c.
+    '''
+    needs_size = True
+
+    def __init__(self, output_dir : str | Path, database : str = 'FinTabNet.c', depth : int = 3, workers : int = 8):
+        super().__init__(output_dir, workers)
+        self.database = database
+        self.depth = depth
+
+    def create_content(self, document : AnnotationDocument):
+        lines = ['<annotation>', '  <folder/>', f'  <filename>{escape(document.name)}</filename>',
+                 f'  <path>{escape(document.name)}</path>', '  <source>', f'    <database>{escape(self.database)}</database>',
+                 '  </source>', '  <size>', f'    <width>{format_number(document.width)}</width>',
+                 f'    <height>{format_number(document.height)}</height>', f'    <depth>{self.depth}</depth>',
+                 '  </size>', '  <segmented>0</segmented>']
+
+        for name, bounds in zip(document.names.tolist(), document.get_bounds().tolist()):
+            xmin, ymin, xmax, ymax = map(format_number, bounds)
+            lines += ['  <object>', f'    <name>{escape(name)}</name>', '    <pose>Frontal</pose>',
+                      '    <truncated>0</truncated>', '    <difficult>0</difficult>', '    <occluded>0</occluded>',
+                      '    <bndbox>', f'      <xmin>{xmin}</xmin>', f'      <ymin>{ymin}</ymin>',
+                      f'      <xmax>{xmax}</xmax>', f'      <ymax>{ymax}</ymax>', '    </bndbox>', '  </object>']
+        lines.append('</annotation>')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, document : AnnotationDocument):
+        self.submit(f'{Path(document.name).stem}.xml', self.create_content(document))
+
+
+class YOLOWriter(FileWriter):
+    '''
+    Grava os TXTs da Ultralytics apenas com os objetos das classes de class_map (nome -> índice):
+    polígonos normalizados (task='segment', caixas viram quatro cantos) ou caixas (task='detect').
+    '''
+    needs_size = True
+
+    def __init__(self, labels_dir : str | Path, class_map : Dict[str, int] = None,
+                 task : Literal['segment', 'detect'] = 'segment', workers : int = 8):
+        super().__init__(labels_dir, workers)
+        self.class_map = class_map if class_map is not None else {'cell': 0}
+        self.task = task
+
+    def create_content(self, document : AnnotationDocument):
+        document = document.select(np.isin(document.names, list(self.class_map)))
+        class_ids = [self.class_map[name] for name in document.names.tolist()]
+        image_size = np.array([document.width, document.height], dtype=np.float64)
+
+        if self.task == 'detect':
+            yolo_boxes = YOLOConverter.convert_boxes_xy2yolo(document.get_bounds(), image_size)
+            return YOLOConverter.create_bbox_txt_file_content(yolo_boxes.tolist(), class_ids)
+
+        points, counts = document.get_polygons()
+        masks = PolygonSimplifier.unpack(points / image_size, counts)
+        return YOLOConverter.create_mask_txt_file_content(masks, class_ids)
+
+    def write(self, document : AnnotationDocument):
+        self.submit(f'{Path(document.name).stem}.txt', self.create_content(document))
+
+
+class COCOWriter:
+    '''
+    Grava um JSON do COCO sem manter o split em memória: as imagens e as anotações são escritas
+    em arquivos temporários à medida que chegam e concatenadas no fechamento. Os ids das
+    categorias são os de class_map (como em YOLO2MaskRCNN); objetos de outras classes são ignorados.
+    '''
+    needs_size = True
+
+    def __init__(self, json_path : str | Path, class_map : Dict[str, int] = None):
+        self.json_path = Path(json_path)
+        os.makedirs(self.json_path.parent, exist_ok=True)
+        self.class_map = class_map if class_map is not None else {'cell': 0}
+
+        self.images_file = open(self.json_path.with_name(f'.{self.json_path.name}.images.tmp'), 'w+')
+        self.annotations_file = open(self.json_path.with_name(f'.{self.json_path.name}.annotations.tmp'), 'w+')
+        self.image_id = 0
+        self.annotation_id = 0
+
+    def write(self, document : AnnotationDocument):
+        document = document.select(np.isin(document.names, list(self.class_map)))
+        self.image_id += 1
+        image = {'id': self.image_id, 'file_name': document.name, 'width': document.width, 'height': document.height}
+        self.images_file.write(('' if self.image_id == 1 else ',') + json.dumps(image))
+
+        if not len(document):
+            return
+
+        points, counts = document.get_polygons()
+        areas = np.round(PolygonSimplifier.polygon_areas(points, counts), 2).tolist()
+        bounds = document.get_bounds()
+        boxes = np.round(np.column_stack([bounds[:, :2], bounds[:, 2:] - bounds[:, :2]]), 2).tolist()
+        offsets = np.concatenate([[0], np.cumsum(counts)]).tolist()
+        coordinates = np.round(points, 2).reshape(-1).tolist()
+
+        # um único json.dumps por documento
+        annotations = []
+        for name, box, area, start, end in zip(document.names.tolist(), boxes, areas, offsets[:-1], offsets[1:]):
+            self.annotation_id += 1
+            annotations.append({'id': self.annotation_id, 'image_id': self.image_id, 'category_id': self.class_map[name],
+                                'bbox': box, 'area': area, 'segmentation': [coordinates[2 * start:2 * end]], 'iscrowd': 0})
+        self.annotations_file.write(('' if self.annotation_id == len(annotations) else ',') + json.dumps(annotations)[1:-1])
+
+    def close(self):
+        categories = [{'id': class_id, 'name': name} for name, class_id in sorted(self.class_map.items(), key=lambda item: item[1])]
+        with open(self.json_path, 'w') as file:
+            file.write('{"images": [')
+            for temporary_file in (self.images_file, self.annotations_file):
+                temporary_file.seek(0)
+                shutil.copyfileobj(temporary_file, file)
+                if temporary_file is self.images_file:
+                    file.write('], "annotations": [')
+            file.write(f'], "categories": {json.dumps(categories)}}}')
+            add_bytes_written(file.tell())
+
+        for temporary_file in (self.images_file, self.annotations_file):
+            temporary_file.close()
+            os.remove(temporary_file.name)
+
+
+class ColumnarWriter:
+    '''
+    Grava o CSV com uma linha por objeto (e uma linha sem objeto para imagens sem anotações).
+    As colunas filename, name, xmin, ymin, xmax, ymax, width e height são as mesmas dos CSVs de
+    instâncias do FinTabNet, lidos por FinTabNetYOLOConverter.process_split. Com a extensão
+    .parquet, as linhas são gravadas com tipo em row groups de chunk_size documentos.
+    '''
+    needs_size = True
+
+    def __init__(self, csv_path : str | Path, chunk_size : int = 1000):
+        os.makedirs(Path(csv_path).parent, exist_ok=True)
+        self.table = None
+        if Path(csv_path).suffix.lower() == '.parquet':
+            self.table = ChunkedTableWriter(csv_path, chunk_size, columns=COLUMNAR_FIELDS, dtypes=COLUMNAR_DTYPES)
+            return
+        self.file = open(csv_path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNAR_FIELDS)
+
+    def write(self, document : AnnotationDocument):
+        width, height = format_number(document.width), format_number(document.height)
+        if not len(document):
+            rows = [[document.name, width, height, '', '', '', '', '', '', '']]
+        else:
+            bounds = document.get_bounds().tolist()
+            polygons = PolygonSimplifier.unpack(document.points, document.counts)
+            rows = [[document.name, width, height, name, parent, *map(format_number, box),
+                     json.dumps(polygon, separators=(',', ':'))]
+                    for name, parent, box, polygon in zip(document.names.tolist(), document.parents.tolist(),
+                                                          bounds, polygons)]
+
+        if self.table is not None:
+            self.table.write([{field: value if value != '' else None for field, value in zip(COLUMNAR_FIELDS, row)}
+                              for row in rows])
+        else:
+            self.writer.writerows(rows)
+
+    def close(self):
+        if self.table is not None:
+            self.table.close()
+            return
+        add_bytes_written(self.file.tell())
+        self.file.close()
+
+
+# ---------------------------------------------------------------------------------------
+# Conversão
+# ---------------------------------------------------------------------------------------
+
+class AnnotationConverter:
+
+    @staticmethod
+    def create_reader(input_format : str, input_path : str | Path, images_path : str | Path = None,
+                      class_names : Iterable[str] = ('cell',), size_cache : ImageSizeCache = None, workers : int = 8):
+        if input_format in ('ctdar', 'voc'):
+            return XMLReader(input_path, images_path, workers)
+        if input_format == 'yolo':
+            return YOLOReader(input_path, images_path, class_names, size_cache)
+        if input_format == 'coco':
+            return COCOReader(input_path, images_path)
+        if input_format == 'columnar':
+            return ColumnarReader(input_path, images_path)
+        raise ValueError(f'Formato de entrada inválido: {input_format}')
+
+    @staticmethod
+    def create_writer(output_format : str, output_path : str | Path, class_names : Iterable[str] = ('cell',),
+                      task : Literal['segment', 'detect'] = 'segment', workers : int = 8):
+        class_map = {name: class_id for class_id, name in enumerate(class_names)}
+        if output_format == 'ctdar':
+            return CTDaRWriter(output_path, [name for name in class_names if name != 'table'], workers)
+        if output_format == 'voc':
+            return VOCWriter(output_path, workers=workers)
+        if output_format == 'yolo':
+            return YOLOWriter(output_path, class_map, task, workers)
+        if output_format == 'coco':
+            return COCOWriter(output_path, class_map)
+        if output_format == 'columnar':
+            return ColumnarWriter(output_path)
+        raise ValueError(f'Formato de saída inválido: {output_format}')
+
+    @staticmethod
+    @instrumented('conversion_hub.AnnotationConverter.convert', items=lambda n_documents: n_documents)
+    def convert(reader : Iterable[AnnotationDocument], writer, size_cache : ImageSizeCache = None):
+        '''
+        Passa cada documento do leitor ao escritor, completando as dimensões ausentes pelo cache
+        quando o escritor precisa delas. Retorna a quantidade de documentos convertidos.
+        '''
+        from tqdm import tqdm
+
+        size_cache = size_cache if size_cache is not None else ImageSizeCache()
+        n_documents = 0
+        try:
+            total = len(reader) if hasattr(reader, '__len__') else None
+            for document in tqdm(reader, total=total, desc='Convertendo anotações'):
+                if writer.needs_size and (document.width is None or document.height is None):
+                    if document.image_path is None:
+                        raise ValueError(f'Dimensões da imagem {document.name} desconhecidas: informe o diretório das imagens.')
+                    document.width, document.height = size_cache.get(document.image_path)
+                writer.write(document)
+                n_documents += 1
+        finally:
+            writer.close()
+            size_cache.save()
+
+        return n_documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converte anotações entre os formatos cTDaR, VOC, YOLO, COCO e colunar.')
+    parser.add_argument('input_format', choices=FORMATS)
+    parser.add_argument('output_format', choices=FORMATS)
+    parser.add_argument('input_path', help='diretório dos XMLs/TXTs, JSON do COCO ou CSV colunar')
+    parser.add_argument('output_path', help='diretório dos XMLs/TXTs, JSON do COCO ou CSV colunar')
+    parser.add_argument('--images-dir', default=None, help='diretório das imagens (dimensões)')
+    parser.add_argument('--classes', nargs='+', default=['cell'], help='nomes das classes, na ordem dos índices YOLO/COCO')
+    parser.add_argument('--task', choices=['segment', 'detect'], default='segment')
+    parser.add_argument('--size-cache', default=None, help='JSON com as dimensões das imagens já lidas')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    size_cache = ImageSizeCache(args.size_cache)
+    reader = AnnotationConverter.create_reader(args.input_format, args.input_path, args.images_dir, args.classes,
+                                               size_cache, args.workers)
+    writer = AnnotationConverter.create_writer(args.output_format, args.output_path, args.classes, args.task, args.workers)
+    n_documents = AnnotationConverter.convert(reader, writer, size_cache)
+
+    print(f'\n{n_documents} documentos convertidos de {args.input_format} para {args.output_format} em: {args.output_path}')
+    print(f'Cache de dimensões: {size_cache.counters["hits"]} acertos, {size_cache.counters["misses"]} leituras de cabeçalho')
+
+
+if __name__ == '__main__':
+    main()
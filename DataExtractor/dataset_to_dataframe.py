@@ -1,15 +1,24 @@
 import os
-import shutil
 import xml.etree.ElementTree as ET
 from PIL import Image
-from glob import glob
 
-import pandas as pd
 from pathlib import Path
-from typing import Iterable, Tuple
-from tqdm import tqdm
 
 from .file_finder import FileFinder
+from .chunked_table import ChunkedTableWriter
+from Instrumentation.spans import instrumented, add_bytes_read, is_enabled
+
+
+ICDAR_DTYPES = {'image_width': 'int64', 'image_height': 'int64', 'class_id': 'int64', 'xy': 'string'}
+
+FINTABNET_OBJECT_PROPERTIES = ['name', 'pose', 'truncated', 'difficult', 'occluded']
+FINTABNET_BOX_PROPERTIES = ['xmin', 'ymin', 'xmax', 'ymax']
+FINTABNET_COLUMNS = ['filename', 'path', 'segmented', 'database', 'width', 'height', 'depth', 'split',
+                     *FINTABNET_OBJECT_PROPERTIES, *FINTABNET_BOX_PROPERTIES]
+# os valores dos XMLs são textos; no Parquet, as colunas numéricas são gravadas com tipo
+FINTABNET_DTYPES = {'segmented': 'int64', 'width': 'float64', 'height': 'float64', 'depth': 'int64',
+                    'truncated': 'int64', 'difficult': 'int64', 'occluded': 'int64',
+                    'xmin': 'float64', 'ymin': 'float64', 'xmax': 'float64', 'ymax': 'float64'}
 
 
 class ConvertICDARDatasetToDataframe:
@@ -45,11 +54,15 @@ class ConvertICDARDatasetToDataframe:
         return FileFinder.associate_files_by_name(self.image_files, self.label_files)
     
     
+    @instrumented('dataset_to_dataframe.get_xy_annotations_from_xml', items=len)
     def get_xy_annotations_from_xml(self, xml_path : str | Path = None):
         '''
         Acessa os arquivos XML, extraindo as anotações no formato XY.
         '''
         
+        if is_enabled():
+            add_bytes_read(os.path.getsize(xml_path))
+
         tree = ET.parse(xml_path) # abre o arquivo XML
         root = tree.getroot() # encontra a raiz
         
@@ -71,7 +84,11 @@ class ConvertICDARDatasetToDataframe:
                                  
         return lines
     
+    @instrumented('dataset_to_dataframe.generate_dataframe', items=len)
     def generate_dataframe(self):
+        # importados aqui para que a leitura das anotações não dependa do pandas
+        import pandas as pd
+        from tqdm import tqdm
 
         print('Gerando DataFrame do conjnuto de dados...')
         df_pairs = pd.DataFrame(self.pairs_image_label, columns=['image_path', 'label_path'])
@@ -93,3 +110,80 @@ class ConvertICDARDatasetToDataframe:
         df_pairs['xy'] = xy_annotations
 
         return df_pairs
+
+    def iterate_rows(self):
+        '''
+        Linhas do DataFrame de generate_dataframe, uma por par imagem/XML, sem acumulá-las.
+        '''
+        for image_path, label_path in self.pairs_image_label:
+            image_width, image_height = self.get_image_shape(image_path)
+            yield {'image_path': image_path,
+                   'label_path': label_path,
+                   'image_width': image_width,
+                   'image_height': image_height,
+                   'class_id': self.class_id,
+                   'class_label': self.class_label,
+                   'xy': self.get_xy_annotations_from_xml(label_path)}
+
+    @instrumented('dataset_to_dataframe.write_table', items=lambda n_rows: n_rows)
+    def write_table(self, output_path : str | Path, chunk_size : int = 500):
+        '''
+        Grava as linhas de generate_dataframe em Parquet ou CSV (pela extensão de output_path),
+        descarregando-as a cada chunk_size imagens. A coluna xy é serializada em JSON.
+        Retorna a quantidade de linhas gravadas.
+        '''
+        from tqdm import tqdm
+
+        with ChunkedTableWriter(output_path, chunk_size, dtypes=ICDAR_DTYPES) as writer:
+            for row in tqdm(self.iterate_rows(), total=len(self.pairs_image_label), desc='Gravando a tabela do conjunto...'):
+                writer.write_row(row)
+
+        return writer.n_rows
+
+
+class ConvertFinTabNetDatasetToTable:
+    '''
+    Tabela de instâncias de um split do FinTabNet.c (uma linha por objeto dos XMLs VOC), com as
+    mesmas colunas do {split}_dataset.csv gerado no notebook dataset_generation_fintab.ipynb.
+    '''
+
+    def __init__(self, labels_path : str | Path, split : str):
+        self.labels_path = labels_path
+        self.split = split
+        self.label_files = FileFinder.find_files(labels_path, format_list=['xml'])
+
+    @staticmethod
+    def get_instances_from_xml(xml_path : str | Path, split : str):
+        root = ET.parse(xml_path).getroot()
+
+        # findtext retorna '' para tags vazias (ex.: <difficult/>), que o cast para FINTABNET_DTYPES não aceita
+        def find_text(element, name):
+            return element.findtext(name) or None
+
+        file_metadata = {name: find_text(root, name) for name in ('filename', 'path', 'segmented')}
+        file_metadata['database'] = find_text(root, 'source/database')
+        file_metadata.update({name: find_text(root, f'size/{name}') for name in ('width', 'height', 'depth')})
+        file_metadata['split'] = split
+
+        instances = []
+        for object_element in root.findall('object'):
+            object_metadata = {name: find_text(object_element, name) for name in FINTABNET_OBJECT_PROPERTIES}
+            object_metadata.update({name: find_text(object_element, f'bndbox/{name}') for name in FINTABNET_BOX_PROPERTIES})
+            instances.append(file_metadata | object_metadata)
+
+        return instances
+
+    @instrumented('dataset_to_dataframe.ConvertFinTabNetDatasetToTable.write_table', items=lambda n_rows: n_rows)
+    def write_table(self, output_path : str | Path, chunk_size : int = 1000):
+        '''
+        Grava as instâncias em Parquet ou CSV (pela extensão de output_path), descarregando-as a
+        cada chunk_size XMLs; cada row group do Parquet contém apenas imagens completas.
+        Retorna a quantidade de linhas gravadas.
+        '''
+        from tqdm import tqdm
+
+        with ChunkedTableWriter(output_path, chunk_size, columns=FINTABNET_COLUMNS, dtypes=FINTABNET_DTYPES) as writer:
+            for xml_path in tqdm(self.label_files, desc=f'Gerando a tabela do split: {self.split}...'):
+                writer.write(self.get_instances_from_xml(xml_path, self.split))
+
+        return writer.n_rows
@@ -3,11 +3,13 @@ import re
 from glob import glob
 from pathlib import Path
 from typing import Iterable
-from tqdm import tqdm
+
+from Instrumentation.spans import instrumented
 
 class FileFinder: 
 
     @staticmethod
+    @instrumented('file_finder.find_files', items=len)
     def find_files(dir_path : str | Path, 
                    format_list : Iterable[str], 
                    sort : bool = True):
@@ -22,10 +24,12 @@ class FileFinder:
         return files
     
     @staticmethod
+    @instrumented('file_finder.associate_files_by_name', items=len)
     def associate_files_by_name(first_files_list : Iterable[str | Path], 
                                 second_files_list : Iterable[str | Path]):
         
-        
+        from tqdm import tqdm
+
         pairs = []
 
 
@@ -0,0 +1,230 @@
+'''
+Cache de imagens pré-decodificadas em um único arquivo mapeado em memória.
+
+As imagens de um split são decodificadas uma única vez para um tensor uint8 N x H x W x C gravado
+como .npy (lido com np.memmap), acompanhado de um índice JSON com os caminhos originais. A leitura
+devolve visões do arquivo mapeado, sem cópia e sem decodificação de JPEG, e as páginas mais usadas
+ficam no cache de páginas do sistema operacional entre épocas e processos.
+
+Estrutura gerada:
+    cache/fold_1_train.npy    tensor N x 640 x 640 x C
+    cache/fold_1_train.json   índice (caminhos, dimensões originais, modo de cor)
+
+Uso:
+    python -m DataExtractor.image_cache build dataset_folds/fold_1/train/images cache/fold_1_train
+    python -m DataExtractor.image_cache info cache/fold_1_train
+'''
+
+import os
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+from tqdm import tqdm
+
+from Instrumentation.spans import instrumented, add_bytes_written, is_enabled
+
+
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp', 'bmp', 'tif', 'tiff']
+
+
+class ImageCacheBuilder:
+
+    @staticmethod
+    def find_images(images_dir : str | Path):
+        return sorted(path for path in Path(images_dir).iterdir()
+                      if path.suffix[1:].lower() in IMAGE_EXTENSIONS)
+
+    @staticmethod
+    def detect_mode(image_paths : str | Path | Iterable[str | Path], sample : int = 16):
+        '''
+        Modo usado com mode='auto': imagens em tons de cinza são armazenadas com um canal; as demais,
+        em RGB. Até sample imagens, espaçadas ao longo da lista, são inspecionadas: o cache só é
+        criado em L quando todas são cinzas na prática (inclusive as gravadas em RGB, como os JPEGs
+        das páginas digitalizadas).
+        '''
+        from DataAugmentation.image_encoding import is_single_channel
+
+        image_paths = [image_paths] if isinstance(image_paths, (str, Path)) else list(image_paths)
+        positions = np.unique(np.linspace(0, len(image_paths) - 1, min(sample, len(image_paths))).astype(int))
+
+        for position in positions:
+            with Image.open(image_paths[position]) as image:
+                if not is_single_channel(image):
+                    return 'RGB'
+        return 'L'
+
+    @staticmethod
+    def decode_into(cache : np.ndarray, position : int, image_path : Path, size : Tuple[int, int], mode : str):
+        '''
+        Decodifica a imagem diretamente na posição do tensor mapeado, redimensionando-a se necessário.
+        Retorna as dimensões originais (largura, altura).
+        '''
+        with Image.open(image_path) as image:
+            original_size = image.size
+            image = image.convert(mode)
+            if image.size != size:
+                image = image.resize(size)
+            cache[position] = np.asarray(image).reshape(cache.shape[1:])
+
+        return original_size
+
+    @staticmethod
+    @instrumented('image_cache.ImageCacheBuilder.build', items=len)
+    def build(image_paths : Iterable[str | Path],
+              output_path : str | Path,
+              size : Tuple[int, int] = (640, 640),
+              mode : str = 'RGB',
+              workers : int = 8):
+        '''
+        Decodifica as imagens em paralelo para output_path.npy e grava o índice em output_path.json.
+        size é (largura, altura); imagens com outras dimensões são redimensionadas e as dimensões
+        originais ficam registradas no índice. mode é 'RGB' (padrão), 'L' ou 'auto', que detecta o
+        modo por uma amostra das imagens (ver detect_mode); em L, cache[...] devolve arrays 2D e os
+        consumidores que alimentam o modelo devem replicar os canais (Augmentation.expand_channels).
+        '''
+        image_paths = [Path(path) for path in image_paths]
+        output_path = Path(output_path)
+        os.makedirs(output_path.parent, exist_ok=True)
+
+        mode = ImageCacheBuilder.detect_mode(image_paths) if mode == 'auto' else mode
+        channels = 1 if mode == 'L' else 3
+        width, height = size
+
+        cache = np.lib.format.open_memmap(output_path.with_suffix('.npy'), mode='w+', dtype=np.uint8,
+                                          shape=(len(image_paths), height, width, channels))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(ImageCacheBuilder.decode_into, cache, position, image_path, (width, height), mode)
+                       for position, image_path in enumerate(image_paths)]
+            original_sizes = [list(future.result()) for future in tqdm(futures, desc=f'Decodificando para {output_path}')]
+
+        cache.flush()
+        del cache
+
+        index = {
+            'version': INDEX_VERSION,
+            'shape': [len(image_paths), height, width, channels],
+            'mode': mode,
+            'paths': [path.as_posix() for path in image_paths],
+            'original_sizes': original_sizes
+        }
+        with open(output_path.with_suffix('.json'), 'w') as file:
+            json.dump(index, file)
+
+        if is_enabled():
+            add_bytes_written(os.path.getsize(output_path.with_suffix('.npy')))
+
+        print(f'\nCache com {len(image_paths)} imagens ({np.prod(index["shape"]) / 2**20:.1f} MB) criado em: {output_path}.npy')
+        return image_paths
+
+
+def normalize_key(image_path : str | Path):
+    return os.path.normpath(Path(image_path).as_posix())
+
+
+class ImageCache:
+    '''
+    Leitura do cache: cache[i] ou cache['caminho/da/imagem.jpg'] devolvem uma visão somente leitura
+    (altura, largura, 3) em RGB, ou (altura, largura) em tons de cinza. Os caminhos são comparados
+    inteiros (normalizados): uma cópia com o mesmo nome em outro diretório (ex.: a de um fold) não é
+    a imagem do cache. Com match_names=True, o nome e o nome sem extensão também são aceitos, para
+    caches cujos nomes de arquivo são únicos.
+    '''
+
+    def __init__(self, path : str | Path, match_names : bool = False):
+        path = Path(path)
+        with open(path.with_suffix('.json'), 'r') as file:
+            self.index = json.load(file)
+
+        self.array = np.load(path.with_suffix('.npy'), mmap_mode='r')
+        self.images = self.array[..., 0] if self.array.shape[-1] == 1 else self.array
+
+        self.mode = self.index['mode']
+        self.paths = self.index['paths']
+        self.match_names = match_names
+        self.positions = {normalize_key(image_path): position for position, image_path in enumerate(self.paths)}
+
+        self.name_positions = {}
+        if match_names:
+            for position, image_path in enumerate(self.paths):
+                self.name_positions[Path(image_path).name] = position
+                self.name_positions[Path(image_path).stem] = position
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_position(self, key : int | str | Path):
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+        position = self.positions.get(normalize_key(key))
+        if position is None and self.match_names:
+            position = self.name_positions.get(Path(key).name, self.name_positions.get(Path(key).stem))
+        if position is None:
+            raise KeyError(f'Imagem não encontrada no cache: {key}')
+        return position
+
+    def __contains__(self, key : int | str | Path):
+        try:
+            self.get_position(key)
+            return True
+        except (KeyError, TypeError):
+            return False
+
+    def __getitem__(self, key : int | str | Path):
+        return self.images[self.get_position(key)]
+
+    def get_original_size(self, key : int | str | Path):
+        return tuple(self.index['original_sizes'][self.get_position(key)])
+
+    def get_pil_image(self, key : int | str | Path):
+        '''
+        Imagem PIL que compartilha a memória da visão (somente leitura).
+        '''
+        return Image.fromarray(self[key], mode=self.mode)
+
+    def iterate_batches(self, batch_size : int = 32, bgr : bool = False):
+        '''
+        Percorre o cache em lotes (caminhos, visão N x H x W x C). Com bgr=True os canais são
+        invertidos (ainda sem cópia), como esperado pelas entradas numpy da Ultralytics.
+        '''
+        for start in range(0, len(self), batch_size):
+            batch = self.images[start:start + batch_size]
+            if bgr and batch.ndim == 4:
+                batch = batch[..., ::-1]
+            yield self.paths[start:start + batch_size], batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache de imagens pré-decodificadas (np.memmap).')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('images_dir')
+    build_parser.add_argument('output_path', help='caminho sem extensão; gera .npy e .json')
+    build_parser.add_argument('--size', type=int, nargs=2, default=[640, 640], metavar=('WIDTH', 'HEIGHT'))
+    build_parser.add_argument('--mode', choices=['RGB', 'L', 'auto'], default='RGB',
+                              help='auto: L quando as páginas amostradas são cinzas na prática')
+    build_parser.add_argument('--workers', type=int, default=8)
+
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('cache_path')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        image_paths = ImageCacheBuilder.find_images(args.images_dir)
+        ImageCacheBuilder.build(image_paths, args.output_path, tuple(args.size), args.mode, args.workers)
+    else:
+        cache = ImageCache(args.cache_path)
+        print(f'Imagens: {len(cache)}')
+        print(f'Formato: {cache.array.shape} ({cache.mode})')
+        print(f'Tamanho: {cache.array.nbytes / 2**20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
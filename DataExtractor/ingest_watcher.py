@@ -0,0 +1,353 @@
+'''
+Ingestão incremental: converte os documentos novos de um diretório de entrada à medida que chegam.
+
+A cada varredura (os.scandir), as imagens e os XMLs (cTDaR ou VOC) cuja assinatura (mtime, tamanho)
+difere da registrada no manifesto são considerados alterados; os que foram modificados há menos de
+settle_seconds são ignorados até a próxima varredura (cópia ainda em andamento). Os pares completos
+imagem/XML que envolvem algum arquivo alterado são associados por FileFinder.associate_files_by_name
+e processados em pequenos lotes paralelos, como no pipeline: simplificação opcional dos polígonos,
+redimensionamento da imagem, rótulo YOLO em <split_dir>/labels e uma linha a mais no CSV de metadados.
+O manifesto (JSON) é regravado atomicamente ao final de cada lote, de modo que uma interrupção
+reprocessa no máximo o lote em andamento. Um documento alterado depois de ingerido é convertido
+novamente (os arquivos do split são sobrescritos e uma nova linha é acrescentada ao CSV); um documento
+com falha só é tentado de novo quando a imagem ou o XML mudar.
+
+    icdar       células do cTDaR, rótulos de segmentação com a classe 'cell' (como icdar_completo.yaml)
+    fintabnet   objetos do VOC do FinTabNet.c, rótulos de detecção (FinTabNetYOLOConverter.class_id_map)
+
+Uso:
+    python -m DataExtractor.ingest_watcher entrada/ dataset_completo/train --metadata dataset_completo/dataset.csv
+    python -m DataExtractor.ingest_watcher entrada/ fin_tab_net_yolo/train --preset fintabnet --once
+'''
+
+import os
+import csv
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Literal, Tuple
+
+from .file_finder import FileFinder
+from .annotation_validator import IMAGE_EXTENSIONS
+from Instrumentation.spans import instrumented
+
+
+PRESETS = ['icdar', 'fintabnet']
+
+LABEL_EXTENSIONS = ['xml']
+
+# colunas do CSV de metadados quando ele ainda não existe (as de icdar_completo.yaml e as origens)
+METADATA_COLUMNS = ['image_path', 'yolo_txt_path', 'split', 'image_width', 'image_height', 'xy', 'yolo_xy',
+                    'original_image_path', 'label_path']
+
+
+def get_file_signature(entry : os.DirEntry):
+    stat = entry.stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def ingest_document(job : Tuple[str, str, dict]):
+    '''
+    Converte um par imagem/XML (executado nos processos do pool). Retorna a linha de metadados ou,
+    em caso de falha, {'error': mensagem}, para que um arquivo defeituoso não interrompa o lote.
+    '''
+    image_path, label_path, options = job
+    try:
+        return convert_document(image_path, label_path, **options)
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+
+
+def convert_document(image_path : str,
+                     label_path : str,
+                     split_dir : str,
+                     width : int,
+                     height : int,
+                     preset : Literal['icdar', 'fintabnet'],
+                     split : str = None,
+                     tolerance : float = None,
+                     encoding : dict = None):
+
+    from DataAugmentation.augmentation import Augmentation
+    from DataAugmentation.image_encoding import EncodingOptions
+    from .conversion_hub import read_xml_file
+    from .polygon_simplification import PolygonSimplifier
+    from .yolo_converter import YOLOConverter, ICDARYOLOConverter, FinTabNetYOLOConverter
+
+    document = read_xml_file(label_path)
+    class_map = {'cell': ICDARYOLOConverter.class_id} if preset == 'icdar' else FinTabNetYOLOConverter.class_id_map
+    document = document.select(np.isin(document.names, list(class_map)))
+    points, counts = document.get_polygons()
+
+    if tolerance is not None and len(counts):
+        points, counts, _ = PolygonSimplifier.simplify(points, counts, tolerance)
+
+    image = Augmentation.load_image(image_path)
+    original_width, original_height = image.size
+
+    output_path = Path(split_dir)/'images'/os.path.basename(image_path)
+    txt_path = Path(split_dir)/'labels'/f'{output_path.stem}.txt'
+    resized_image, _ = Augmentation.resize_image(image, width, height)
+    Augmentation.save_image(resized_image, output_path, EncodingOptions(**encoding) if encoding else None)
+
+    # mesmas operações, na mesma ordem, de Augmentation.resize_mask: int(x * new_width / original_width)
+    points = (points * [width, height] / [original_width, original_height]).astype(np.int64)
+    resized_masks = PolygonSimplifier.unpack(points, counts)
+
+    if preset == 'icdar':
+        yolo_xy = ICDARYOLOConverter.process_masks(resized_masks, width, height, txt_path)
+    else:
+        boxes = np.array([[*np.min(mask, axis=0), *np.max(mask, axis=0)] for mask in resized_masks]).reshape(-1, 4)
+        yolo_boxes = YOLOConverter.convert_boxes_xy2yolo(boxes, (width, height))
+        class_ids = [class_map[name] for name in document.names]
+        YOLOConverter.save_file(YOLOConverter.create_bbox_txt_file_content(yolo_boxes, class_ids), txt_path)
+        yolo_xy = yolo_boxes.tolist()
+
+    split_values = {'split': split} if split is not None else {}
+    return split_values | {
+        'image_path': output_path.as_posix(),
+        'yolo_txt_path': txt_path.as_posix(),
+        'image_width': width,
+        'image_height': height,
+        'xy': resized_masks,
+        'yolo_xy': yolo_xy,
+        'original_image_path': Path(image_path).as_posix(),
+        'label_path': Path(label_path).as_posix(),
+    }
+
+
+class IngestManifest:
+    '''
+    Estado persistente da ingestão: assinatura (mtime_ns, tamanho) dos arquivos já vistos e o
+    resultado de cada documento ({'status': 'done' | 'error', ...}), indexado pelo nome sem extensão.
+    '''
+
+    def __init__(self, path : str | Path):
+        self.path = Path(path)
+        self.files : Dict[str, list] = {}
+        self.documents : Dict[str, dict] = {}
+
+        if self.path.exists():
+            with open(self.path, 'r') as file:
+                content = json.load(file)
+            self.files = content.get('files', {})
+            self.documents = content.get('documents', {})
+
+    def save(self):
+        # gravação atômica: uma interrupção não corrompe o manifesto anterior
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump({'files': self.files, 'documents': self.documents}, file)
+        os.replace(temporary_path, self.path)
+
+    def count(self, status : str):
+        return sum(document['status'] == status for document in self.documents.values())
+
+
+class IngestWatcher:
+    def __init__(self,
+                 ingest_dir : str | Path,
+                 split_dir : str | Path,
+                 metadata_path : str | Path = None,
+                 manifest_path : str | Path = None,
+                 width : int = 640,
+                 height : int = 640,
+                 preset : Literal['icdar', 'fintabnet'] = 'icdar',
+                 split : str = None,
+                 tolerance : float = None,
+                 encoding : dict = None,
+                 settle_seconds : float = 2.0,
+                 batch_size : int = 16,
+                 workers : int = 4):
+
+        if preset not in PRESETS:
+            raise ValueError(f'Preset de ingestão inválido: {preset}')
+
+        self.ingest_dir = Path(ingest_dir)
+        self.split_dir = Path(split_dir)
+        # por padrão, o CSV de metadados e o manifesto ficam na raiz do dataset (pai do split)
+        self.metadata_path = Path(metadata_path) if metadata_path is not None else self.split_dir.parent/'dataset.csv'
+        self.manifest = IngestManifest(manifest_path if manifest_path is not None
+                                       else self.split_dir.parent/f'ingest_{self.split_dir.name}.json')
+        self.settle_seconds = settle_seconds
+        self.batch_size = batch_size
+        self.workers = workers
+        self.options = {'split_dir': self.split_dir.as_posix(), 'width': width, 'height': height, 'preset': preset,
+                        'split': split if split is not None else self.split_dir.name,
+                        'tolerance': tolerance, 'encoding': encoding}
+
+    def scan(self):
+        '''
+        Assinaturas das imagens e dos XMLs do diretório de entrada, em uma única listagem.
+        '''
+        images, labels = {}, {}
+        with os.scandir(self.ingest_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                extension = os.path.splitext(entry.name)[1][1:].lower()
+                if extension in IMAGE_EXTENSIONS:
+                    images[Path(entry.path).as_posix()] = get_file_signature(entry)
+                elif extension in LABEL_EXTENSIONS:
+                    labels[Path(entry.path).as_posix()] = get_file_signature(entry)
+        return images, labels
+
+    def find_new_pairs(self, images : Dict[str, list], labels : Dict[str, list], now : float = None):
+        '''
+        Retorna (pares novos ou alterados, assinaturas estáveis alteradas). Um par é novo quando a
+        imagem ou o XML mudou desde a última ingestão e ambos estão estáveis há settle_seconds.
+        '''
+        now_ns = int((time.time() if now is None else now) * 1e9)
+        settle_ns = int(self.settle_seconds * 1e9)
+        stable = {path: signature for path, signature in (images | labels).items()
+                  if now_ns - signature[0] >= settle_ns}
+        changed = {path: signature for path, signature in stable.items() if self.manifest.files.get(path) != signature}
+
+        # apenas os arquivos com o nome de algum arquivo alterado participam da associação
+        stems = {Path(path).stem for path in changed}
+        pending_images = sorted(path for path in images if path in stable and Path(path).stem in stems)
+        pending_labels = sorted(path for path in labels if path in stable and Path(path).stem in stems)
+
+        return FileFinder.associate_files_by_name(pending_images, pending_labels), changed
+
+    def append_metadata(self, rows : List[dict]):
+        '''
+        Acrescenta as linhas ao CSV de metadados, preservando as colunas de um CSV existente
+        (ex.: o escrito pela etapa write_metadata do pipeline).
+        '''
+        if not rows:
+            return
+
+        columns = METADATA_COLUMNS
+        if self.metadata_path.exists() and self.metadata_path.stat().st_size > 0:
+            with open(self.metadata_path, 'r', newline='') as file:
+                columns = next(csv.reader(file))
+            write_header = False
+        else:
+            self.metadata_path.parent.mkdir(parents=True, exist_ok=True)
+            write_header = True
+
+        with open(self.metadata_path, 'a', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+            if write_header:
+                writer.writeheader()
+            writer.writerows({key: json.dumps(value) if isinstance(value, (list, tuple)) else value
+                              for key, value in row.items()} for row in rows)
+
+    @instrumented('ingest_watcher.process_pairs', items=len)
+    def process_pairs(self, pairs : List[Tuple[str, str]], signatures : Dict[str, list],
+                      executor : ProcessPoolExecutor = None):
+        '''
+        Converte os pares em lotes de batch_size e registra cada lote, com as assinaturas dos seus
+        arquivos, no manifesto. Retorna as linhas de metadados dos documentos convertidos.
+        '''
+        (self.split_dir/'images').mkdir(parents=True, exist_ok=True)
+        (self.split_dir/'labels').mkdir(parents=True, exist_ok=True)
+
+        converted_rows = []
+        for start in range(0, len(pairs), self.batch_size):
+            batch = pairs[start:start + self.batch_size]
+            jobs = [(image_path, label_path, self.options) for image_path, label_path in batch]
+            results = executor.map(ingest_document, jobs) if executor is not None else map(ingest_document, jobs)
+
+            rows = []
+            for (image_path, label_path), result in zip(batch, results):
+                stem = Path(image_path).stem
+                if 'error' in result:
+                    self.manifest.documents[stem] = {'status': 'error', 'image_path': image_path,
+                                                     'label_path': label_path, 'error': result['error']}
+                    print(f'Falha ao ingerir {stem}: {result["error"]}')
+                    continue
+                self.manifest.documents[stem] = {'status': 'done', 'image_path': image_path, 'label_path': label_path,
+                                                 'output_path': result['image_path'], 'ingested_at': time.time()}
+                rows.append(result)
+
+            # metadados antes do manifesto: após uma interrupção, o lote é refeito por inteiro
+            self.append_metadata(rows)
+            self.manifest.files.update({path: signatures[path] for pair in batch for path in pair})
+            self.manifest.save()
+            converted_rows.extend(rows)
+
+        return converted_rows
+
+    def poll(self, executor : ProcessPoolExecutor = None):
+        '''
+        Uma varredura do diretório de entrada. Retorna a quantidade de documentos convertidos.
+        '''
+        images, labels = self.scan()
+        pairs, changed = self.find_new_pairs(images, labels)
+
+        rows = self.process_pairs(pairs, images | labels, executor) if pairs else []
+
+        # os arquivos alterados ainda sem par também são registrados: quando o par chegar, ele
+        # próprio será o arquivo alterado e a associação os encontrará na listagem
+        paired = {path for pair in pairs for path in pair}
+        unpaired = {path: signature for path, signature in changed.items() if path not in paired}
+        if unpaired:
+            self.manifest.files.update(unpaired)
+            self.manifest.save()
+
+        return len(rows)
+
+    def watch(self, interval : float = 5.0, max_polls : int = None):
+        '''
+        Varre o diretório de entrada a cada interval segundos até ser interrompido (Ctrl+C) ou
+        completar max_polls varreduras. O pool de processos é mantido entre as varreduras.
+        '''
+        n_polls, n_converted = 0, 0
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            while max_polls is None or n_polls < max_polls:
+                started = time.perf_counter()
+                n_new = self.poll(executor)
+                n_polls += 1
+                n_converted += n_new
+                if n_new:
+                    print(f'{n_new} documentos ingeridos em {time.perf_counter() - started:.2f} s '
+                          f'({self.manifest.count("done")} no total, {self.manifest.count("error")} com falha)')
+                if max_polls is None or n_polls < max_polls:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            print('\nIngestão interrompida.')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return n_converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converte incrementalmente os pares imagem/XML novos de um diretório.')
+    parser.add_argument('ingest_dir', help='diretório monitorado (imagens e XMLs cTDaR ou VOC)')
+    parser.add_argument('split_dir', help='split de destino (images/ e labels/), ex.: dataset_completo/train')
+    parser.add_argument('--metadata', default=None, help='CSV de metadados (padrão: <pai do split>/dataset.csv)')
+    parser.add_argument('--manifest', default=None, help='manifesto JSON (padrão: <pai do split>/ingest_<split>.json)')
+    parser.add_argument('--preset', choices=PRESETS, default='icdar')
+    parser.add_argument('--split', default=None, help='valor da coluna split (padrão: nome do diretório do split)')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=640)
+    parser.add_argument('--tolerance', type=float, default=None, help='tolerância da simplificação dos polígonos (px)')
+    parser.add_argument('--quality', type=int, default=None, help='qualidade JPEG/WebP das imagens gravadas')
+    parser.add_argument('--settle', type=float, default=2.0, help='segundos sem modificação para considerar um arquivo completo')
+    parser.add_argument('--interval', type=float, default=5.0, help='segundos entre as varreduras')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--once', action='store_true', help='faz uma única varredura e termina')
+    args = parser.parse_args()
+
+    watcher = IngestWatcher(args.ingest_dir, args.split_dir, args.metadata, args.manifest, args.width, args.height,
+                            args.preset, args.split, args.tolerance,
+                            {'quality': args.quality} if args.quality is not None else None,
+                            args.settle, args.batch_size, args.workers)
+
+    print(f'Monitorando {args.ingest_dir} -> {args.split_dir}' + (' (varredura única)' if args.once else ''))
+    n_converted = watcher.watch(args.interval, max_polls=1 if args.once else None)
+    print(f'\n{n_converted} documentos ingeridos. Manifesto: {watcher.manifest.path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+'''
+Escrita em lote dos rótulos YOLO e cache binário pré-construído dos rótulos.
+
+YOLOLabelWriter normaliza e formata cada página de uma só vez e grava os arquivos TXT por um
+pool de threads. LabelCacheExporter lê os TXT de um split (ex.: dataset_folds/fold_1/train) e
+grava, ao lado deles, os arrays de classes, caixas e segmentos de cada imagem em um único arquivo
+labels.npz e, opcionalmente, o labels.cache no formato da Ultralytics, para que a preparação dos
+folds e a primeira época de treino não precisem reinterpretar os milhares de arquivos TXT.
+
+Uso:
+    python -m DataExtractor.label_cache dataset_folds/fold_1/train dataset_folds/fold_1/val --ultralytics
+'''
+
+import os
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple, List
+
+from .yolo_converter import YOLOConverter
+from Instrumentation.spans import instrumented, span
+
+
+IMAGE_FORMATS = {'bmp', 'dng', 'jpeg', 'jpg', 'mpo', 'png', 'tif', 'tiff', 'webp', 'pfm', 'heic'}
+
+
+class YOLOLabelWriter:
+
+    @staticmethod
+    def normalize_page(masks : Iterable[Iterable[Tuple[float]]], image_width : float, image_height : float):
+        '''
+        Versão vetorizada de YOLOConverter.normalize_masks: todos os pontos da página são
+        normalizados em uma única divisão e devolvidos como um array (n_pontos, 2) por máscara.
+        '''
+        masks = [np.asarray(mask, dtype=np.float64).reshape(-1, 2) for mask in masks]
+        if not masks:
+            return []
+
+        points = np.concatenate(masks) / np.array([image_width, image_height], dtype=np.float64)
+        offsets = np.cumsum([len(mask) for mask in masks])[:-1]
+
+        return np.split(points, offsets)
+
+    @staticmethod
+    def write_file(path : str | Path, content : str):
+        YOLOConverter.save_file(content, path)
+        return path
+
+    @staticmethod
+    @instrumented('label_cache.YOLOLabelWriter.write_pages', items=lambda written: written)
+    def write_pages(pages : Iterable[Tuple[str | Path, Iterable[int], Iterable[Iterable[Tuple[float]]], float, float]],
+                    workers : int = 8,
+                    normalized : bool = False):
+        '''
+        Escreve os rótulos de segmentação de várias páginas. Cada página é dada por
+        (path_txt_file, class_ids, masks, image_width, image_height). A formatação é feita na
+        thread chamadora e a escrita dos arquivos por um pool de threads, com no máximo
+        4 * workers arquivos pendentes. Retorna a quantidade de arquivos escritos.
+        '''
+
+        written = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for path, class_ids, masks, image_width, image_height in pages:
+                if not normalized:
+                    masks = YOLOLabelWriter.normalize_page(masks, image_width, image_height)
+                content = YOLOConverter.create_mask_txt_file_content(masks, class_ids)
+                pending.append(executor.submit(YOLOLabelWriter.write_file, path, content))
+
+                if len(pending) >= 4 * workers:
+                    pending.popleft().result()
+                    written += 1
+
+            for future in pending:
+                future.result()
+                written += 1
+
+        return written
+
+
+class LabelCache:
+    '''
+    Leitura do labels.npz gerado por LabelCacheExporter. Os arrays de cada imagem são visões
+    (sem cópia) dos arrays concatenados.
+    '''
+
+    def __init__(self, path : str | Path):
+        with np.load(path, allow_pickle=False) as data:
+            self.arrays = {key: data[key] for key in data.files}
+
+        self.image_files = self.arrays['image_files'].tolist()
+        self.label_files = self.arrays['label_files'].tolist()
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __getitem__(self, index : int):
+        start, end = self.arrays['label_offsets'][index:index + 2]
+        point_offsets = self.arrays['point_offsets'][start:end + 1]
+        points = self.arrays['points']
+
+        return {
+            'im_file': self.image_files[index],
+            'label_file': self.label_files[index],
+            'shape': tuple(self.arrays['shapes'][index].tolist()),
+            'cls': self.arrays['classes'][start:end],
+            'bboxes': self.arrays['boxes'][start:end],
+            'segments': [points[point_start:point_end] for point_start, point_end in zip(point_offsets[:-1], point_offsets[1:])]
+        }
+
+
+class LabelCacheExporter:
+
+    @staticmethod
+    def find_image_files(split_path : str | Path):
+        '''
+        Procura as imagens do split como a Ultralytics: recursivamente, ordenadas pelo caminho absoluto.
+        '''
+        split_path = Path(split_path).resolve()
+        return sorted(os.path.join(root, file_name)
+                      for root, _, file_names in os.walk(split_path)
+                      for file_name in file_names
+                      if file_name.rsplit('.', 1)[-1].lower() in IMAGE_FORMATS)
+
+    @staticmethod
+    def image_to_label_path(image_path : str):
+        images_dir, labels_dir = f'{os.sep}images{os.sep}', f'{os.sep}labels{os.sep}'
+        return labels_dir.join(image_path.rsplit(images_dir, 1)).rsplit('.', 1)[0] + '.txt'
+
+    @staticmethod
+    def read_label_file(image_path : str, label_path : str):
+        '''
+        Retorna (shape, classes, segmentos) de uma imagem. O shape é (altura, largura), lido apenas
+        do cabeçalho da imagem.
+        '''
+        with Image.open(image_path) as image:
+            width, height = image.size
+
+        classes, segments = [], []
+        if os.path.exists(label_path):
+            with open(label_path, 'r') as file:
+                for line in file.read().splitlines():
+                    values = line.split()
+                    if not values:
+                        continue
+                    classes.append(int(float(values[0])))
+                    segments.append(np.array(values[1:], dtype=np.float32).reshape(-1, 2))
+
+        return (height, width), classes, segments
+
+    @staticmethod
+    def segments_to_boxes(segments : List[np.ndarray]):
+        '''
+        Caixas (xcentral, ycentral, largura, altura) normalizadas que envolvem cada segmento. Rótulos
+        de detecção (4 valores por linha) são interpretados diretamente como caixas.
+        '''
+        boxes = np.zeros((len(segments), 4), dtype=np.float32)
+        for index, segment in enumerate(segments):
+            if len(segment) == 2:
+                boxes[index] = segment.reshape(-1)
+                continue
+            xy_min, xy_max = segment.min(axis=0), segment.max(axis=0)
+            boxes[index, :2] = (xy_min + xy_max) / 2
+            boxes[index, 2:] = xy_max - xy_min
+
+        return boxes
+
+    @staticmethod
+    @instrumented('label_cache.LabelCacheExporter.read_split', items=lambda result: len(result[0]))
+    def read_split(split_path : str | Path, workers : int = 8):
+        from tqdm import tqdm
+
+        image_files = LabelCacheExporter.find_image_files(split_path)
+        label_files = [LabelCacheExporter.image_to_label_path(image_file) for image_file in image_files]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            labels = list(tqdm(executor.map(LabelCacheExporter.read_label_file, image_files, label_files),
+                               total=len(image_files), desc=f'Lendo rótulos de {split_path}'))
+
+        return image_files, label_files, labels
+
+    @staticmethod
+    def export(split_path : str | Path, output_path : str | Path = None, workers : int = 8, ultralytics : bool = False):
+        '''
+        Grava split_path/labels.npz com os arrays concatenados de todas as imagens do split e, com
+        ultralytics=True, também o split_path/labels.cache lido pelo YOLODataset.
+        '''
+        split_path = Path(split_path)
+        output_path = Path(output_path) if output_path is not None else split_path/'labels.npz'
+
+        image_files, label_files, labels = LabelCacheExporter.read_split(split_path, workers)
+
+        with span('label_cache.LabelCacheExporter.export', items=len(image_files)):
+            shapes = np.array([shape for shape, _, _ in labels], dtype=np.int32).reshape(-1, 2)
+            classes = [np.array(image_classes, dtype=np.int32) for _, image_classes, _ in labels]
+            segments = [segment for _, _, image_segments in labels for segment in image_segments]
+
+            label_offsets = np.concatenate([[0], np.cumsum([len(image_classes) for image_classes in classes])])
+            point_offsets = np.concatenate([[0], np.cumsum([len(segment) for segment in segments])])
+
+            np.savez(output_path,
+                     image_files=np.array(image_files, dtype=str),
+                     label_files=np.array(label_files, dtype=str),
+                     shapes=shapes,
+                     classes=np.concatenate(classes) if classes else np.zeros(0, dtype=np.int32),
+                     boxes=LabelCacheExporter.segments_to_boxes(segments),
+                     label_offsets=label_offsets.astype(np.int64),
+                     points=np.concatenate(segments) if segments else np.zeros((0, 2), dtype=np.float32),
+                     point_offsets=point_offsets.astype(np.int64))
+
+        print(f'\nCache de rótulos criado em: {output_path}')
+
+        if ultralytics:
+            LabelCacheExporter.export_ultralytics_cache(LabelCache(output_path))
+
+        return output_path
+
+    @staticmethod
+    def export_ultralytics_cache(label_cache : LabelCache):
+        '''
+        Grava o labels.cache da Ultralytics (mesmo conteúdo de YOLODataset.cache_labels) a partir do
+        cache binário. O hash e a versão vêm da Ultralytics instalada, para que o cache seja aceito.
+        '''
+        from ultralytics.data.utils import get_hash, DATASET_CACHE_VERSION
+
+        if len(label_cache) == 0:
+            raise ValueError('O split não contém imagens.')
+
+        labels, n_found, n_empty = [], 0, 0
+        for index in range(len(label_cache)):
+            label = label_cache[index]
+            n_found += int(os.path.exists(label['label_file']))
+            n_empty += int(len(label['cls']) == 0)
+
+            is_segment = any(len(segment) > 2 for segment in label['segments'])
+            labels.append({
+                'im_file': label['im_file'],
+                'shape': label['shape'],
+                'cls': label['cls'].astype(np.float32).reshape(-1, 1),
+                'bboxes': label['bboxes'].copy(),
+                'segments': [segment.copy() for segment in label['segments']] if is_segment else [],
+                'keypoints': None,
+                'normalized': True,
+                'bbox_format': 'xywh'
+            })
+
+        n_missing = len(label_cache) - n_found
+        cache = {
+            'labels': labels,
+            'hash': get_hash(label_cache.label_files + label_cache.image_files),
+            'results': (n_found, n_missing, n_empty, 0, len(label_cache)),
+            'msgs': [],
+            'version': DATASET_CACHE_VERSION
+        }
+
+        cache_path = Path(label_cache.label_files[0]).parent.with_suffix('.cache')
+        np.save(str(cache_path), cache)
+        cache_path.with_suffix('.cache.npy').rename(cache_path)
+
+        print(f'Cache da Ultralytics criado em: {cache_path}')
+        return cache_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera o cache binário dos rótulos YOLO de cada split.')
+    parser.add_argument('splits', nargs='+', help='diretórios dos splits (contendo images/ e labels/)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--ultralytics', action='store_true', help='gera também o labels.cache da Ultralytics')
+    args = parser.parse_args()
+
+    for split_path in args.splits:
+        LabelCacheExporter.export(split_path, workers=args.workers, ultralytics=args.ultralytics)
+
+
+if __name__ == '__main__':
+    main()
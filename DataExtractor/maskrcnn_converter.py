@@ -4,6 +4,8 @@ import shutil
 import yaml
 from PIL import Image
 
+from Instrumentation.spans import instrumented
+
 
 class YOLO2MaskRCNN:
     
@@ -31,6 +33,7 @@ class YOLO2MaskRCNN:
             h * img_h
         ]
 
+    @instrumented('maskrcnn_converter.YOLO2MaskRCNN.process_split', items=lambda coco: len(coco['images']))
     def process_split(self, split_path, split_name, categories, out_images_dir):
     
         images_dir = os.path.join(split_path, "images")
@@ -0,0 +1,395 @@
+'''
+Simplificação vetorizada dos polígonos das células antes da conversão para YOLO.
+
+As Coords das células do ICDAR frequentemente trazem vários pontos colineares por aresta, que
+passam inalterados por YOLOConverter.normalize_masks até os rótulos e o treino. Aqui os polígonos
+de muitas páginas são empacotados em um único array (n_pontos, 2) com as contagens de pontos de
+cada polígono, e a simplificação é feita de uma só vez para todos eles:
+
+    - Douglas-Peucker em níveis: a cada iteração, todos os segmentos ainda abertos de todos os
+      polígonos são avaliados juntos, e o ponto mais distante de cada segmento é mantido se estiver
+      a mais de tolerance pixels da corda;
+    - snap opcional para retângulos (alinhados aos eixos) ou quadriláteros de área mínima
+      (retângulos rotacionados), aplicado apenas quando todos os vértices estão a no máximo
+      tolerance pixels da borda do retângulo e o desvio médio de área também fica abaixo dela.
+
+SimplificationReport acumula a redução de pontos, o tamanho estimado dos rótulos YOLO antes e
+depois e o maior desvio de IoU (1 - IoU entre o polígono original e o simplificado, medido por
+rasterização) do conjunto de dados.
+
+Uso:
+    python -m DataExtractor.polygon_simplification dataset/training/TRACKB1/ground_truth --tolerance 1.0 --snap rectangle
+'''
+
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Iterable, List, Literal, Tuple
+
+from Instrumentation.spans import instrumented
+
+
+# cada coordenada normalizada ocupa ' %.6f' = 9 bytes no TXT da Ultralytics
+YOLO_BYTES_PER_POINT = 18
+
+
+class PolygonSimplifier:
+
+    @staticmethod
+    def pack(masks : Iterable[Iterable[Tuple[float]]]):
+        '''
+        Empacota uma lista de polígonos em (pontos (n, 2) float64, contagem de pontos por polígono).
+        '''
+        masks = [np.asarray(mask, dtype=np.float64).reshape(-1, 2) for mask in masks]
+        counts = np.array([len(mask) for mask in masks], dtype=np.int64)
+        points = np.concatenate(masks) if masks else np.zeros((0, 2), dtype=np.float64)
+        return points, counts
+
+    @staticmethod
+    def unpack(points : np.ndarray, counts : np.ndarray):
+        '''
+        Inverso de pack; devolve listas de [x, y], como as colunas xy dos CSVs.
+        '''
+        if not len(counts):
+            return []
+        return [polygon.tolist() for polygon in np.split(points, np.cumsum(counts)[:-1])]
+
+    @staticmethod
+    def get_starts(counts : np.ndarray):
+        return np.cumsum(counts) - counts
+
+    @staticmethod
+    def segment_argmax(values : np.ndarray, segment_ids : np.ndarray, starts : np.ndarray):
+        '''
+        Índice do maior valor de cada segmento contíguo e não vazio de values.
+        '''
+        order = np.lexsort((-values, segment_ids))
+        return order[starts]
+
+    @staticmethod
+    def distance_to_line(points : np.ndarray, line_starts : np.ndarray, line_ends : np.ndarray):
+        '''
+        Distância de cada ponto à reta que passa por line_starts e line_ends (ou ao ponto, se coincidirem).
+        '''
+        direction = line_ends - line_starts
+        offset = points - line_starts
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        cross = np.abs(direction[:, 0] * offset[:, 1] - direction[:, 1] * offset[:, 0])
+        return np.where(length > 0, cross / np.where(length > 0, length, 1), np.hypot(offset[:, 0], offset[:, 1]))
+
+    @staticmethod
+    def get_next_indices(counts : np.ndarray):
+        '''
+        Índice do próximo vértice de cada ponto, voltando ao primeiro no fim de cada polígono.
+        '''
+        starts = PolygonSimplifier.get_starts(counts)
+        next_indices = np.arange(counts.sum()) + 1
+        non_empty = counts > 0
+        next_indices[(starts + counts - 1)[non_empty]] = starts[non_empty]
+        return next_indices
+
+    @staticmethod
+    def polygon_areas(points : np.ndarray, counts : np.ndarray, next_indices : np.ndarray = None):
+        '''
+        Área de cada polígono pela fórmula do laço, com o fechamento de cada polígono tratado
+        separadamente (polígonos vazios têm área 0). next_indices (get_next_indices) pode ser
+        reaproveitado entre chamadas sobre polígonos com as mesmas contagens.
+        '''
+        if not len(counts):
+            return np.zeros(0)
+        next_indices = next_indices if next_indices is not None else PolygonSimplifier.get_next_indices(counts)
+        cross = points[:, 0] * points[next_indices, 1] - points[next_indices, 0] * points[:, 1]
+        polygon_ids = np.repeat(np.arange(len(counts)), counts)
+        return np.abs(np.bincount(polygon_ids, weights=cross, minlength=len(counts))) / 2
+
+    @staticmethod
+    def douglas_peucker(points : np.ndarray, counts : np.ndarray, tolerance : float):
+        '''
+        Douglas-Peucker para polígonos fechados, vetorizado sobre todos os polígonos. Retorna a
+        máscara dos pontos mantidos. Cada polígono começa com três âncoras (o primeiro ponto, o
+        mais distante dele e o mais distante da reta entre os dois). Pontos coincidentes podem
+        reduzir um polígono a menos de 3 pontos distintos; simplify devolve o original nesses casos.
+        Todos os polígonos devem ter pelo menos 3 pontos.
+        '''
+        n_polygons = len(counts)
+        if not n_polygons:
+            return np.ones(len(points), dtype=bool)
+
+        # duplica o primeiro ponto de cada polígono ao final, transformando-o em uma linha aberta
+        starts = PolygonSimplifier.get_starts(counts)
+        closed = np.insert(points, starts + counts, points[starts], axis=0)
+        closed_counts = counts + 1
+        closed_starts = starts + np.arange(n_polygons)
+        polygon_ids = np.repeat(np.arange(n_polygons), closed_counts)
+        closed_keep = np.zeros(len(closed), dtype=bool)
+
+        # âncoras iniciais
+        first = closed[closed_starts][polygon_ids]
+        farthest = PolygonSimplifier.segment_argmax(np.hypot(*(closed - first).T), polygon_ids, closed_starts)
+        from_line = PolygonSimplifier.distance_to_line(closed, first, closed[farthest][polygon_ids])
+        third = PolygonSimplifier.segment_argmax(from_line, polygon_ids, closed_starts)
+
+        anchors = np.sort(np.stack([closed_starts, farthest, third, closed_starts + counts], axis=1), axis=1)
+        closed_keep[anchors.ravel()] = True
+        segment_starts, segment_ends = anchors[:, :-1].ravel(), anchors[:, 1:].ravel()
+
+        while True:
+            open_segments = segment_ends - segment_starts >= 2
+            segment_starts, segment_ends = segment_starts[open_segments], segment_ends[open_segments]
+            if not len(segment_starts):
+                break
+
+            # pontos internos de todos os segmentos abertos
+            lengths = segment_ends - segment_starts - 1
+            offsets = np.cumsum(lengths) - lengths
+            segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+            interior = np.arange(lengths.sum()) - offsets[segment_ids] + segment_starts[segment_ids] + 1
+
+            distances = PolygonSimplifier.distance_to_line(closed[interior], closed[segment_starts[segment_ids]],
+                                                           closed[segment_ends[segment_ids]])
+            farthest = PolygonSimplifier.segment_argmax(distances, segment_ids, offsets)
+
+            split = distances[farthest] > tolerance
+            split_points = interior[farthest[split]]
+            closed_keep[split_points] = True
+
+            segment_starts, segment_ends = (np.concatenate([segment_starts[split], split_points]),
+                                            np.concatenate([split_points, segment_ends[split]]))
+
+        # remove os pontos duplicados de fechamento
+        return np.delete(closed_keep, closed_starts + counts)
+
+    @staticmethod
+    def rectangle_corners(points : np.ndarray, counts : np.ndarray, snap : Literal['rectangle', 'quad']):
+        '''
+        Cantos (n_polígonos, 4, 2) do retângulo envolvente de cada polígono, no sentido horário a
+        partir do canto superior esquerdo (para 'rectangle'), e a distância de cada vértice à borda.
+        '''
+        starts = PolygonSimplifier.get_starts(counts)
+        polygon_ids = np.repeat(np.arange(len(counts)), counts)
+
+        if snap == 'rectangle':
+            xmin, ymin = np.minimum.reduceat(points, starts).T
+            xmax, ymax = np.maximum.reduceat(points, starts).T
+            corners = np.stack([np.stack([xmin, ymin], axis=1), np.stack([xmax, ymin], axis=1),
+                                np.stack([xmax, ymax], axis=1), np.stack([xmin, ymax], axis=1)], axis=1)
+            x, y = points.T
+            distances = np.minimum.reduce([x - xmin[polygon_ids], xmax[polygon_ids] - x,
+                                           y - ymin[polygon_ids], ymax[polygon_ids] - y])
+            return corners, distances
+
+        import cv2
+
+        # o retângulo de área mínima de cada polígono (cv2.minAreaRect) e a verificação vetorizada
+        rectangles = [cv2.minAreaRect(polygon.astype(np.float32))
+                      for polygon in np.split(points, np.cumsum(counts)[:-1])]
+        centers = np.array([rectangle[0] for rectangle in rectangles], dtype=np.float64)
+        half_sizes = np.array([rectangle[1] for rectangle in rectangles], dtype=np.float64) / 2
+        angles = np.radians([rectangle[2] for rectangle in rectangles])
+        u = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        v = np.stack([-np.sin(angles), np.cos(angles)], axis=1)
+
+        signs = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64)
+        corners = (centers[:, None] + signs[None, :, :1] * (u * half_sizes[:, :1])[:, None]
+                   + signs[None, :, 1:] * (v * half_sizes[:, 1:])[:, None])
+        # elimina o ruído de ponto flutuante dos senos e cossenos (ex.: -3e-16 no lugar de 0);
+        # + 0.0 converte o -0.0 que o arredondamento produz em 0.0
+        corners = np.round(corners, 6) + 0.0
+
+        offsets = points - centers[polygon_ids]
+        local_x = np.abs(np.einsum('ij,ij->i', offsets, u[polygon_ids]))
+        local_y = np.abs(np.einsum('ij,ij->i', offsets, v[polygon_ids]))
+        distances = np.minimum(half_sizes[polygon_ids, 0] - local_x, half_sizes[polygon_ids, 1] - local_y)
+        return corners, distances
+
+    @staticmethod
+    def snap_rectangles(points : np.ndarray, counts : np.ndarray, tolerance : float,
+                        snap : Literal['rectangle', 'quad'] = 'rectangle'):
+        '''
+        Retorna (máscara dos polígonos que podem ser substituídos pelo retângulo, cantos (n, 4, 2)).
+        Todos os polígonos devem ter pelo menos 3 pontos.
+        '''
+        if not len(counts):
+            return np.zeros(0, dtype=bool), np.zeros((0, 4, 2))
+
+        corners, distances = PolygonSimplifier.rectangle_corners(points, counts, snap)
+        starts = PolygonSimplifier.get_starts(counts)
+
+        near_border = np.logical_and.reduceat(np.abs(distances) <= tolerance, starts)
+        rectangle_areas = PolygonSimplifier.polygon_areas(corners.reshape(-1, 2), np.full(len(counts), 4))
+        perimeters = np.hypot(*np.diff(np.concatenate([corners, corners[:, :1]], axis=1), axis=1).transpose(2, 0, 1)).sum(axis=1)
+        area_deviation = np.abs(rectangle_areas - PolygonSimplifier.polygon_areas(points, counts))
+
+        # retângulos de área nula (pontos coincidentes ou colineares) não substituem o polígono
+        return near_border & (area_deviation <= tolerance * perimeters) & (rectangle_areas > 0), corners
+
+    @staticmethod
+    @instrumented('polygon_simplification.PolygonSimplifier.simplify', items=lambda result: len(result[1]))
+    def simplify(points : np.ndarray, counts : np.ndarray, tolerance : float = 1.0,
+                 snap : Literal['rectangle', 'quad'] = None):
+        '''
+        Simplifica polígonos empacotados. Retorna (pontos, contagens, máscara dos polígonos snapped).
+        Polígonos cuja simplificação teria menos de 3 pontos ou área nula (ex.: pontos coincidentes)
+        são mantidos como no original.
+        '''
+        polygon_ids = np.repeat(np.arange(len(counts)), counts)
+        snapped = np.zeros(len(counts), dtype=bool)
+
+        # polígonos com menos de 3 pontos passam inalterados
+        valid = counts >= 3
+        valid_points = valid[polygon_ids]
+        keep = np.ones(len(points), dtype=bool)
+        keep[valid_points] = PolygonSimplifier.douglas_peucker(points[valid_points], counts[valid], tolerance)
+
+        kept_counts = np.bincount(polygon_ids[keep], minlength=len(counts))
+        kept_areas = np.zeros(len(counts))
+        kept_areas[kept_counts > 0] = PolygonSimplifier.polygon_areas(points[keep], kept_counts[kept_counts > 0])
+        degenerate = valid & ((kept_counts < 3) | (kept_areas <= 0))
+        keep |= degenerate[polygon_ids]
+
+        if snap is None:
+            return points[keep], np.bincount(polygon_ids[keep], minlength=len(counts)), snapped
+
+        corners = np.zeros((len(counts), 4, 2))
+        snapped[valid], corners[valid] = PolygonSimplifier.snap_rectangles(points[valid_points], counts[valid], tolerance, snap)
+        keep &= ~snapped[polygon_ids]
+
+        # junta os pontos mantidos e os cantos dos retângulos, reordenando por polígono
+        snapped_ids = np.flatnonzero(snapped)
+        merged_ids = np.concatenate([polygon_ids[keep], np.repeat(snapped_ids, 4)])
+        merged_points = np.concatenate([points[keep], corners[snapped_ids].reshape(-1, 2)])
+        order = np.argsort(merged_ids, kind='stable')
+
+        return merged_points[order], np.bincount(merged_ids, minlength=len(counts)), snapped
+
+    @staticmethod
+    def simplify_masks(masks : Iterable[Iterable[Tuple[float]]], tolerance : float = 1.0,
+                       snap : Literal['rectangle', 'quad'] = None):
+        '''
+        Simplifica uma lista de polígonos [[x, y], ...] e devolve outra no mesmo formato.
+        '''
+        points, counts = PolygonSimplifier.pack(masks)
+        simplified_points, simplified_counts, _ = PolygonSimplifier.simplify(points, counts, tolerance, snap)
+        return PolygonSimplifier.unpack(simplified_points, simplified_counts)
+
+    @staticmethod
+    def polygon_iou(polygon : np.ndarray, other : np.ndarray, scale : float = 4.0):
+        '''
+        IoU entre dois polígonos por rasterização na região que os contém, ampliada por scale.
+        '''
+        import cv2
+
+        origin = np.minimum(polygon.min(axis=0), other.min(axis=0))
+        width, height = np.ceil((np.maximum(polygon.max(axis=0), other.max(axis=0)) - origin) * scale).astype(int) + 2
+
+        masks = np.zeros((2, height, width), dtype=np.uint8)
+        for mask, points in zip(masks, [polygon, other]):
+            cv2.fillPoly(mask, [np.round((points - origin) * scale).astype(np.int32)], 1)
+
+        union = np.count_nonzero(masks[0] | masks[1])
+        return np.count_nonzero(masks[0] & masks[1]) / union if union else 1.0
+
+
+@dataclass
+class SimplificationReport:
+    polygons : int = 0
+    snapped : int = 0
+    points_before : int = 0
+    points_after : int = 0
+    label_bytes_before : int = 0
+    label_bytes_after : int = 0
+    max_iou_deviation : float = 0.0
+
+    @staticmethod
+    def label_bytes(counts : np.ndarray):
+        '''
+        Tamanho do TXT de segmentação da Ultralytics (classe de 1 dígito e 6 casas decimais por coordenada).
+        '''
+        return int(YOLO_BYTES_PER_POINT * counts.sum() + 2 * len(counts))
+
+    def update(self, points : np.ndarray, counts : np.ndarray, simplified_points : np.ndarray,
+               simplified_counts : np.ndarray, snapped : np.ndarray, measure_iou : bool = True):
+        self.polygons += len(counts)
+        self.snapped += int(snapped.sum())
+        self.points_before += int(counts.sum())
+        self.points_after += int(simplified_counts.sum())
+        self.label_bytes_before += SimplificationReport.label_bytes(counts)
+        self.label_bytes_after += SimplificationReport.label_bytes(simplified_counts)
+
+        if measure_iou and len(counts):
+            # a IoU só é medida nos polígonos alterados
+            changed = np.flatnonzero((counts != simplified_counts) | snapped)
+            originals = np.split(points, np.cumsum(counts)[:-1])
+            simplified = np.split(simplified_points, np.cumsum(simplified_counts)[:-1])
+            for index in changed:
+                if counts[index] >= 3:
+                    deviation = 1 - PolygonSimplifier.polygon_iou(originals[index], simplified[index])
+                    self.max_iou_deviation = max(self.max_iou_deviation, deviation)
+
+    def to_dict(self):
+        return asdict(self) | {
+            'point_reduction': round(1 - self.points_after / self.points_before, 4) if self.points_before else 0.0,
+            'label_size_reduction': round(1 - self.label_bytes_after / self.label_bytes_before, 4) if self.label_bytes_before else 0.0
+        }
+
+    def print_report(self):
+        report = self.to_dict()
+        print(f'\nPolígonos: {self.polygons} ({self.snapped} substituídos por retângulos)')
+        print(f'Pontos: {self.points_before} -> {self.points_after} (redução de {100 * report["point_reduction"]:.1f}%)')
+        print(f'Rótulos YOLO: {self.label_bytes_before / 2**20:.2f} MB -> {self.label_bytes_after / 2**20:.2f} MB '
+              f'(redução de {100 * report["label_size_reduction"]:.1f}%)')
+        print(f'Maior desvio de IoU: {self.max_iou_deviation:.4f}')
+
+    def save(self, path : str | Path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+def simplify_pages(pages : List[List[List[Tuple[float]]]], tolerance : float = 1.0,
+                   snap : Literal['rectangle', 'quad'] = None, report : SimplificationReport = None,
+                   measure_iou : bool = True):
+    '''
+    Simplifica os polígonos de várias páginas em uma única chamada vetorizada e devolve as páginas
+    no formato de entrada (coluna xy). Se report for informado, as estatísticas são acumuladas nele.
+    '''
+    page_counts = [len(masks) for masks in pages]
+    points, counts = PolygonSimplifier.pack([mask for masks in pages for mask in masks])
+    simplified_points, simplified_counts, snapped = PolygonSimplifier.simplify(points, counts, tolerance, snap)
+
+    if report is not None:
+        report.update(points, counts, simplified_points, simplified_counts, snapped, measure_iou)
+
+    simplified_masks = PolygonSimplifier.unpack(simplified_points, simplified_counts)
+    page_offsets = np.cumsum([0] + page_counts)
+    return [simplified_masks[start:end] for start, end in zip(page_offsets[:-1], page_offsets[1:])]
+
+
+def main():
+    from .dataset_to_dataframe import ConvertICDARDatasetToDataframe
+
+    parser = argparse.ArgumentParser(description='Avalia a simplificação dos polígonos das células de XMLs cTDaR.')
+    parser.add_argument('labels_path')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='tolerância em pixels')
+    parser.add_argument('--snap', choices=['rectangle', 'quad'], default=None)
+    parser.add_argument('--batch-size', type=int, default=256, help='páginas por chamada vetorizada')
+    parser.add_argument('--report', default=None, help='grava o relatório em JSON')
+    args = parser.parse_args()
+
+    converter = ConvertICDARDatasetToDataframe(images_path=args.labels_path, labels_path=args.labels_path)
+    xml_paths = [path for path in converter.label_files if str(path).endswith('.xml')]
+
+    report = SimplificationReport()
+    for start in range(0, len(xml_paths), args.batch_size):
+        pages = [converter.get_xy_annotations_from_xml(xml_path)
+                 for xml_path in xml_paths[start:start + args.batch_size]]
+        simplify_pages(pages, args.tolerance, args.snap, report)
+
+    report.print_report()
+    if args.report is not None:
+        report.save(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,16 @@
 import os
-import shutil
-import xml.etree.ElementTree as ET
-from PIL import Image
-from glob import glob
-
-import pandas as pd
 from pathlib import Path
-from typing import Iterable, Tuple, Literal
+from typing import Iterable, Tuple, Literal, TYPE_CHECKING
+
+import numpy as np
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 
-import random
+from Instrumentation.spans import instrumented, add_bytes_written
 
+# o pandas (~0.4 s de importação) só é usado como tipo; os workers de conversão não o carregam
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class YOLOConverter:
@@ -33,11 +34,12 @@ class YOLOConverter:
     @staticmethod
     def convert_xy2yolo(xmin : int, ymin : int, xmax : int, ymax : int):
         '''
-        DocString
+        Converte uma bounding box (xmin, ymin, xmax, ymax) em (xcentral, ycentral, width, height).
+        O centro não é arredondado: a divisão inteira deslocaria as caixas em até meio pixel.
         '''
         
-        xcentral = (xmax + xmin) // 2
-        ycentral = (ymax + ymin) // 2
+        xcentral = (xmax + xmin) / 2
+        ycentral = (ymax + ymin) / 2
         width = xmax - xmin
         height = ymax - ymin
 
@@ -52,7 +54,7 @@ class YOLOConverter:
         retornando [ xcentral / image_width, ycentral / image_height, width / image_width, height / image_height ]
         '''
         
-        xmin, ymin, xmax, ymax = sum(bounding_box, [])
+        (xmin, ymin), (xmax, ymax) = bounding_box
         xcentral, ycentral, width, height = YOLOConverter.convert_xy2yolo(xmin, ymin, xmax, ymax)
         
         xcentral /= image_width
@@ -76,6 +78,22 @@ class YOLOConverter:
                                    for boudning_box in bounding_boxes]
         
         return converted_bouding_boxes
+
+    @staticmethod
+    def convert_boxes_xy2yolo(boxes : np.ndarray, image_sizes : np.ndarray):
+        '''
+        Versão vetorizada de convert_bounding_boxes_xy2yolo para todas as caixas de um split:
+        boxes é (N, 4) com xmin, ymin, xmax, ymax e image_sizes é (N, 2) com a largura e a altura
+        da imagem de cada caixa (ou (2,), se todas as imagens têm o mesmo tamanho).
+        Retorna (N, 4) com xcentral, ycentral, width e height normalizados.
+        '''
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        image_sizes = np.asarray(image_sizes, dtype=np.float64)
+
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        sizes = boxes[:, 2:] - boxes[:, :2]
+
+        return np.concatenate([centers, sizes], axis=1) / np.tile(image_sizes, 2)
     
     @staticmethod
     def normalize_mask_points( 
@@ -123,31 +141,45 @@ class YOLOConverter:
     def create_mask_txt_file_content(normalized_masks : Iterable[Iterable[Tuple[float]]],
                                      class_ids : Iterable[int]):
 
-        lines = []
-        for class_id, mask in zip(class_ids, normalized_masks):
-            # constroi a string com os pontos normalizados x1_norm y2_norm x2_norm y2_norm ... xn_norm yn_norm 
-            poly_str = " ".join([f"{coord:.6f}" for xy_point in mask for coord in xy_point ])
-            # define a string que representa a linha com class_id x1_norm y2_norm x2_norm y2_norm ... xn_norm yn_norm 
-            line = f"{class_id} {poly_str}"
-            # adiciona a linnha na lista de linhas
-            lines.append(line)       
-
-        # concatena todas as linhas do arquivo TXT em uma string separadas pela quebra de linha
-        return "\n".join(lines)
+        lines = list(zip(class_ids, normalized_masks))
+
+        # monta o modelo da página inteira, uma linha class_id %.6f %.6f ... por máscara, e formata
+        # todas as coordenadas de uma só vez (mesmo resultado de f"{coord:.6f}" coordenada a coordenada)
+        template = "\n".join([f"{class_id}" + " %.6f" * (2 * len(mask)) if len(mask) else f"{class_id} "
+                              for class_id, mask in lines])
+        coords = tuple(chain.from_iterable(chain.from_iterable(mask for _, mask in lines)))
+
+        return template % coords
     
     @staticmethod
     def create_bbox_txt_file_content(normalized_bouding_boxes : Iterable[Iterable[Tuple[float]]],
                                      class_ids : Iterable[int]):
 
-        lines = []
-        for class_id, bbox in zip(class_ids, normalized_bouding_boxes):
-            xcentral, ycentral, width, height = bbox
-            line = f"{class_id} {xcentral} {ycentral} {width} {height}"
-            lines.append(line)
+        # uma linha class_id xcentral ycentral width height por caixa, com 6 casas decimais
+        # (a mesma precisão dos rótulos de segmentação), formatadas de uma só vez
+        lines = [(class_id, *bbox) for class_id, bbox in zip(class_ids, normalized_bouding_boxes)]
+        template = "\n".join(["%d %.6f %.6f %.6f %.6f"] * len(lines))
 
-        # concatena todas as linhas do arquivo TXT em uma string separadas pela quebra de linha
-        return "\n".join(lines)
+        return template % tuple(chain.from_iterable(lines))
 
+    @staticmethod
+    def create_bbox_txt_contents(class_ids : np.ndarray, yolo_boxes : np.ndarray, offsets : np.ndarray):
+        '''
+        Conteúdo dos TXTs de detecção de várias imagens: as caixas da imagem i são
+        yolo_boxes[offsets[i]:offsets[i + 1]]. As linhas de cada imagem são formatadas com um
+        único modelo (reutilizado entre imagens com a mesma quantidade de caixas).
+        '''
+        values = np.column_stack([class_ids, yolo_boxes]).tolist()
+        templates = {}
+        contents = []
+
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            n_boxes = end - start
+            if n_boxes not in templates:
+                templates[n_boxes] = "\n".join(["%d %.6f %.6f %.6f %.6f"] * n_boxes)
+            contents.append(templates[n_boxes] % tuple(chain.from_iterable(values[start:end])))
+
+        return contents
 
    
     @staticmethod
@@ -161,7 +193,7 @@ class YOLOConverter:
         
         header_content = f"path: {output_dir}\ntrain: {train_fold_path}\n"
         header_content += f"val: {val_fold_path}\n" if val_fold_path is not None else ""
-        header_content += f"test: {val_fold_path}\n" if test_fold_path is not None else ""
+        header_content += f"test: {test_fold_path}\n" if test_fold_path is not None else ""
         header_content += f"task : {task}\n\nnames:\n"
         classes_content = "".join([f"   {class_id}: {class_label}\n" for class_id, class_label in zip(class_ids, class_labels)])
 
@@ -170,7 +202,7 @@ class YOLOConverter:
     @staticmethod
     def save_file(content : str,  path : str | Path):
         with open(path, 'w') as file: 
-            file.write(content)
+            add_bytes_written(file.write(content))
 
 
 class ICDARYOLOConverter:
@@ -179,6 +211,7 @@ class ICDARYOLOConverter:
     class_label = 'cell'
 
     @staticmethod
+    @instrumented('yolo_converter.ICDARYOLOConverter.process_masks')
     def process_masks(masks : Iterable[Iterable[Tuple[float]]], 
                       image_width : int, 
                       image_height : int,
@@ -213,4 +246,76 @@ class ICDARYOLOConverter:
         return yaml_path
 
 
+class FinTabNetYOLOConverter:
+
+    class_id_map = {
+        'table': 0,
+        'table column': 1,
+        'table column header': 2,
+        'table projected row header': 3,
+        'table row': 4,
+        'table spanning cell': 5
+    }
+
+    @staticmethod
+    def group_by_image(filenames : Iterable[str]):
+        '''
+        Ordem (estável) que agrupa as caixas por imagem, os nomes das imagens e os offsets de cada grupo.
+        '''
+        filenames = np.asarray(filenames)
+        order = np.argsort(filenames, kind='stable')
+        image_names, starts = np.unique(filenames[order], return_index=True)
+        offsets = np.append(starts, len(filenames))
+
+        return order, image_names, offsets
+
+    @staticmethod
+    @instrumented('yolo_converter.FinTabNetYOLOConverter.process_split', items=len)
+    def process_split(annotations : 'pd.DataFrame',
+                      labels_dir : str | Path,
+                      workers : int = 8):
+        '''
+        Gera os TXTs de detecção de um split a partir do DataFrame de instâncias do FinTabNet
+        (colunas filename, name, xmin, ymin, xmax, ymax, width e height; uma linha por caixa).
+        A conversão é feita de uma só vez para todas as caixas e os arquivos são gravados por um
+        pool de threads. Como as coordenadas são normalizadas, o resultado não depende de as
+        imagens serem redimensionadas depois. Retorna os caminhos dos TXTs.
+        '''
+        os.makedirs(labels_dir, exist_ok=True)
+
+        order, image_names, offsets = FinTabNetYOLOConverter.group_by_image(annotations['filename'].to_numpy())
+        annotations = annotations.iloc[order]
+
+        class_ids = annotations['name'].map(FinTabNetYOLOConverter.class_id_map)
+        if class_ids.isna().any():
+            raise ValueError(f'Classes desconhecidas: {sorted(annotations["name"][class_ids.isna()].unique())}')
+        class_ids = class_ids.to_numpy()
+        yolo_boxes = YOLOConverter.convert_boxes_xy2yolo(annotations[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy(),
+                                                         annotations[['width', 'height']].to_numpy())
+        contents = YOLOConverter.create_bbox_txt_contents(class_ids, yolo_boxes, offsets)
+
+        txt_paths = [Path(labels_dir)/f'{os.path.splitext(image_name)[0]}.txt' for image_name in image_names]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(YOLOConverter.save_file, contents, txt_paths))
+
+        return txt_paths
+
+    @staticmethod
+    def create_yaml(output_dir : str | Path,
+                    train_fold_path : str | Path,
+                    val_fold_path : str | Path):
 
+        yaml_path = os.path.join(output_dir, "dataset.yaml")
+        yaml_content = YOLOConverter.create_yaml_content(
+            output_dir = output_dir,
+            train_fold_path = train_fold_path,
+            val_fold_path = val_fold_path,
+            class_ids = FinTabNetYOLOConverter.class_id_map.values(),
+            class_labels = FinTabNetYOLOConverter.class_id_map.keys(),
+            task = 'detect'
+        )
+
+        YOLOConverter.save_file(yaml_content, yaml_path)
+
+        print(f"\nYAML criado em: {yaml_path}")
+        return yaml_path
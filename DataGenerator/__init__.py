@@ -0,0 +1,11 @@
+'''
+Geração de corpora sintéticos nos formatos do ICDAR 2019 cTDaR, do FinTabNet.c e da Ultralytics.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'synthetic_corpus': ['SyntheticCorpusGenerator'],
+})
@@ -0,0 +1,422 @@
+'''
+Gerador de corpora sintéticos nos formatos do ICDAR 2019 cTDaR e do FinTabNet.
+
+Cada documento é gerado a partir de um gerador aleatório semeado por (seed, índice do documento),
+de modo que o resultado independe da quantidade de processos utilizados. Para cada página são
+sorteadas tabelas em grade, com células mescladas (row/col spans), que são escritas como:
+
+    - XML cTDaR (<document><table><Coords/><cell start-row ...><Coords points/></cell></table>);
+    - XML PASCAL VOC do FinTabNet.c-Structure (table, table row, table column, ...);
+    - rótulos YOLO de segmentação organizados em folds, como em dataset_generation_icdar.ipynb;
+    - imagens renderizadas das páginas (opcional).
+
+Uso:
+    python -m DataGenerator.synthetic_corpus icdar --output synthetic_icdar --documents 100000 --workers 8
+    python -m DataGenerator.synthetic_corpus fintabnet --output synthetic_fintabnet --documents 10000
+    python -m DataGenerator.synthetic_corpus folds --output synthetic_folds --documents 5000 --folds 5
+'''
+
+import os
+import argparse
+import numpy as np
+from PIL import Image, ImageDraw
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Iterable, Literal
+
+from tqdm import tqdm
+
+
+@dataclass
+class SyntheticCell:
+    start_row : int
+    end_row : int
+    start_col : int
+    end_col : int
+    # polígono (k, 2) em coordenadas absolutas da página
+    polygon : np.ndarray
+
+    def get_bbox(self):
+        return (*self.polygon.min(axis=0), *self.polygon.max(axis=0))
+
+
+@dataclass
+class SyntheticTable:
+    bbox : Tuple[int, int, int, int]
+    row_edges : np.ndarray
+    col_edges : np.ndarray
+    cells : List[SyntheticCell] = field(default_factory=list)
+
+
+@dataclass
+class SyntheticPage:
+    filename : str
+    width : int
+    height : int
+    tables : List[SyntheticTable] = field(default_factory=list)
+
+
+class SyntheticCorpusGenerator:
+
+    def __init__(self,
+                 output_dir : str | Path,
+                 n_documents : int,
+                 cells_per_table : int = 40,
+                 tables_per_page : int = 1,
+                 page_size : Tuple[int, int] = (1240, 1754),
+                 span_probability : float = 0.05,
+                 points_per_edge : int = 1,
+                 render_images : bool = True,
+                 image_format : str = 'jpg',
+                 seed : int = 42,
+                 workers : int = None,
+                 chunk_size : int = 256):
+        '''
+        cells_per_table controla a densidade de células de cada tabela (grade aproximadamente
+        quadrada), points_per_edge a quantidade de vértices colineares por aresta das células
+        (1 gera quadriláteros) e page_size as dimensões (largura, altura) das páginas.
+        '''
+
+        self.output_dir = Path(output_dir)
+        self.n_documents = n_documents
+        self.cells_per_table = cells_per_table
+        self.tables_per_page = tables_per_page
+        self.page_size = page_size
+        self.span_probability = span_probability
+        self.points_per_edge = points_per_edge
+        self.render_images = render_images
+        self.image_format = image_format
+        self.seed = seed
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    def get_random_generator(self, document_index : int):
+        return np.random.default_rng([self.seed, document_index])
+
+    # -----------------------------------------------------------------------------------
+    # Layout
+    # -----------------------------------------------------------------------------------
+
+    @staticmethod
+    def split_edges(random_generator : np.random.Generator, start : int, end : int, n_parts : int):
+        '''
+        Divide o intervalo [start, end] em n_parts partes de tamanhos aleatórios, retornando as n_parts + 1 bordas.
+        '''
+        weights = random_generator.uniform(0.5, 1.5, size=n_parts)
+        edges = start + np.concatenate([[0], np.cumsum(weights)]) / weights.sum() * (end - start)
+        return np.round(edges).astype(np.int64)
+
+    @staticmethod
+    def rectangle_polygon(xmin : int, ymin : int, xmax : int, ymax : int, points_per_edge : int = 1):
+        '''
+        Retângulo no sentido horário a partir do canto superior esquerdo, com points_per_edge
+        vértices (colineares) por aresta.
+        '''
+        steps = np.arange(points_per_edge) / points_per_edge
+        top = np.stack([xmin + steps * (xmax - xmin), np.full(points_per_edge, ymin)], axis=1)
+        right = np.stack([np.full(points_per_edge, xmax), ymin + steps * (ymax - ymin)], axis=1)
+        bottom = np.stack([xmax - steps * (xmax - xmin), np.full(points_per_edge, ymax)], axis=1)
+        left = np.stack([np.full(points_per_edge, xmin), ymax - steps * (ymax - ymin)], axis=1)
+        return np.round(np.concatenate([top, right, bottom, left])).astype(np.int64)
+
+    def generate_table(self, random_generator : np.random.Generator, bbox : Tuple[int, int, int, int]):
+
+        xmin, ymin, xmax, ymax = bbox
+        aspect = (xmax - xmin) / max(ymax - ymin, 1)
+        n_cols = max(1, int(round(np.sqrt(self.cells_per_table * aspect / 4))))
+        n_rows = max(1, int(round(self.cells_per_table / n_cols)))
+
+        row_edges = self.split_edges(random_generator, ymin, ymax, n_rows)
+        col_edges = self.split_edges(random_generator, xmin, xmax, n_cols)
+
+        table = SyntheticTable(bbox=bbox, row_edges=row_edges, col_edges=col_edges)
+
+        # células já cobertas por uma célula mesclada
+        covered = np.zeros((n_rows, n_cols), dtype=bool)
+
+        for row in range(n_rows):
+            for col in range(n_cols):
+                if covered[row, col]:
+                    continue
+
+                end_row, end_col = row, col
+                if random_generator.random() < self.span_probability:
+                    if random_generator.random() < 0.5 and col + 1 < n_cols and not covered[row, col + 1]:
+                        end_col = col + 1
+                    elif row + 1 < n_rows:
+                        end_row = row + 1
+
+                covered[row:end_row + 1, col:end_col + 1] = True
+                polygon = self.rectangle_polygon(col_edges[col], row_edges[row],
+                                                 col_edges[end_col + 1], row_edges[end_row + 1],
+                                                 self.points_per_edge)
+                table.cells.append(SyntheticCell(row, end_row, col, end_col, polygon))
+
+        return table
+
+    def generate_page(self, document_index : int, prefix : str = 'cTDaR_s'):
+
+        random_generator = self.get_random_generator(document_index)
+        width, height = self.page_size
+        page = SyntheticPage(filename=f'{prefix}{document_index:07d}.{self.image_format}', width=width, height=height)
+
+        # as tabelas ocupam faixas horizontais disjuntas da página
+        margin = int(0.05 * min(width, height))
+        band_edges = self.split_edges(random_generator, margin, height - margin, self.tables_per_page)
+
+        for band_top, band_bottom in zip(band_edges[:-1], band_edges[1:]):
+            band_height = band_bottom - band_top
+            table_height = int(band_height * random_generator.uniform(0.5, 0.9))
+            table_width = int((width - 2 * margin) * random_generator.uniform(0.6, 1.0))
+            xmin = int(random_generator.integers(margin, width - margin - table_width + 1))
+            ymin = int(band_top + random_generator.integers(0, band_height - table_height + 1))
+            page.tables.append(self.generate_table(random_generator, (xmin, ymin, xmin + table_width, ymin + table_height)))
+
+        return page
+
+    # -----------------------------------------------------------------------------------
+    # Escrita
+    # -----------------------------------------------------------------------------------
+
+    @staticmethod
+    def format_points(polygon : np.ndarray):
+        return ' '.join(f'{x},{y}' for x, y in polygon.tolist())
+
+    @staticmethod
+    def create_ctdar_xml_content(page : SyntheticPage):
+
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<document filename="{page.filename}">']
+        for table_index, table in enumerate(page.tables, start=1):
+            table_polygon = SyntheticCorpusGenerator.rectangle_polygon(*table.bbox)
+            lines.append(f'  <table id="Table_{table_index}">')
+            lines.append(f'    <Coords points="{SyntheticCorpusGenerator.format_points(table_polygon)}"/>')
+            for cell_index, cell in enumerate(table.cells, start=1):
+                lines.append(f'    <cell id="TableCell_{table_index}_{cell_index}" start-row="{cell.start_row}" '
+                             f'end-row="{cell.end_row}" start-col="{cell.start_col}" end-col="{cell.end_col}">')
+                lines.append(f'      <Coords points="{SyntheticCorpusGenerator.format_points(cell.polygon)}"/>')
+                lines.append('    </cell>')
+            lines.append('  </table>')
+        lines.append('</document>')
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def get_voc_objects(table : SyntheticTable, offset : Tuple[int, int] = (0, 0)):
+        '''
+        Objetos do FinTabNet.c-Structure de uma tabela: table, table row, table column,
+        table column header (primeira linha) e table spanning cell (células mescladas).
+        '''
+        dx, dy = offset
+        xmin, ymin, xmax, ymax = table.bbox
+        objects = [('table', xmin, ymin, xmax, ymax)]
+        objects += [('table row', xmin, top, xmax, bottom) for top, bottom in zip(table.row_edges[:-1], table.row_edges[1:])]
+        objects += [('table column', left, ymin, right, ymax) for left, right in zip(table.col_edges[:-1], table.col_edges[1:])]
+        objects.append(('table column header', xmin, ymin, xmax, table.row_edges[1]))
+        objects += [('table spanning cell', *cell.get_bbox()) for cell in table.cells
+                    if cell.end_row > cell.start_row or cell.end_col > cell.start_col]
+
+        return [(name, int(x0) - dx, int(y0) - dy, int(x1) - dx, int(y1) - dy) for name, x0, y0, x1, y1 in objects]
+
+    @staticmethod
+    def create_voc_xml_content(filename : str, width : int, height : int, objects : Iterable[tuple], depth : int = 3):
+
+        lines = ['<annotation>', '  <folder/>', f'  <filename>{filename}</filename>', f'  <path>{filename}</path>',
+                 '  <source>', '    <database>FinTabNet.c</database>', '  </source>',
+                 '  <size>', f'    <width>{width}</width>', f'    <height>{height}</height>', f'    <depth>{depth}</depth>',
+                 '  </size>', '  <segmented>0</segmented>']
+
+        for name, xmin, ymin, xmax, ymax in objects:
+            lines += ['  <object>', f'    <name>{name}</name>', '    <pose>Frontal</pose>',
+                      '    <truncated>0</truncated>', '    <difficult>0</difficult>', '    <occluded>0</occluded>',
+                      '    <bndbox>', f'      <xmin>{xmin}</xmin>', f'      <ymin>{ymin}</ymin>',
+                      f'      <xmax>{xmax}</xmax>', f'      <ymax>{ymax}</ymax>', '    </bndbox>', '  </object>']
+        lines.append('</annotation>')
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def render_page(page : SyntheticPage, random_generator : np.random.Generator, crop = None):
+        '''
+        Renderiza a página em tons de cinza: bordas das células e blocos simulando o texto.
+        '''
+        image = Image.new('L', (page.width, page.height), color=255)
+        draw = ImageDraw.Draw(image)
+
+        for table in page.tables:
+            for cell in table.cells:
+                xmin, ymin, xmax, ymax = (int(value) for value in cell.get_bbox())
+                draw.rectangle((xmin, ymin, xmax, ymax), outline=0, width=1)
+
+                text_width = int((xmax - xmin) * random_generator.uniform(0.2, 0.8))
+                text_height = max(1, int((ymax - ymin) * 0.4))
+                if text_width > 2 and ymax - ymin > 4:
+                    top = ymin + (ymax - ymin - text_height) // 2
+                    draw.rectangle((xmin + 2, top, xmin + 2 + text_width, top + text_height), fill=90)
+
+        if crop is not None:
+            image = image.crop(crop)
+
+        return image.convert('RGB')
+
+    @staticmethod
+    def create_yolo_seg_content(page : SyntheticPage, class_id : int = 0):
+        from DataExtractor.yolo_converter import YOLOConverter
+
+        masks = [cell.polygon.tolist() for table in page.tables for cell in table.cells]
+        normalized_masks = YOLOConverter.normalize_masks(masks, page.width, page.height)
+        return YOLOConverter.create_mask_txt_file_content(normalized_masks, [class_id] * len(normalized_masks))
+
+    # -----------------------------------------------------------------------------------
+    # Geração paralela
+    # -----------------------------------------------------------------------------------
+
+    def write_icdar_documents(self, document_indices : Iterable[int]):
+
+        for document_index in document_indices:
+            page = self.generate_page(document_index, prefix='cTDaR_s')
+            stem = os.path.splitext(page.filename)[0]
+
+            with open(self.output_dir/f'{stem}.xml', 'w') as file:
+                file.write(self.create_ctdar_xml_content(page))
+
+            if self.render_images:
+                random_generator = self.get_random_generator(document_index)
+                self.render_page(page, random_generator).save(self.output_dir/page.filename)
+
+        return len(document_indices)
+
+    def write_fintabnet_documents(self, document_indices : Iterable[int], split : str):
+
+        for document_index in document_indices:
+            page = self.generate_page(document_index, prefix=f'SYN_{split}_page_')
+
+            # no FinTabNet.c cada imagem é o recorte de uma tabela com uma pequena margem
+            for table_index, table in enumerate(page.tables):
+                xmin, ymin, xmax, ymax = table.bbox
+                padding = 10
+                crop = (max(0, xmin - padding), max(0, ymin - padding),
+                        min(page.width, xmax + padding), min(page.height, ymax + padding))
+                crop_width, crop_height = crop[2] - crop[0], crop[3] - crop[1]
+
+                filename = f'{os.path.splitext(page.filename)[0]}_table_{table_index}.{self.image_format}'
+                objects = self.get_voc_objects(table, offset=crop[:2])
+                content = self.create_voc_xml_content(filename, crop_width, crop_height, objects)
+
+                with open(self.output_dir/split/f'{os.path.splitext(filename)[0]}.xml', 'w') as file:
+                    file.write(content)
+
+                if self.render_images:
+                    random_generator = self.get_random_generator(document_index)
+                    self.render_page(page, random_generator, crop=crop).save(self.output_dir/'images'/filename)
+
+        return len(document_indices)
+
+    def write_fold_documents(self, document_indices : Iterable[int], n_folds : int):
+        '''
+        Escreve cada documento na estrutura dataset_folds/fold_k/{train,val}/{images,labels}.
+        O documento é de validação no fold (índice % n_folds) e de treino nos demais.
+        '''
+
+        for document_index in document_indices:
+            page = self.generate_page(document_index, prefix='cTDaR_s')
+            stem = os.path.splitext(page.filename)[0]
+            content = self.create_yolo_seg_content(page)
+            image = self.render_page(page, self.get_random_generator(document_index)) if self.render_images else None
+
+            for fold_index in range(n_folds):
+                split = 'val' if document_index % n_folds == fold_index else 'train'
+                split_path = self.output_dir/f'fold_{fold_index + 1}'/split
+
+                with open(split_path/'labels'/f'{stem}.txt', 'w') as file:
+                    file.write(content)
+
+                if image is not None:
+                    image.save(split_path/'images'/page.filename)
+
+        return len(document_indices)
+
+    def run_in_parallel(self, function, description : str, *args):
+
+        chunks = [range(start, min(start + self.chunk_size, self.n_documents))
+                  for start in range(0, self.n_documents, self.chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(function, chunk, *args) for chunk in chunks]
+            with tqdm(total=self.n_documents, desc=description) as pbar:
+                for future in futures:
+                    pbar.update(future.result())
+
+    def generate_icdar(self):
+        '''
+        Gera o corpus na estrutura de dataset/training/TRACKB1/ground_truth: imagens e XMLs no mesmo diretório.
+        '''
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.run_in_parallel(self.write_icdar_documents, 'Gerando documentos cTDaR...')
+        return self.output_dir
+
+    def generate_fintabnet(self, split : Literal['train', 'val', 'test'] = 'train'):
+        '''
+        Gera o corpus na estrutura do FinTabNet.c-Structure: XMLs em <split>/ e imagens em images/.
+        '''
+        (self.output_dir/split).mkdir(parents=True, exist_ok=True)
+        (self.output_dir/'images').mkdir(parents=True, exist_ok=True)
+        self.run_in_parallel(self.write_fintabnet_documents, f'Gerando documentos FinTabNet ({split})...', split)
+        return self.output_dir
+
+    def generate_yolo_folds(self, n_folds : int = 5):
+        '''
+        Gera folds no formato esperado pela Ultralytics (e pelo YOLO2MaskRCNN), com o arquivo dataset.yaml.
+        '''
+        from DataExtractor.yolo_converter import YOLOConverter, ICDARYOLOConverter
+
+        for fold_index in range(n_folds):
+            fold_path = self.output_dir/f'fold_{fold_index + 1}'
+            YOLOConverter.create_folders(fold_path)
+            ICDARYOLOConverter.create_yaml(output_dir=fold_path.as_posix() + '/', train_fold_path='train/', val_fold_path='val/')
+
+        self.run_in_parallel(self.write_fold_documents, 'Gerando folds YOLO...', n_folds)
+        return self.output_dir
+
+
+def main(argv : Iterable[str] = None):
+
+    parser = argparse.ArgumentParser(description='Gera corpora sintéticos cTDaR/FinTabNet para testes de escala.')
+    parser.add_argument('format', choices=['icdar', 'fintabnet', 'folds'])
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--documents', type=int, default=1000)
+    parser.add_argument('--cells', type=int, default=40, help='quantidade aproximada de células por tabela')
+    parser.add_argument('--tables', type=int, default=1, help='quantidade de tabelas por página')
+    parser.add_argument('--page-size', type=int, nargs=2, default=[1240, 1754], metavar=('LARGURA', 'ALTURA'))
+    parser.add_argument('--points-per-edge', type=int, default=1)
+    parser.add_argument('--span-probability', type=float, default=0.05)
+    parser.add_argument('--no-images', action='store_true', help='gera apenas as anotações')
+    parser.add_argument('--split', default='train', help='split do FinTabNet')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    generator = SyntheticCorpusGenerator(
+        output_dir=args.output,
+        n_documents=args.documents,
+        cells_per_table=args.cells,
+        tables_per_page=args.tables,
+        page_size=tuple(args.page_size),
+        span_probability=args.span_probability,
+        points_per_edge=args.points_per_edge,
+        render_images=not args.no_images,
+        seed=args.seed,
+        workers=args.workers
+    )
+
+    if args.format == 'icdar':
+        generator.generate_icdar()
+    elif args.format == 'fintabnet':
+        generator.generate_fintabnet(args.split)
+    else:
+        generator.generate_yolo_folds(args.folds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+'''
+Divisão do conjunto de dados em folds e detecção de quase duplicatas.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'dedup': ['PerceptualHasher', 'NearDuplicateFinder', 'assign_duplicate_groups'],
+    'kfold': ['DataFrameKFoldSplitter', 'LazyFold', 'get_page_key'],
+})
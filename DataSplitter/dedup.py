@@ -0,0 +1,292 @@
+'''
+Detecção de imagens quase duplicadas por hashes perceptuais.
+
+Os hashes (dHash e pHash, 64 bits) são calculados em paralelo a partir de miniaturas em tons de
+cinza (o JPEG é decodificado já reduzido com Image.draft) e armazenados como arrays uint64. A
+busca por pares a no máximo threshold bits de distância usa indexação multi-índice: os 64 bits
+são divididos em threshold + 1 bandas e, pelo princípio da casa dos pombos, dois hashes próximos
+coincidem em pelo menos uma banda. Apenas os pares que caem no mesmo balde de alguma banda são
+verificados, com a distância de Hamming vetorizada (np.bitwise_count), o que evita a comparação
+de todos os pares.
+
+Os grupos de duplicatas (componentes conexas dos pares encontrados, unidas às variantes _var_N de
+uma mesma página) podem ser usados na divisão em folds (DataFrameKFoldSplitter com
+group_column='duplicate_group'), para que duplicatas não vazem entre treino e validação, e na
+amostragem (um representante por grupo ou pesos 1 / tamanho do grupo).
+
+Uso:
+    python -m DataSplitter.dedup hash dataset_completo/train/images --output hashes.npz
+    python -m DataSplitter.dedup find hashes.npz --threshold 6 --output duplicates.csv
+'''
+
+import csv
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Literal
+from tqdm import tqdm
+
+from .kfold import get_page_key
+from Instrumentation.spans import instrumented
+
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp', 'bmp', 'tif', 'tiff']
+
+# lado da miniatura usada pelo pHash (a DCT é calculada sobre 32 x 32 e os 8 x 8 coeficientes de
+# menor frequência formam o hash)
+PHASH_SIZE = 32
+HASH_SIZE = 8
+
+
+def get_dct_matrix(size : int):
+    '''
+    Matriz da DCT-II ortonormal, para calcular a DCT 2D de um lote como D @ X @ D.T.
+    '''
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def get_box_matrix(source_size : int, target_size : int):
+    '''
+    Matriz (target_size, source_size) que reduz um eixo pela média das áreas sobrepostas.
+    '''
+    edges = np.linspace(0, source_size, target_size + 1)
+    pixels = np.arange(source_size)[None, :]
+    overlap = np.clip(np.minimum(edges[1:, None], pixels + 1) - np.maximum(edges[:-1, None], pixels), 0, None)
+    return (overlap / overlap.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def pack_bits(bits : np.ndarray):
+    '''
+    Empacota (N, 64) booleanos em N inteiros uint64 (o primeiro bit é o mais significativo).
+    '''
+    return np.packbits(bits.reshape(len(bits), -1), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def hamming_distance(first : np.ndarray, second : np.ndarray):
+    return np.bitwise_count(np.bitwise_xor(first, second))
+
+
+class PerceptualHasher:
+
+    DCT_MATRIX = get_dct_matrix(PHASH_SIZE)
+
+    @staticmethod
+    def load_thumbnail(image_path : str | Path, size : int = PHASH_SIZE):
+        '''
+        Miniatura size x size em tons de cinza (float32). O draft faz o decodificador do JPEG
+        reduzir a imagem durante a decodificação, o que domina o custo em páginas grandes.
+        '''
+        with Image.open(image_path) as image:
+            image.draft('L', (size * 4, size * 4))
+            thumbnail = image.convert('L').resize((size, size), Image.Resampling.BOX)
+            return np.asarray(thumbnail, dtype=np.float32)
+
+    @staticmethod
+    def dhash(thumbnails : np.ndarray):
+        '''
+        dHash de um lote (N, altura, largura): compara pixels vizinhos na horizontal de uma miniatura 8 x 9.
+        '''
+        _, height, width = thumbnails.shape
+        # redução por média de áreas até 8 x 9, feita para o lote inteiro com duas multiplicações
+        small = get_box_matrix(height, HASH_SIZE) @ thumbnails @ get_box_matrix(width, HASH_SIZE + 1).T
+        return pack_bits(small[:, :, 1:] > small[:, :, :-1])
+
+    @staticmethod
+    def phash(thumbnails : np.ndarray):
+        '''
+        pHash de um lote (N, 32, 32): coeficientes 8 x 8 de menor frequência da DCT comparados com a mediana.
+        '''
+        dct = PerceptualHasher.DCT_MATRIX @ thumbnails @ PerceptualHasher.DCT_MATRIX.T
+        low = dct[:, :HASH_SIZE, :HASH_SIZE].reshape(len(thumbnails), -1)
+        median = np.median(low[:, 1:], axis=1, keepdims=True)
+        return pack_bits(low > median)
+
+    @staticmethod
+    @instrumented('dedup.PerceptualHasher.hash_images', items=lambda hashes: len(hashes['paths']))
+    def hash_images(image_paths : Iterable[str | Path], workers : int = 8, batch_size : int = 1024):
+        '''
+        Calcula dHash e pHash de todas as imagens. As miniaturas são decodificadas por um pool de
+        threads e os hashes, calculados em lotes. Retorna {'paths', 'dhash', 'phash'}.
+        '''
+        image_paths = [Path(path).as_posix() for path in image_paths]
+        dhashes = np.zeros(len(image_paths), dtype=np.uint64)
+        phashes = np.zeros(len(image_paths), dtype=np.uint64)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in tqdm(range(0, len(image_paths), batch_size), desc='Calculando hashes perceptuais'):
+                batch_paths = image_paths[start:start + batch_size]
+                thumbnails = np.stack(list(executor.map(PerceptualHasher.load_thumbnail, batch_paths)))
+                dhashes[start:start + len(batch_paths)] = PerceptualHasher.dhash(thumbnails)
+                phashes[start:start + len(batch_paths)] = PerceptualHasher.phash(thumbnails)
+
+        return {'paths': np.array(image_paths), 'dhash': dhashes, 'phash': phashes}
+
+    @staticmethod
+    def save(hashes : dict, path : str | Path):
+        np.savez(path, **hashes)
+
+    @staticmethod
+    def load(path : str | Path):
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+
+class NearDuplicateFinder:
+
+    @staticmethod
+    def get_bands(threshold : int):
+        '''
+        Divide os 64 bits em threshold + 1 bandas (deslocamento, largura).
+        '''
+        n_bands = min(threshold + 1, 64)
+        edges = np.linspace(0, 64, n_bands + 1).astype(int)
+        return [(int(start), int(end - start)) for start, end in zip(edges[:-1], edges[1:])]
+
+    @staticmethod
+    def band_pairs(hashes : np.ndarray, threshold : int):
+        '''
+        Pares (i, j), i < j, que coincidem em pelo menos uma banda e estão a no máximo threshold
+        bits de distância. Os candidatos são verificados assim que gerados, de modo que apenas os
+        pares próximos são mantidos em memória.
+        '''
+        pairs = []
+        for shift, width in NearDuplicateFinder.get_bands(threshold):
+            band = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            order = np.argsort(band, kind='stable')
+            sorted_band = band[order]
+
+            # compara cada elemento com os seguintes do mesmo balde, um deslocamento por vez
+            offset = 1
+            while offset < len(order):
+                same = sorted_band[offset:] == sorted_band[:-offset]
+                if not same.any():
+                    break
+                positions = np.flatnonzero(same)
+                first, second = order[positions], order[positions + offset]
+                near = hamming_distance(hashes[first], hashes[second]) <= threshold
+                pairs.append(np.stack([first[near], second[near]], axis=1))
+                offset += 1
+
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+        pairs = np.sort(np.concatenate(pairs), axis=1)
+        return np.unique(pairs, axis=0)
+
+    @staticmethod
+    @instrumented('dedup.NearDuplicateFinder.find_pairs', items=len)
+    def find_pairs(hashes : np.ndarray, threshold : int = 6):
+        '''
+        Pares de índices (i, j) com distância de Hamming <= threshold. Hashes idênticos são reunidos
+        antes da busca, de modo que baldes grandes de páginas iguais (ex.: em branco) não geram
+        uma quantidade quadrática de candidatos.
+        '''
+        unique_hashes, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+
+        near = NearDuplicateFinder.band_pairs(unique_hashes, threshold)
+
+        # liga cada imagem à primeira imagem com o mesmo hash e, entre hashes próximos, as primeiras imagens
+        positions = np.arange(len(hashes))
+        exact = np.stack([first[inverse], positions], axis=1)[first[inverse] != positions]
+        return np.concatenate([exact, first[near]])
+
+    @staticmethod
+    def connected_groups(n_items : int, pairs : np.ndarray):
+        '''
+        Identificador do grupo (componente conexa) de cada item.
+        '''
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n_items, n_items))
+        return connected_components(graph, directed=False)[1]
+
+    @staticmethod
+    def find_groups(hashes : np.ndarray, threshold : int = 6, keys : Iterable[str] = None):
+        '''
+        Grupos de quase duplicatas. keys (ex.: get_page_key dos caminhos) une também os itens com a mesma chave.
+        '''
+        pairs = [NearDuplicateFinder.find_pairs(hashes, threshold)]
+        if keys is not None:
+            codes = np.unique(np.asarray(list(keys)), return_inverse=True)[1]
+            order = np.argsort(codes, kind='stable')
+            same_key = np.flatnonzero(codes[order][1:] == codes[order][:-1])
+            pairs.append(np.stack([order[same_key], order[same_key + 1]], axis=1))
+
+        return NearDuplicateFinder.connected_groups(len(hashes), np.concatenate(pairs))
+
+
+def get_representatives(groups : np.ndarray):
+    '''
+    Índice do primeiro item de cada grupo, para amostrar um único representante das duplicatas.
+    '''
+    return np.sort(np.unique(groups, return_index=True)[1])
+
+
+def get_sample_weights(groups : np.ndarray):
+    '''
+    Peso 1 / tamanho do grupo de cada item, para amostragem ponderada em que cada grupo conta uma vez.
+    '''
+    return 1.0 / np.bincount(groups)[groups]
+
+
+def assign_duplicate_groups(image_paths : List[str | Path], threshold : int = 6,
+                            method : Literal['dhash', 'phash'] = 'phash', workers : int = 8, hashes : dict = None):
+    '''
+    Grupo de duplicatas de cada imagem, unindo as quase duplicatas e as variantes de uma mesma página.
+    hashes (resultado de PerceptualHasher.hash_images, na mesma ordem) evita recalcular os hashes.
+    '''
+    if hashes is None:
+        hashes = PerceptualHasher.hash_images(image_paths, workers=workers)
+    return NearDuplicateFinder.find_groups(hashes[method], threshold, keys=[get_page_key(path) for path in image_paths])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detecção de quase duplicatas por hashes perceptuais.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    hash_parser = subparsers.add_parser('hash')
+    hash_parser.add_argument('images_dirs', nargs='+')
+    hash_parser.add_argument('--output', default='hashes.npz')
+    hash_parser.add_argument('--workers', type=int, default=8)
+
+    find_parser = subparsers.add_parser('find')
+    find_parser.add_argument('hashes_path')
+    find_parser.add_argument('--threshold', type=int, default=6, help='distância de Hamming máxima (bits)')
+    find_parser.add_argument('--method', choices=['dhash', 'phash'], default='phash')
+    find_parser.add_argument('--output', default=None, help='CSV com o grupo de cada imagem')
+
+    args = parser.parse_args()
+
+    if args.command == 'hash':
+        image_paths = sorted(path for images_dir in args.images_dirs for path in Path(images_dir).rglob('*')
+                             if path.suffix[1:].lower() in IMAGE_EXTENSIONS)
+        hashes = PerceptualHasher.hash_images(image_paths, workers=args.workers)
+        PerceptualHasher.save(hashes, args.output)
+        print(f'Hashes de {len(image_paths)} imagens salvos em: {args.output}')
+    else:
+        hashes = PerceptualHasher.load(args.hashes_path)
+        groups = NearDuplicateFinder.find_groups(hashes[args.method], args.threshold,
+                                                 keys=[get_page_key(path) for path in hashes['paths']])
+        sizes = np.bincount(groups)
+        duplicated = sizes[groups] > 1
+
+        print(f'Imagens: {len(groups)} | grupos: {len(sizes)} | imagens em grupos de duplicatas: {duplicated.sum()} '
+              f'({(sizes > 1).sum()} grupos)')
+
+        if args.output is not None:
+            with open(args.output, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['image_path', 'duplicate_group', 'group_size'])
+                # todas as imagens, pois a coluna de grupos do DataFrameKFoldSplitter precisa de um valor por linha
+                for index in range(len(groups)):
+                    writer.writerow([hashes['paths'][index], groups[index], sizes[groups[index]]])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,170 @@
+import re
+import json
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import KFold
+from pathlib import Path
+from collections.abc import Mapping
+from typing import Dict, Iterable, Literal
 from tqdm import tqdm
 
+from Instrumentation.spans import instrumented
+
+
+# sufixos das cópias aumentadas (pagina_var_2.jpg), das variantes geométricas (pagina_geo_1.jpg)
+# e dos recortes de tabelas do FinTabNet (pagina_table_0.jpg)
+DERIVED_SUFFIX_PATTERN = re.compile(r'(_var_\d+|_geo_\d+|_table_\d+)+$')
+
+# faixas de quantidade de células por página usadas na estratificação
+DEFAULT_CELL_BUCKETS = (10, 25, 50, 100, 200)
+
+
+def get_page_key(image_path : str | Path):
+    '''
+    Identificador da página de origem: as variantes _var_N e _geo_N e os recortes _table_N de uma mesma
+    página compartilham a chave e, portanto, o fold.
+    '''
+    return DERIVED_SUFFIX_PATTERN.sub('', Path(image_path).stem)
+
+
+def get_page_family(image_path : str | Path):
+    '''
+    Família da página no ICDAR 2019 cTDaR: cTDaR_t1xxxx são documentos históricos (archival),
+    cTDaR_t0xxxx, documentos modernos (modern).
+    '''
+    stem = Path(image_path).stem
+    if stem.startswith('cTDaR_t1'):
+        return 'archival'
+    if stem.startswith('cTDaR_t0'):
+        return 'modern'
+    return 'other'
+
+
+def count_cells(xy : list | str):
+    # a coluna xy é uma lista de polígonos ou, quando lida de um CSV, a sua serialização em JSON
+    if isinstance(xy, str):
+        xy = json.loads(xy)
+    return len(xy) if isinstance(xy, (list, tuple)) else 0
+
+
+class LazyFold(Mapping):
+    '''
+    Fold representado apenas pelos índices (posicionais) de treino e de validação. fold['train']
+    materializa o DataFrame somente no acesso, sem mantê-lo em memória.
+    '''
+
+    def __init__(self, data : pd.DataFrame, indices : Dict[str, np.ndarray]):
+        self.data = data
+        self.indices = indices
+
+    def __getitem__(self, split : str):
+        return self.data.iloc[self.indices[split]]
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return sum(indices.nbytes for indices in self.indices.values())
+
+
 class DataFrameKFoldSplitter:
-    def __init__(self, 
-                 data : pd.DataFrame, 
+    def __init__(self,
+                 data : pd.DataFrame,
                  n_splits : int = 5,
-                 shuffle : bool = True, 
-                 random_state : int = 42):
+                 shuffle : bool = True,
+                 random_state : int = 42,
+                 mode : Literal['kfold', 'group', 'stratified_group'] = 'kfold',
+                 group_column : str = None,
+                 cells_column : str = 'xy',
+                 cell_buckets : Iterable[int] = DEFAULT_CELL_BUCKETS):
 
-        # paris é o DataFrame com as colunas image_path e label_path 
+        # paris é o DataFrame com as colunas image_path e label_path
         # a partir do qual a divisão em KFolds é realizada
-        self.data = data  
+        self.data = data
         self.n_splits = n_splits
-        self.shuffle = shuffle 
-        self.random_state = random_state 
-        
+        self.shuffle = shuffle
+        self.random_state = random_state
+
+        # kfold: divisão simples por linhas
+        # group: as linhas de uma mesma página (variantes _var_N, recortes _table_N) ficam no mesmo fold
+        # stratified_group: como group, equilibrando entre os folds a família da página (archival/modern)
+        # e a faixa de quantidade de células por página
+        if mode not in ('kfold', 'group', 'stratified_group'):
+            raise ValueError(f'Modo de divisão inválido: {mode}')
+        self.mode = mode
+        self.group_column = group_column
+        self.cells_column = cells_column
+        self.cell_buckets = list(cell_buckets)
 
+    def get_groups(self):
+        '''
+        Código inteiro do grupo de cada linha: a coluna group_column, se informada, ou a página de origem.
+        '''
+        if self.group_column is not None:
+            keys = self.data[self.group_column]
+        else:
+            keys = self.data['image_path'].map(get_page_key)
+        return pd.factorize(keys)[0]
+
+    def get_strata(self):
+        '''
+        Código inteiro do estrato de cada linha: família da página combinada com a faixa de células.
+        '''
+        if self.cells_column in self.data.columns:
+            cells = self.data[self.cells_column].map(count_cells).to_numpy()
+        else:
+            cells = np.zeros(len(self.data), dtype=np.int64)
+
+        buckets = np.digitize(cells, self.cell_buckets)
+        families = self.data['image_path'].map(get_page_family).to_numpy()
+        return pd.factorize(pd.Series(families).str.cat(buckets.astype(str), sep='_'))[0]
+
+    def get_splitter(self):
+        # o sklearn (~1 s de importação) só é carregado ao dividir
+        from sklearn.model_selection import KFold, GroupKFold, StratifiedGroupKFold
+
+        random_state = self.random_state if self.shuffle else None
+        if self.mode == 'group':
+            return GroupKFold(self.n_splits, shuffle=self.shuffle, random_state=random_state)
+        if self.mode == 'stratified_group':
+            return StratifiedGroupKFold(self.n_splits, shuffle=self.shuffle, random_state=random_state)
+        return KFold(self.n_splits, shuffle=self.shuffle, random_state=random_state)
+
+    @instrumented('kfold.split_indices', items=len)
+    def split_indices(self):
+        '''
+        Índices posicionais de treino e de validação de cada fold, em int32 quando possível.
+        '''
+        n_rows = len(self.data)
+        index_dtype = np.int32 if n_rows < 2**31 else np.int64
+
+        # os divisores do sklearn só usam a quantidade de linhas de X
+        placeholder = np.zeros((n_rows, 1), dtype=np.uint8)
+        groups = self.get_groups() if self.mode != 'kfold' else None
+        strata = self.get_strata() if self.mode == 'stratified_group' else None
+
+        folds = []
+        for train_index, val_index in self.get_splitter().split(placeholder, strata, groups):
+            folds.append({'train': train_index.astype(index_dtype), 'val': val_index.astype(index_dtype)})
+
+        return folds
+
+    @instrumented('kfold.split_folds', items=len)
     def split_folds(self):
         '''
-        Realiza a divisão do Dataset em KFolds. 
+        Realiza a divisão do Dataset em KFolds.
         '''
-        
-        # Define os folds do dataset. Nesse caso, é possível embaralhar os dados antes da divisão. 
-        # Mesmo com o embaralhamento, não haverá repetições de dados entre as partições de validação. 
-        kf = KFold(self.n_splits, shuffle=self.shuffle, random_state=self.random_state)
-        kf.get_n_splits(self.data)
 
+        # Define os folds do dataset. Nesse caso, é possível embaralhar os dados antes da divisão.
+        # Mesmo com o embaralhamento, não haverá repetições de dados entre as partições de validação.
+        # Cada fold guarda apenas os índices; os DataFrames são materializados no acesso (fold['train']).
         folds = []
-        
+
         # Para cada fold do dataset
-        for train_index, val_index in tqdm(kf.split(self.data), total=self.n_splits, desc='Gerando folds...'):
-            
-            train_fold = self.data.iloc[train_index]
-            val_fold = self.data.iloc[val_index]
+        for indices in tqdm(self.split_indices(), total=self.n_splits, desc='Gerando folds...'):
+            folds.append(LazyFold(self.data, indices))
 
-            folds.append({'train': train_fold, 'val': val_fold})
-          
         return folds
-          
-          
\ No newline at end of file
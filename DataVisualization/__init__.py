@@ -0,0 +1,13 @@
+'''
+Visualização das anotações e das predições.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports);
+o matplotlib só é carregado ao desenhar uma figura.
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'object_detection_visualization': ['draw_bouding_box'],
+    'table_visualizer': ['Cell', 'Table', 'TableAnnotationParser', 'TableVisualizer'],
+})
@@ -1,6 +1,8 @@
 import cv2
 from typing import Literal
 
+from Instrumentation.spans import instrumented
+
 icdar_color_class_map = {
     'cell': (255, 0, 0)
 }
@@ -14,6 +16,7 @@ fintab_color_class_map = {
     'table spanning cell': (127, 127, 127)
 }
 
+@instrumented('object_detection_visualization.draw_bouding_box')
 def draw_bouding_box(image, 
                      xmin, ymin, xmax, ymax, 
                      bbox_color = (255,0,0), 
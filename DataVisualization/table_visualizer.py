@@ -8,15 +8,17 @@ Referência: https://cndplab-founder.github.io/cTDaR2019/dataset-description.htm
 """
 
 import xml.etree.ElementTree as ET
-from typing import List, Tuple, Dict, Optional, Union
+from typing import List, Tuple, Dict, Optional, Union, TYPE_CHECKING
 from dataclasses import dataclass
 from pathlib import Path
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.collections import PatchCollection
 from PIL import Image, ImageDraw
-import cv2
+
+from Instrumentation.spans import instrumented
+
+# matplotlib e cv2 são importados apenas ao desenhar, para que TableAnnotationParser fique leve
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 
 @dataclass
@@ -80,6 +82,7 @@ class TableAnnotationParser:
         return coords
     
     @staticmethod
+    @instrumented('table_visualizer.TableAnnotationParser.parse_xml')
     def parse_xml(xml_path: Union[str, Path]) -> Tuple[str, List[Table]]:
         """
         Parse um arquivo XML de anotação de tabela.
@@ -165,6 +168,7 @@ class TableVisualizer:
         """
         self.figsize = figsize
     
+    @instrumented('table_visualizer.TableVisualizer.visualize_tables')
     def visualize_tables(
         self,
         tables: List[Table],
@@ -179,7 +183,7 @@ class TableVisualizer:
         save_path: Optional[Union[str, Path]] = None,
         title: Optional[str] = None,
         generate_mask: bool = False
-    ) -> plt.Figure:
+    ) -> 'plt.Figure':
         """
         Visualiza tabelas e células sobre uma imagem.
         
@@ -222,7 +226,12 @@ class TableVisualizer:
         else:
             img_array = image
         
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+
         if generate_mask:
+            import cv2
+
             # Criar máscara branca com as mesmas dimensões
             height, width = img_array.shape[:2]
             mask = np.ones((height, width), dtype=np.uint8) * 255
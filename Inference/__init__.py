@@ -0,0 +1,15 @@
+'''
+Inferência por tiles, exportação das predições em XML cTDaR, cache de predições, servidor HTTP e
+benchmark dos formatos exportados.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'ctdar_export': ['CTDaRExporter', 'PagePrediction', 'prediction_to_document'],
+    'prediction_cache': ['PredictionCache', 'CachedModel'],
+    'server': ['InferenceServer', 'InferenceClient'],
+    'tiled': ['Detections', 'TiledInference', 'UltralyticsTileModel', 'merge_detections'],
+})
@@ -0,0 +1,380 @@
+'''
+Conversão das predições (máscaras de instância ou caixas) em XMLs do ICDAR 2019 cTDaR, lidos por
+DataVisualization.table_visualizer.TableAnnotationParser e aceitos pela avaliação da competição.
+
+Os contornos não são extraídos máscara a máscara: as máscaras de uma página são combinadas em uma
+única imagem de rótulos (cada pixel recebe o índice da instância de maior confiança que o cobre),
+os pixels na fronteira entre duas instâncias são zerados para que células vizinhas não se fundam e
+um único cv2.findContours percorre a página inteira; o rótulo de cada contorno é lido no seu
+primeiro ponto. Tabelas e células ficam em imagens de rótulos separadas, pois se sobrepõem.
+Os contornos de todas as instâncias são então simplificados de uma vez (PolygonSimplifier) e cada
+célula é atribuída à tabela cuja caixa contém a maior fração da caixa da célula. As células sem
+tabela (por exemplo, de modelos treinados só com a classe cell) são atribuídas pelo CTDaRWriter à
+tabela mais próxima ou, se a página não tem tabelas, agrupadas em uma tabela envolvente. As páginas
+são convertidas por um pool de threads (o cv2 e o numpy liberam o GIL) e os XMLs, gravados pelo
+pool do CTDaRWriter, com coordenadas inteiras.
+
+Uso:
+    python -m Inference.ctdar_export predictions.json submission/ --classes cell --tolerance 1.5
+    python -m Inference.ctdar_export --weights runs/segment/train/weights/best.pt --images dataset/test/*.jpg submission/
+'''
+
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Literal, Tuple
+from tqdm import tqdm
+
+from Instrumentation.spans import instrumented
+
+
+@dataclass
+class PagePrediction:
+    '''
+    Predições de uma página. class_ids: (n,); scores: (n,) ou None; e uma das formas abaixo:
+        masks: (n, altura, largura) booleanas ou probabilidades (como result.masks.data da
+               Ultralytics), na resolução da imagem ou na da entrada do modelo (letterbox);
+        polygons: lista com um array (k, 2) por instância, em pixels da imagem (Detections.polygons);
+        boxes: (n, 4) xmin, ymin, xmax, ymax em pixels da imagem.
+    image_size é (largura, altura) da imagem original, necessário quando as máscaras têm outra resolução.
+    '''
+    name : str
+    class_ids : np.ndarray
+    scores : np.ndarray = None
+    masks : np.ndarray = None
+    polygons : List[np.ndarray] = None
+    boxes : np.ndarray = None
+    image_size : Tuple[int, int] = None
+
+    @staticmethod
+    def from_detections(name : str, detections : dict, image_size : Tuple[int, int] = None):
+        '''
+        Página a partir de um Detections (Inference.tiled) ou do seu to_dict().
+        '''
+        if not isinstance(detections, dict):
+            detections = {'boxes': detections.boxes, 'scores': detections.scores,
+                          'class_ids': detections.class_ids, 'polygons': detections.polygons}
+
+        polygons = detections.get('polygons')
+        return PagePrediction(name, np.asarray(detections['class_ids'], dtype=np.int64).reshape(-1),
+                              np.asarray(detections['scores'], dtype=np.float64).reshape(-1),
+                              polygons=[np.asarray(polygon, dtype=np.float64).reshape(-1, 2) for polygon in polygons]
+                              if polygons is not None else None,
+                              boxes=np.asarray(detections['boxes'], dtype=np.float64).reshape(-1, 4),
+                              image_size=image_size)
+
+    @staticmethod
+    def from_ultralytics(result):
+        '''
+        Página a partir de um Results da Ultralytics, usando as máscaras em vez de result.masks.xy
+        (que executa um findContours por máscara).
+        '''
+        height, width = result.orig_shape
+        masks = result.masks.data.cpu().numpy() if result.masks is not None else None
+        return PagePrediction(Path(result.path).name,
+                              result.boxes.cls.cpu().numpy().astype(np.int64),
+                              result.boxes.conf.cpu().numpy().astype(np.float64),
+                              masks=masks,
+                              boxes=result.boxes.xyxy.cpu().numpy().astype(np.float64),
+                              image_size=(width, height))
+
+
+def gather_indices(starts : np.ndarray, counts : np.ndarray, selected : np.ndarray):
+    '''
+    Índices dos pontos dos polígonos empacotados selected, na ordem de selected.
+    '''
+    selected_counts = counts[selected]
+    new_starts = np.cumsum(selected_counts) - selected_counts
+    return np.repeat(starts[selected] - new_starts, selected_counts) + np.arange(selected_counts.sum())
+
+
+class MaskContours:
+
+    @staticmethod
+    def build_label_image(masks : np.ndarray, scores : np.ndarray = None, threshold : float = 0.5):
+        '''
+        Imagem (altura, largura) int32 em que cada pixel é 1 + o índice da instância de maior
+        confiança que o cobre, ou 0. As linhas e colunas ocupadas por cada máscara são obtidas em
+        duas reduções vetorizadas e cada instância é pintada apenas na sua janela, da menor para a
+        maior confiança.
+        '''
+        binary = masks if masks.dtype == bool else masks > threshold
+        rows, columns = binary.any(axis=2), binary.any(axis=1)
+        labels = np.zeros(binary.shape[1:], dtype=np.int32)
+
+        order = np.argsort(scores, kind='stable') if scores is not None else np.arange(len(binary))[::-1]
+        for index in order:
+            ys, xs = np.flatnonzero(rows[index]), np.flatnonzero(columns[index])
+            if not len(ys):
+                continue
+            window = np.s_[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+            labels[window][binary[index][window]] = index + 1
+
+        return labels
+
+    @staticmethod
+    def separate_instances(labels : np.ndarray):
+        '''
+        Zera os pixels que tocam (à direita, abaixo ou nas diagonais inferiores) um pixel de outra
+        instância, deixando uma fronteira entre instâncias vizinhas (o findContours usa vizinhança-8).
+        '''
+        separated = labels.copy()
+        # as diagonais são verificadas depois das arestas, apenas onde as instâncias ainda se tocam pelo canto
+        for pairs in (((np.s_[:, :-1], np.s_[:, 1:]), (np.s_[:-1], np.s_[1:])),
+                      ((np.s_[:-1, :-1], np.s_[1:, 1:]), (np.s_[:-1, 1:], np.s_[1:, :-1]))):
+            reference = separated.copy()
+            for current, neighbour in pairs:
+                touching = (reference[current] != reference[neighbour]) & (reference[current] > 0) & (reference[neighbour] > 0)
+                separated[current][touching] = 0
+        return separated
+
+    @staticmethod
+    @instrumented('ctdar_export.MaskContours.extract_polygons')
+    def extract_polygons(labels : np.ndarray, n_instances : int):
+        '''
+        Contorno externo de cada instância da imagem de rótulos com um único cv2.findContours.
+        Instâncias partidas em várias regiões ficam com a maior. Retorna (pontos, contagens) empacotados,
+        com contagem 0 para as instâncias sem contorno.
+        '''
+        import cv2
+        from DataExtractor.polygon_simplification import PolygonSimplifier
+
+        counts = np.zeros(n_instances, dtype=np.int64)
+        contours, _ = cv2.findContours((labels > 0).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [contour for contour in contours if len(contour) >= 3]
+        if not contours:
+            return np.zeros((0, 2)), counts
+
+        contour_counts = np.array([len(contour) for contour in contours], dtype=np.int64)
+        contour_points = np.concatenate(contours).reshape(-1, 2)
+        starts = np.cumsum(contour_counts) - contour_counts
+
+        # os pontos do contorno externo pertencem à região; o primeiro identifica a instância
+        instance_ids = labels[contour_points[starts, 1], contour_points[starts, 0]] - 1
+        areas = PolygonSimplifier.polygon_areas(contour_points.astype(np.float64), contour_counts)
+
+        # maior contorno de cada instância: o último de cada instância na ordem (instância, área)
+        order = np.lexsort((areas, instance_ids))
+        selected = order[np.append(instance_ids[order][1:] != instance_ids[order][:-1], True)]
+
+        counts[instance_ids[selected]] = contour_counts[selected]
+        point_indices = gather_indices(starts, contour_counts, selected)
+        return contour_points[point_indices].astype(np.float64), counts
+
+    @staticmethod
+    def get_mask_transform(mask_shape : Tuple[int, int], image_size : Tuple[int, int] = None):
+        '''
+        (ganho, deslocamento) que levam pixels da máscara a pixels da imagem: image = (mask - pad) / gain.
+        Máscaras de outra proporção são tratadas como o letterbox centralizado da Ultralytics.
+        '''
+        mask_height, mask_width = mask_shape
+        if image_size is None or tuple(image_size) == (mask_width, mask_height):
+            return 1.0, np.zeros(2)
+        width, height = image_size
+        gain = min(mask_width / width, mask_height / height)
+        return gain, np.array([(mask_width - width * gain) / 2, (mask_height - height * gain) / 2])
+
+
+@instrumented('ctdar_export.prediction_to_document')
+def prediction_to_document(page : PagePrediction,
+                           class_names : Iterable[str] = ('cell',),
+                           tolerance : float = 1.0,
+                           snap : Literal['rectangle', 'quad'] = None,
+                           min_overlap : float = 0.5,
+                           min_area : float = 4.0,
+                           threshold : float = 0.5):
+    '''
+    AnnotationDocument da página: tabelas (classe 'table') e células, com polígonos simplificados
+    em pixels da imagem, células ordenadas por linha e coluna e atribuídas às tabelas.
+    '''
+    from DataExtractor.conversion_hub import AnnotationDocument, assign_tables
+    from DataExtractor.polygon_simplification import PolygonSimplifier
+
+    class_names = np.asarray(list(class_names), dtype=str)
+    names = class_names[page.class_ids]
+    n_instances = len(names)
+
+    if page.masks is not None:
+        is_table = names == 'table'
+        gain, pad = MaskContours.get_mask_transform(page.masks.shape[1:], page.image_size)
+        points, ids, counts = [np.zeros((0, 2))], [np.zeros(0, dtype=np.int64)], np.zeros(n_instances, dtype=np.int64)
+
+        # tabelas e células se sobrepõem: uma imagem de rótulos (e um findContours) para cada grupo
+        for group in (np.flatnonzero(is_table), np.flatnonzero(~is_table)):
+            if not len(group):
+                continue
+            scores = page.scores[group] if page.scores is not None else None
+            labels = MaskContours.separate_instances(MaskContours.build_label_image(page.masks[group], scores, threshold))
+            group_points, counts[group] = MaskContours.extract_polygons(labels, len(group))
+            points.append((group_points - pad) / gain)
+            ids.append(np.repeat(group, counts[group]))
+
+        # pontos na ordem das instâncias
+        points = np.concatenate(points)[np.argsort(np.concatenate(ids), kind='stable')]
+    elif page.polygons is not None:
+        counts = np.array([len(polygon) for polygon in page.polygons], dtype=np.int64)
+        points = np.concatenate(page.polygons) if len(page.polygons) else np.zeros((0, 2))
+    else:
+        # caixas: dois cantos por objeto, convertidos em quatro pelo CTDaRWriter
+        counts = np.full(n_instances, 2, dtype=np.int64)
+        points = page.boxes.reshape(-1, 2)
+
+    # caixas (dois pontos) passam inalteradas; os polígonos de todas as instâncias são simplificados juntos
+    is_polygon = counts >= 3
+    if is_polygon.any():
+        point_is_polygon = np.repeat(is_polygon, counts)
+        simplified, simplified_counts, _ = PolygonSimplifier.simplify(points[point_is_polygon], counts[is_polygon],
+                                                                      tolerance, snap)
+        ids = np.concatenate([np.repeat(np.flatnonzero(is_polygon), simplified_counts),
+                              np.repeat(np.flatnonzero(~is_polygon), counts[~is_polygon])])
+        points = np.concatenate([simplified, points[~point_is_polygon]])[np.argsort(ids, kind='stable')]
+        counts[is_polygon] = simplified_counts
+
+    if page.image_size is not None:
+        points = np.clip(points, 0, page.image_size)
+
+    document = AnnotationDocument(page.name, names, counts, points, np.full(n_instances, -1, dtype=np.int64),
+                                  *(page.image_size or (None, None)))
+    bounds = document.get_bounds()
+    keep = (counts > 0) & ((bounds[:, 2:] - bounds[:, :2]).prod(axis=1) >= min_area)
+    document = document.select(keep)
+    bounds = bounds[keep]
+
+    # objetos em ordem de leitura (topo, depois esquerda), como nas anotações do cTDaR
+    order = np.lexsort((bounds[:, 0], bounds[:, 1]))
+    point_indices = gather_indices(np.cumsum(document.counts) - document.counts, document.counts, order)
+    document = AnnotationDocument(document.name, document.names[order], document.counts[order],
+                                  document.points[point_indices], document.parents[order],
+                                  document.width, document.height)
+    bounds = bounds[order]
+
+    is_table = document.names == 'table'
+    if is_table.any():
+        table_indices = np.flatnonzero(is_table)
+        cell_tables = assign_tables(bounds[~is_table], bounds[is_table], min_overlap)
+        document.parents[~is_table] = np.where(cell_tables >= 0, table_indices[np.maximum(cell_tables, 0)], -1)
+
+    return document
+
+
+class CTDaRExporter:
+    '''
+    Converte páginas de predições em XMLs cTDaR: a conversão e a formatação de cada página rodam em
+    um pool de workers threads, com no máximo 2 * workers páginas pendentes, e a gravação, no pool
+    do CTDaRWriter.
+    '''
+
+    def __init__(self,
+                 output_dir : str | Path,
+                 class_names : Iterable[str] = ('cell',),
+                 tolerance : float = 1.0,
+                 snap : Literal['rectangle', 'quad'] = None,
+                 min_overlap : float = 0.5,
+                 min_area : float = 4.0,
+                 workers : int = 8):
+
+        from DataExtractor.conversion_hub import CTDaRWriter
+
+        self.class_names = list(class_names)
+        self.parameters = {'class_names': self.class_names, 'tolerance': tolerance, 'snap': snap,
+                           'min_overlap': min_overlap, 'min_area': min_area}
+        cell_names = [name for name in self.class_names if name != 'table']
+        self.writer = CTDaRWriter(output_dir, cell_names, workers, min_overlap)
+        self.workers = workers
+        self.statistics = {'pages': 0, 'tables': 0, 'cells': 0}
+
+    def convert(self, page : PagePrediction):
+        document = prediction_to_document(page, **self.parameters)
+        return document, self.writer.create_content(document)
+
+    def collect(self, document, content : str):
+        self.writer.submit(f'{Path(document.name).stem}.xml', content)
+        is_table = document.names == 'table'
+        self.statistics['pages'] += 1
+        self.statistics['tables'] += int(is_table.sum())
+        self.statistics['cells'] += int((~is_table).sum())
+
+    @instrumented('ctdar_export.CTDaRExporter.export')
+    def export(self, pages : Iterable[PagePrediction], total : int = None):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for page in tqdm(pages, total=total, desc='Gerando XMLs cTDaR'):
+                pending.append(executor.submit(self.convert, page))
+                if len(pending) >= 2 * self.workers:
+                    self.collect(*pending.popleft().result())
+            while pending:
+                self.collect(*pending.popleft().result())
+
+        self.writer.close()
+        return self.statistics
+
+
+def iterate_prediction_file(json_path : str | Path, images_dir : str | Path = None):
+    '''
+    Páginas do JSON gravado por Inference.tiled (--output). Com images_dir, as dimensões das
+    imagens são lidas do cabeçalho para limitar as coordenadas.
+    '''
+    from DataExtractor.conversion_hub import ImageSizeCache
+
+    with open(json_path, 'r') as file:
+        predictions = json.load(file)['predictions']
+
+    size_cache = ImageSizeCache()
+    for image_path, detections in predictions.items():
+        image_size = None
+        if images_dir is not None and (Path(images_dir)/Path(image_path).name).exists():
+            image_size = size_cache.get(Path(images_dir)/Path(image_path).name)
+        yield PagePrediction.from_detections(Path(image_path).name, detections, image_size)
+
+
+def iterate_model_predictions(weights : str | Path, image_paths : List[str], imgsz : int = 640, conf : float = 0.25,
+                              device : str = None, batch : int = 8):
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    parameters = {'imgsz': imgsz, 'conf': conf, 'max_det': 1000, 'batch': batch, 'verbose': False, 'stream': True}
+    if device is not None:
+        parameters['device'] = device
+
+    for result in model.predict(image_paths, **parameters):
+        yield PagePrediction.from_ultralytics(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converte predições (máscaras ou caixas) em XMLs do ICDAR 2019 cTDaR.')
+    parser.add_argument('predictions', nargs='?', default=None, help='JSON gravado por Inference.tiled --output')
+    parser.add_argument('output_dir')
+    parser.add_argument('--weights', default=None, help='executa o modelo YOLO sobre --images em vez de ler o JSON')
+    parser.add_argument('--images', nargs='*', default=[])
+    parser.add_argument('--images-dir', default=None, help='imagens das predições do JSON (dimensões)')
+    parser.add_argument('--classes', nargs='+', default=['cell'], help='nome de cada classe do modelo (table para tabelas)')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='tolerância da simplificação, em pixels')
+    parser.add_argument('--snap', choices=['rectangle', 'quad'], default=None)
+    parser.add_argument('--min-overlap', type=float, default=0.5, help='fração da célula contida na tabela')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.weights is not None:
+        pages, total = iterate_model_predictions(args.weights, args.images, args.imgsz, args.conf, args.device), len(args.images)
+    elif args.predictions is not None:
+        pages, total = iterate_prediction_file(args.predictions, args.images_dir), None
+    else:
+        parser.error('informe o JSON de predições ou --weights com --images')
+
+    exporter = CTDaRExporter(args.output_dir, args.classes, args.tolerance, args.snap, args.min_overlap,
+                             workers=args.workers)
+    statistics = exporter.export(pages, total)
+
+    print(f'\n{statistics["pages"]} XMLs gravados em {args.output_dir} '
+          f'({statistics["tables"]} tabelas, {statistics["cells"]} células)')
+
+
+if __name__ == '__main__':
+    main()
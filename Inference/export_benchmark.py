@@ -0,0 +1,405 @@
+'''
+Exportação dos modelos YOLO para execução em CPU e benchmark dos formatos exportados.
+
+Converte os pesos .pt (ex.: yolo_icdar.pt, yolo_fintabnet.pt) para ONNX, TorchScript e OpenVINO
+(quando instalados), opcionalmente quantizados em INT8, e varre tamanho de lote, número de threads
+e tamanho de entrada sobre um conjunto fixo de imagens locais. Para cada configuração são
+reportados os percentis de latência do modelo e as imagens por segundo; para cada exportação, a
+concordância das predições com o modelo .pt (e, com --data, a diferença de mAP).
+
+Quantização: ONNX usa a quantização dinâmica do onnxruntime; OpenVINO usa a calibração INT8 da
+Ultralytics (requer --data); TorchScript não é quantizado.
+
+Uso:
+    python -m Inference.export_benchmark yolo_icdar.pt --images dataset/test --formats onnx openvino \\
+        --quantize --batch 1 4 --threads 1 2 4 --imgsz 640 1024 --output benchmark_icdar.json
+'''
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import List, Tuple
+
+from Instrumentation.spans import span
+from .tiled import compute_overlaps
+
+
+FORMATS = ['pytorch', 'torchscript', 'onnx', 'openvino']
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp', 'bmp', 'tif', 'tiff']
+
+
+@dataclass
+class ExportedModel:
+    format : str
+    path : str
+    imgsz : int
+    quantized : bool = False
+    batch : int = None
+
+
+@dataclass
+class LatencyResult:
+    format : str
+    quantized : bool
+    imgsz : int
+    batch : int
+    threads : int
+    p50_ms : float
+    p90_ms : float
+    p99_ms : float
+    mean_ms : float
+    images_per_second : float
+
+
+# ---------------------------------------------------------------------------------------
+# Imagens e pré-processamento
+# ---------------------------------------------------------------------------------------
+
+def load_images(images_dir : str | Path = None, image_cache : str | Path = None, limit : int = 32):
+    '''
+    Carrega até limit imagens RGB, em ordem, de um diretório ou de um ImageCache (DataExtractor.image_cache).
+    Caches em L (um canal) têm as páginas replicadas nos três canais esperados pelo modelo.
+    '''
+    if image_cache is not None:
+        from DataExtractor.image_cache import ImageCache
+        from DataAugmentation.augmentation import Augmentation
+        cache = ImageCache(image_cache)
+        return [Augmentation.expand_channels(np.asarray(cache[position])) for position in range(min(limit, len(cache)))]
+
+    paths = sorted(path for path in Path(images_dir).iterdir() if path.suffix[1:].lower() in IMAGE_EXTENSIONS)[:limit]
+    images = []
+    for path in paths:
+        with Image.open(path) as image:
+            images.append(np.asarray(image.convert('RGB')))
+    return images
+
+
+def letterbox(image : np.ndarray, imgsz : int):
+    '''
+    Redimensiona mantendo a proporção e preenche com cinza (114) até imgsz x imgsz, como a Ultralytics.
+    '''
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = imgsz / max(height, width)
+    new_width, new_height = round(width * scale), round(height * scale)
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_height) // 2, (imgsz - new_width) // 2
+    padded[top:top + new_height, left:left + new_width] = resized
+    return padded
+
+
+def prepare_batches(images : List[np.ndarray], imgsz : int, batch_size : int):
+    '''
+    Lotes NCHW float32 normalizados em [0, 1]. Imagens são repetidas para completar o último lote.
+    '''
+    letterboxed = np.stack([letterbox(image, imgsz) for image in images])
+    tensor = np.ascontiguousarray(letterboxed.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+    n_batches = max(1, int(np.ceil(len(tensor) / batch_size)))
+    indices = np.arange(n_batches * batch_size) % len(tensor)
+    return [np.ascontiguousarray(tensor[indices[start:start + batch_size]])
+            for start in range(0, len(indices), batch_size)]
+
+
+# ---------------------------------------------------------------------------------------
+# Exportação
+# ---------------------------------------------------------------------------------------
+
+def quantize_onnx(onnx_path : str | Path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output_path = Path(onnx_path).with_suffix('.int8.onnx')
+    quantize_dynamic(str(onnx_path), str(output_path), weight_type=QuantType.QUInt8)
+    return output_path
+
+
+def export_models(weights : str | Path, formats : List[str], imgszs : List[int], batches : List[int],
+                  quantize : bool = False, data : str = None):
+    '''
+    Exporta os pesos para cada formato e tamanho de entrada. ONNX e OpenVINO são exportados com
+    dimensões dinâmicas (um arquivo atende a todos os lotes); TorchScript é exportado por lote.
+    Formatos cujo runtime não está instalado são ignorados com um aviso.
+    '''
+    from ultralytics import YOLO
+
+    exported = []
+    for imgsz in imgszs:
+        exported.append(ExportedModel('pytorch', str(weights), imgsz))
+
+        for export_format in formats:
+            if export_format == 'pytorch':
+                continue
+            try:
+                with span(f'export_benchmark.export.{export_format}'):
+                    if export_format == 'torchscript':
+                        for batch in batches:
+                            path = YOLO(weights).export(format='torchscript', imgsz=imgsz, batch=batch)
+                            exported.append(ExportedModel('torchscript', rename_export(path, f'_{imgsz}_b{batch}'), imgsz, batch=batch))
+                        continue
+
+                    path = YOLO(weights).export(format=export_format, imgsz=imgsz, dynamic=True)
+                    path = rename_export(path, f'_{imgsz}')
+                    exported.append(ExportedModel(export_format, path, imgsz))
+
+                    if quantize and export_format == 'onnx':
+                        exported.append(ExportedModel('onnx', str(quantize_onnx(path)), imgsz, quantized=True))
+                    elif quantize and export_format == 'openvino':
+                        if data is None:
+                            print('Quantização OpenVINO ignorada: informe --data para a calibração INT8.')
+                            continue
+                        int8_path = YOLO(weights).export(format='openvino', imgsz=imgsz, dynamic=True, int8=True, data=data)
+                        exported.append(ExportedModel('openvino', rename_export(int8_path, f'_{imgsz}'), imgsz, quantized=True))
+            except ImportError as error:
+                print(f'Formato {export_format} ignorado: {error}')
+
+    return exported
+
+
+def rename_export(path : str | Path, suffix : str):
+    '''
+    A Ultralytics sempre exporta para o mesmo nome; o sufixo evita que exportações com outros
+    tamanhos de entrada sobrescrevam as anteriores.
+    '''
+    path = Path(path)
+    new_path = path.with_name(f'{path.stem}{suffix}{path.suffix}') if path.is_file() else path.with_name(f'{path.name}{suffix}')
+    if new_path.exists():
+        import shutil
+        shutil.rmtree(new_path) if new_path.is_dir() else new_path.unlink()
+    path.rename(new_path)
+    return str(new_path)
+
+
+# ---------------------------------------------------------------------------------------
+# Execução dos modelos (apenas o forward, com controle do número de threads)
+# ---------------------------------------------------------------------------------------
+
+def create_runner(exported : ExportedModel, threads : int):
+    '''
+    Retorna uma função que executa o forward do modelo sobre um lote NCHW float32.
+    '''
+    if exported.format in ('pytorch', 'torchscript'):
+        import torch
+
+        torch.set_num_threads(threads)
+        if exported.format == 'pytorch':
+            from ultralytics import YOLO
+            model = YOLO(exported.path).model.float().eval()
+        else:
+            model = torch.jit.load(exported.path, map_location='cpu').eval()
+
+        def run(batch):
+            with torch.inference_mode():
+                return model(torch.from_numpy(batch))
+        return run
+
+    if exported.format == 'onnx':
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(exported.path, options, providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+        return lambda batch: session.run(None, {input_name: batch})
+
+    if exported.format == 'openvino':
+        import openvino
+
+        xml_path = next(Path(exported.path).glob('*.xml'))
+        compiled_model = openvino.Core().compile_model(str(xml_path), 'CPU', {'INFERENCE_NUM_THREADS': threads})
+        return lambda batch: compiled_model(batch)
+
+    raise ValueError(f'Formato desconhecido: {exported.format}')
+
+
+def measure_latency(run, batches : List[np.ndarray], warmup : int = 3, iterations : int = 20):
+    for index in range(warmup):
+        run(batches[index % len(batches)])
+
+    latencies = []
+    for index in range(iterations):
+        start = time.perf_counter()
+        run(batches[index % len(batches)])
+        latencies.append(time.perf_counter() - start)
+
+    return np.array(latencies) * 1000
+
+
+def sweep(exported_models : List[ExportedModel], images : List[np.ndarray], batches : List[int],
+          threads : List[int], warmup : int = 3, iterations : int = 20):
+
+    results = []
+    for exported in exported_models:
+        for batch_size in ([exported.batch] if exported.batch is not None else batches):
+            input_batches = prepare_batches(images, exported.imgsz, batch_size)
+            for n_threads in threads:
+                run = create_runner(exported, n_threads)
+                with span(f'export_benchmark.latency.{exported.format}', items=iterations * batch_size):
+                    latencies = measure_latency(run, input_batches, warmup, iterations)
+
+                result = LatencyResult(exported.format, exported.quantized, exported.imgsz, batch_size, n_threads,
+                                       *np.percentile(latencies, [50, 90, 99]).round(2).tolist(),
+                                       round(float(latencies.mean()), 2),
+                                       round(float(batch_size * 1000 / latencies.mean()), 2))
+                results.append(result)
+                print(format_latency_result(result))
+
+    return results
+
+
+def format_latency_result(result : LatencyResult):
+    name = f'{result.format}{" int8" if result.quantized else ""}'
+    return (f'{name:<16} imgsz {result.imgsz:>5} | lote {result.batch:>3} | threads {result.threads:>3} | '
+            f'p50 {result.p50_ms:>8.1f} ms | p90 {result.p90_ms:>8.1f} ms | p99 {result.p99_ms:>8.1f} ms | '
+            f'{result.images_per_second:>7.1f} img/s')
+
+
+# ---------------------------------------------------------------------------------------
+# Precisão em relação ao modelo .pt
+# ---------------------------------------------------------------------------------------
+
+def predict_all(model_path : str, images : List[np.ndarray], imgsz : int, conf : float = 0.25):
+    from ultralytics import YOLO
+    from DataAugmentation.augmentation import Augmentation
+
+    model = YOLO(model_path, task=None)
+    predictions, milliseconds = [], []
+    for image in images:
+        # a Ultralytics espera arrays numpy em BGR (páginas 2D são replicadas antes de inverter os canais)
+        result = model.predict(Augmentation.expand_channels(image)[..., ::-1], imgsz=imgsz, conf=conf, device='cpu', verbose=False)[0]
+        predictions.append((result.boxes.xyxy.cpu().numpy(), result.boxes.cls.cpu().numpy(), result.boxes.conf.cpu().numpy()))
+        milliseconds.append(sum(result.speed.values()))
+
+    return predictions, float(np.mean(milliseconds))
+
+
+def compare_predictions(reference : List[Tuple[np.ndarray]], candidate : List[Tuple[np.ndarray]], iou_threshold : float = 0.5):
+    '''
+    Concordância das caixas do candidato com as do modelo de referência (pareamento guloso por IoU
+    e classe): precisão, revocação, F1 e diferença média de confiança dos pares.
+    '''
+    matched, n_reference, n_candidate, confidence_deltas = 0, 0, 0, []
+
+    for (reference_boxes, reference_classes, reference_scores), (boxes, classes, scores) in zip(reference, candidate):
+        n_reference += len(reference_boxes)
+        n_candidate += len(boxes)
+        available = np.ones(len(reference_boxes), dtype=bool)
+
+        for index in np.argsort(-scores):
+            if not available.any():
+                break
+            overlaps = compute_overlaps(boxes[index], reference_boxes, 'iou')
+            overlaps[~available | (reference_classes != classes[index])] = 0
+            best = int(np.argmax(overlaps))
+            if overlaps[best] >= iou_threshold:
+                available[best] = False
+                matched += 1
+                confidence_deltas.append(abs(float(scores[index]) - float(reference_scores[best])))
+
+    precision = matched / max(n_candidate, 1)
+    recall = matched / max(n_reference, 1)
+    return {
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(2 * precision * recall / max(precision + recall, 1e-9), 4),
+        'mean_confidence_delta': round(float(np.mean(confidence_deltas)) if confidence_deltas else 0.0, 4),
+        'reference_detections': n_reference,
+        'candidate_detections': n_candidate
+    }
+
+
+def validate_map(model_path : str, data : str, imgsz : int):
+    from ultralytics import YOLO
+
+    metrics = YOLO(model_path).val(data=data, imgsz=imgsz, batch=1, device='cpu', verbose=False, plots=False)
+    result = {'box_map50': float(metrics.box.map50), 'box_map': float(metrics.box.map)}
+    if hasattr(metrics, 'seg'):
+        result |= {'mask_map50': float(metrics.seg.map50), 'mask_map': float(metrics.seg.map)}
+    return result
+
+
+def evaluate_accuracy(exported_models : List[ExportedModel], images : List[np.ndarray], data : str = None):
+    '''
+    Compara as predições de cada exportação (uma por formato, quantização e tamanho de entrada) com
+    as do modelo .pt no mesmo tamanho de entrada.
+    '''
+    results = []
+    references = {}
+
+    for exported in exported_models:
+        if exported.format == 'torchscript' and exported.batch != 1:
+            continue
+
+        key = (exported.format, exported.quantized, exported.imgsz)
+        predictions, end_to_end_ms = predict_all(exported.path, images, exported.imgsz)
+        if exported.format == 'pytorch':
+            references[exported.imgsz] = predictions
+
+        result = {'format': exported.format, 'quantized': exported.quantized, 'imgsz': exported.imgsz,
+                  'end_to_end_ms': round(end_to_end_ms, 2)}
+        result |= compare_predictions(references[exported.imgsz], predictions)
+
+        if data is not None:
+            result |= validate_map(exported.path, data, exported.imgsz)
+
+        results.append(result)
+        print(f'{key}: F1 {result["f1"]:.4f} em relação ao .pt | {result["end_to_end_ms"]:.1f} ms por imagem (ponta a ponta)')
+
+    if data is not None:
+        for result in results:
+            reference = next(item for item in results if item['format'] == 'pytorch' and item['imgsz'] == result['imgsz'])
+            for metric in [metric for metric in result if metric.endswith(('map', 'map50'))]:
+                result[f'{metric}_delta'] = round(result[metric] - reference[metric], 4)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta os modelos YOLO para CPU e compara os formatos.')
+    parser.add_argument('weights')
+    parser.add_argument('--images', default=None, help='diretório com o conjunto fixo de imagens')
+    parser.add_argument('--image-cache', default=None, help='ImageCache usado no lugar de --images')
+    parser.add_argument('--limit', type=int, default=32, help='quantidade de imagens usadas')
+    parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx', 'openvino'], choices=FORMATS)
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--data', default=None, help='dataset.yaml para o mAP e a calibração INT8 do OpenVINO')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count()])
+    parser.add_argument('--imgsz', type=int, nargs='+', default=[640])
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.images is None and args.image_cache is None:
+        parser.error('informe --images ou --image-cache')
+
+    images = load_images(args.images, args.image_cache, args.limit)
+    exported_models = export_models(args.weights, args.formats, args.imgsz, args.batch, args.quantize, args.data)
+
+    print('\nLatência do modelo (sem pré e pós-processamento):')
+    latency_results = sweep(exported_models, images, args.batch, args.threads, args.warmup, args.iterations)
+
+    print('\nPrecisão em relação ao modelo .pt:')
+    accuracy_results = evaluate_accuracy(exported_models, images, args.data)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'weights': args.weights,
+                       'n_images': len(images),
+                       'exports': [asdict(exported) for exported in exported_models],
+                       'latency': [asdict(result) for result in latency_results],
+                       'accuracy': accuracy_results}, file, indent=2)
+        print(f'\nResultados salvos em: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+'''
+Cache de predições endereçado pelo conteúdo.
+
+A chave combina o hash do conteúdo da imagem, o hash dos pesos do modelo e os parâmetros da
+inferência, de modo que páginas repetidas (documentos retificados, digitalizações duplicadas) não
+passam novamente pelo modelo, e trocar os pesos ou os parâmetros invalida o cache naturalmente.
+
+Há dois níveis: um LRU em memória limitado em bytes e, opcionalmente, um nível em disco para onde
+as entradas removidas do LRU são despejadas como arrays compactos (.npz sem compressão, com os
+pontos de todos os polígonos concatenados). Acertos no disco são promovidos de volta à memória e
+atualizam o mtime do arquivo, que ordena o LRU do disco ao reabrir o cache. As entradas que ainda
+estão só na memória são gravadas no disco por close().
+
+Uso:
+    cache = PredictionCache(max_memory_bytes=256 * 2**20, disk_dir='cache/predictions')
+    model = CachedModel(UltralyticsTileModel('yolo_icdar.pt'), cache, hash_file('yolo_icdar.pt'), {'imgsz': 640})
+    detections = model([image])[0]
+    print(cache.get_stats())
+    cache.close()
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from .tiled import Detections
+
+
+def hash_bytes(content : bytes | memoryview):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def hash_image(image : np.ndarray):
+    '''
+    Hash de uma imagem decodificada (conteúdo, dimensões e tipo).
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{image.shape}{image.dtype}'.encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+_file_hashes = {}
+
+
+def hash_file(path : str | Path, chunk_size : int = 2**20):
+    '''
+    Hash do conteúdo de um arquivo (ex.: pesos do modelo), memorizado por caminho, tamanho e mtime.
+    '''
+    stat = os.stat(path)
+    memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as file:
+            while chunk := file.read(chunk_size):
+                digest.update(chunk)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def make_namespace(weights_hash : str, params : Dict[str, Any] = None):
+    '''
+    Parte da chave comum a todas as imagens de um mesmo modelo e conjunto de parâmetros.
+    '''
+    return hash_bytes(f'{weights_hash}|{json.dumps(params or {}, sort_keys=True, default=str)}'.encode())
+
+
+def make_key(image_hash : str, namespace : str):
+    return hash_bytes(f'{namespace}|{image_hash}'.encode())
+
+
+def get_detections_size(detections : Detections):
+    size = detections.boxes.nbytes + detections.scores.nbytes + detections.class_ids.nbytes
+    if detections.polygons is not None:
+        size += sum(polygon.nbytes for polygon in detections.polygons)
+    return size + 256
+
+
+class PredictionCache:
+
+    def __init__(self, max_memory_bytes : int = 256 * 2**20, disk_dir : str | Path = None, max_disk_bytes : int = None):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.lock = threading.RLock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'spills': 0, 'disk_evictions': 0}
+
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.load_disk_index()
+
+    # -----------------------------------------------------------------------------------
+    # Nível em disco
+    # -----------------------------------------------------------------------------------
+
+    def get_disk_path(self, key : str):
+        return self.disk_dir/key[:2]/f'{key}.npz'
+
+    def load_disk_index(self):
+        '''
+        Reconstrói o índice do disco a partir dos arquivos existentes, do acesso mais antigo ao mais recente.
+        '''
+        entries = [(entry.stat().st_mtime_ns, entry.name[:-4], entry.stat().st_size)
+                   for directory in os.scandir(self.disk_dir) if directory.is_dir()
+                   for entry in os.scandir(directory.path) if entry.name.endswith('.npz')]
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def write_disk(self, key : str, detections : Detections, metadata : dict):
+        path = self.get_disk_path(key)
+        os.makedirs(path.parent, exist_ok=True)
+
+        arrays = {'boxes': detections.boxes.astype(np.float32),
+                  'scores': detections.scores.astype(np.float32),
+                  'class_ids': detections.class_ids.astype(np.int32),
+                  'metadata': np.array(json.dumps(metadata))}
+        if detections.polygons is not None:
+            arrays['points'] = (np.concatenate(detections.polygons).astype(np.float32) if detections.polygons
+                                else np.zeros((0, 2), dtype=np.float32))
+            arrays['point_counts'] = np.array([len(polygon) for polygon in detections.polygons], dtype=np.int32)
+
+        temporary_path = path.with_name(f'.{path.name}.tmp')
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, path)
+
+        size = path.stat().st_size
+        self.disk_bytes += size - self.disk.pop(key, 0)
+        self.disk[key] = size
+        self.counters['spills'] += 1
+
+        while self.max_disk_bytes is not None and self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            old_key, old_size = self.disk.popitem(last=False)
+            self.get_disk_path(old_key).unlink(missing_ok=True)
+            self.disk_bytes -= old_size
+            self.counters['disk_evictions'] += 1
+
+    def read_disk(self, key : str):
+        path = self.get_disk_path(key)
+        with np.load(path, allow_pickle=False) as data:
+            polygons = None
+            if 'points' in data.files:
+                polygons = np.split(data['points'], np.cumsum(data['point_counts'])[:-1]) if len(data['point_counts']) else []
+            detections = Detections(data['boxes'], data['scores'], data['class_ids'], polygons)
+            metadata = json.loads(str(data['metadata']))
+
+        # o mtime registra o acesso para que load_disk_index preserve a ordem do LRU após reiniciar
+        os.utime(path)
+        self.disk.move_to_end(key)
+        return detections, metadata
+
+    # -----------------------------------------------------------------------------------
+    # LRU em memória
+    # -----------------------------------------------------------------------------------
+
+    def store_memory(self, key : str, detections : Detections, metadata : dict):
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key)[2]
+
+        size = get_detections_size(detections)
+        self.memory[key] = (detections, metadata, size)
+        self.memory_bytes += size
+
+        # remove as entradas menos usadas, despejando-as no disco quando há nível em disco
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            old_key, (old_detections, old_metadata, old_size) = self.memory.popitem(last=False)
+            self.memory_bytes -= old_size
+            if self.disk_dir is not None and old_key not in self.disk:
+                self.write_disk(old_key, old_detections, old_metadata)
+
+    def get(self, key : str):
+        '''
+        Retorna (detecções, metadados) ou None. As detecções são compartilhadas e não devem ser alteradas.
+        '''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                detections, metadata, _ = self.memory[key]
+                return detections, metadata
+
+            if self.disk_dir is not None and key in self.disk:
+                try:
+                    detections, metadata = self.read_disk(key)
+                except (OSError, ValueError, KeyError):
+                    self.disk_bytes -= self.disk.pop(key)
+                else:
+                    self.counters['disk_hits'] += 1
+                    self.store_memory(key, detections, metadata)
+                    return detections, metadata
+
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key : str, detections : Detections, metadata : dict = None):
+        with self.lock:
+            self.store_memory(key, detections, metadata or {})
+
+    def close(self):
+        '''
+        Grava no disco as entradas que estão apenas na memória, da menos à mais usada, para que
+        sobrevivam a um reinício. Sem nível em disco não faz nada.
+        '''
+        with self.lock:
+            if self.disk_dir is None:
+                return
+            for key, (detections, metadata, _) in list(self.memory.items()):
+                if key in self.disk and self.get_disk_path(key).exists():
+                    self.disk.move_to_end(key)
+                else:
+                    self.write_disk(key, detections, metadata)
+
+            # mtimes estritamente crescentes na ordem do LRU, que a resolução do relógio do sistema de
+            # arquivos não garante para gravações consecutivas
+            now_ns = time.time_ns()
+            for offset, key in enumerate(key for key in self.memory if key in self.disk):
+                os.utime(self.get_disk_path(key), ns=(now_ns + offset, now_ns + offset))
+
+    def get_stats(self):
+        with self.lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses']
+            return self.counters | {
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'disk_entries': len(self.disk),
+                'disk_bytes': self.disk_bytes
+            }
+
+
+class CachedModel:
+    '''
+    Envolve um modelo (lista de imagens -> lista de Detections) consultando o cache antes. Apenas as
+    imagens ausentes do cache são enviadas ao modelo, em um único lote.
+    '''
+
+    def __init__(self, model : Callable[[List[np.ndarray]], List[Detections]], cache : PredictionCache,
+                 weights_hash : str, params : Dict[str, Any] = None):
+        self.model = model
+        self.cache = cache
+        self.namespace = make_namespace(weights_hash, params)
+
+    def __call__(self, images : List[np.ndarray]):
+        keys = [make_key(hash_image(image), self.namespace) for image in images]
+        results = [self.cache.get(key) for key in keys]
+
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            for index, detections in zip(missing, self.model([images[index] for index in missing])):
+                self.cache.put(keys[index], detections)
+                results[index] = (detections, {})
+
+        return [detections for detections, _ in results]
@@ -0,0 +1,611 @@
+'''
+Serviço HTTP de reconhecimento de estrutura de tabelas com micro-lotes dinâmicos.
+
+O servidor (asyncio, apenas biblioteca padrão) recebe páginas em POST /predict, enfileira cada
+página e forma micro-lotes limitados por tamanho (max_batch_size) e por tempo de espera
+(max_wait_ms). O modelo executa em um executor, fora do loop de eventos, e as caixas e polígonos
+são devolvidos nas coordenadas da página original (as páginas maiores que max_side são reduzidas
+antes do modelo e as predições, reescaladas).
+
+Controle de carga: no máximo max_concurrency requisições são processadas ao mesmo tempo; com a
+fila cheia (max_queue_size páginas), novas requisições recebem 503 com Retry-After em vez de
+aumentar a latência de todas as demais.
+
+Com --cache-memory-mb/--cache-dir, páginas repetidas são respondidas pelo cache de predições
+(Inference/prediction_cache.py), com a chave calculada sobre os bytes recebidos, antes da decodificação.
+
+Endpoints:
+    POST /predict    corpo: bytes da imagem; resposta: JSON com width, height e detections
+    GET  /metrics    histogramas de latência, espera na fila e tamanho dos lotes (JSON ou ?format=prometheus)
+    GET  /health
+
+Uso:
+    python -m Inference.server serve --stub --port 8080
+    python -m Inference.server serve --weights yolo_icdar.pt --max-batch-size 8 --max-wait-ms 20
+    python -m Inference.server serve --stub --cache-memory-mb 256 --cache-dir cache/predictions
+    python -m Inference.server client dataset/test/*.jpg --port 8080 --concurrency 16
+'''
+
+import io
+import json
+import time
+import asyncio
+import argparse
+import threading
+import http.client
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from .tiled import Detections
+from .prediction_cache import PredictionCache, hash_bytes, hash_file, make_key, make_namespace
+
+
+# ---------------------------------------------------------------------------------------
+# Métricas
+# ---------------------------------------------------------------------------------------
+
+class Histogram:
+    '''
+    Histograma cumulativo com limites fixos (como no Prometheus) e percentis calculados sobre as
+    últimas window observações.
+    '''
+
+    def __init__(self, buckets : List[float], window : int = 10_000):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, value : float):
+        with self.lock:
+            position = next((index for index, bucket in enumerate(self.buckets) if value <= bucket), len(self.buckets))
+            self.counts[position] += 1
+            self.count += 1
+            self.total += value
+            self.recent.append(value)
+
+    def snapshot(self):
+        with self.lock:
+            cumulative = np.cumsum(self.counts).tolist()
+            recent = np.array(self.recent) if self.recent else np.zeros(1)
+            return {
+                'buckets': {str(bucket): count for bucket, count in zip(self.buckets + ['+Inf'], cumulative)},
+                'count': self.count,
+                'sum': round(self.total, 3),
+                'p50': round(float(np.percentile(recent, 50)), 3),
+                'p90': round(float(np.percentile(recent, 90)), 3),
+                'p99': round(float(np.percentile(recent, 99)), 3)
+            }
+
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class ServerMetrics:
+
+    def __init__(self, max_batch_size : int):
+        self.request_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.queue_wait_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.model_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_size = Histogram(list(range(1, max_batch_size + 1)))
+        self.counters = {'requests': 0, 'rejected': 0, 'errors': 0}
+        self.prediction_cache = None
+
+    def snapshot(self, queue_size : int):
+        return {
+            'counters': dict(self.counters),
+            'queue_size': queue_size,
+            'request_latency_ms': self.request_latency_ms.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            'model_latency_ms': self.model_latency_ms.snapshot(),
+            'batch_size': self.batch_size.snapshot()
+        } | ({'prediction_cache': self.prediction_cache.get_stats()} if self.prediction_cache is not None else {})
+
+    def to_prometheus(self, queue_size : int):
+        lines = [f'table_server_queue_size {queue_size}']
+        for name, value in self.counters.items():
+            lines.append(f'table_server_{name}_total {value}')
+
+        if self.prediction_cache is not None:
+            for name, value in self.prediction_cache.get_stats().items():
+                lines.append(f'table_server_cache_{name} {value}')
+
+        for name in ['request_latency_ms', 'queue_wait_ms', 'model_latency_ms', 'batch_size']:
+            snapshot = getattr(self, name).snapshot()
+            lines.append(f'# TYPE table_server_{name} histogram')
+            for bucket, count in snapshot['buckets'].items():
+                lines.append(f'table_server_{name}_bucket{{le="{bucket}"}} {count}')
+            lines.append(f'table_server_{name}_sum {snapshot["sum"]}')
+            lines.append(f'table_server_{name}_count {snapshot["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# ---------------------------------------------------------------------------------------
+# Modelos
+# ---------------------------------------------------------------------------------------
+
+class StubModel:
+    '''
+    Modelo substituto para testes locais: as componentes conexas escuras da página são devolvidas
+    como detecções da classe 0 (retângulos). batch_overhead_ms e image_ms simulam o custo fixo por
+    lote e o custo por imagem de um modelo real, evidenciando o ganho dos micro-lotes.
+    '''
+
+    def __init__(self, batch_overhead_ms : float = 20.0, image_ms : float = 2.0, threshold : int = 128,
+                 min_area : int = 16):
+        self.batch_overhead_ms = batch_overhead_ms
+        self.image_ms = image_ms
+        self.threshold = threshold
+        self.min_area = min_area
+
+    def detect(self, image : np.ndarray):
+        import cv2
+
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        _, _, stats, _ = cv2.connectedComponentsWithStats((gray < self.threshold).astype(np.uint8), connectivity=8)
+        stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+
+        boxes = np.stack([stats[:, 0], stats[:, 1], stats[:, 0] + stats[:, 2], stats[:, 1] + stats[:, 3]], axis=1).astype(np.float32)
+        polygons = [np.array([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]], dtype=np.float32)
+                    for xmin, ymin, xmax, ymax in boxes]
+        return Detections(boxes, np.ones(len(boxes), dtype=np.float32), np.zeros(len(boxes), dtype=np.int32), polygons)
+
+    def __call__(self, images : List[np.ndarray]):
+        time.sleep((self.batch_overhead_ms + self.image_ms * len(images)) / 1000)
+        return [self.detect(image) for image in images]
+
+
+def scale_detections(detections : Detections, scale : float):
+    '''
+    Converte as detecções da imagem reduzida para as coordenadas da página original.
+    '''
+    if scale == 1.0:
+        return detections
+
+    polygons = None
+    if detections.polygons is not None:
+        polygons = [polygon / scale for polygon in detections.polygons]
+    return Detections(detections.boxes / scale, detections.scores, detections.class_ids, polygons)
+
+
+# ---------------------------------------------------------------------------------------
+# Micro-lotes
+# ---------------------------------------------------------------------------------------
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+
+    def __init__(self,
+                 model : Callable[[List[np.ndarray]], List[Detections]],
+                 metrics : ServerMetrics,
+                 max_batch_size : int = 8,
+                 max_wait_ms : float = 10.0,
+                 max_queue_size : int = 64,
+                 model_workers : int = 1):
+
+        self.model = model
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=model_workers, thread_name_prefix='model')
+        self.model_slots = asyncio.Semaphore(model_workers)
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, image : np.ndarray):
+        '''
+        Enfileira a imagem e retorna o future com as suas detecções. Lança Overloaded com a fila cheia.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise Overloaded()
+        return future
+
+    async def collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # só forma o próximo lote quando há um executor livre, de modo que as páginas continuam
+            # se acumulando na fila (e formando lotes maiores) enquanto o modelo está ocupado
+            await self.model_slots.acquire()
+            batch = await self.collect_batch()
+            loop.create_task(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            start = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.metrics.queue_wait_ms.observe((start - enqueued) * 1000)
+            self.metrics.batch_size.observe(len(batch))
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.model, [image for image, _, _ in batch])
+            except Exception as error:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+
+            self.metrics.model_latency_ms.observe((time.perf_counter() - start) * 1000)
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.model_slots.release()
+
+
+# ---------------------------------------------------------------------------------------
+# Servidor HTTP
+# ---------------------------------------------------------------------------------------
+
+class HTTPError(Exception):
+    def __init__(self, status : int, message : str, headers : dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                  413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class InferenceServer:
+
+    def __init__(self,
+                 model : Callable[[List[np.ndarray]], List[Detections]],
+                 host : str = '127.0.0.1',
+                 port : int = 8080,
+                 max_batch_size : int = 8,
+                 max_wait_ms : float = 10.0,
+                 max_queue_size : int = 64,
+                 max_concurrency : int = 128,
+                 max_side : int = None,
+                 max_body_bytes : int = 64 * 2**20,
+                 model_workers : int = 1,
+                 prediction_cache : PredictionCache = None,
+                 cache_namespace : str = ''):
+
+        self.model = model
+        self.host = host
+        self.port = port
+        self.max_side = max_side
+        self.max_body_bytes = max_body_bytes
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.max_concurrency = max_concurrency
+        self.model_workers = model_workers
+        self.metrics = ServerMetrics(max_batch_size)
+        self.metrics.prediction_cache = prediction_cache
+        self.prediction_cache = prediction_cache
+        # max_side altera as predições, então também faz parte da chave
+        self.cache_namespace = make_namespace(cache_namespace, {'max_side': max_side})
+        self.server = None
+
+    async def start(self):
+        self.concurrency = asyncio.Semaphore(self.max_concurrency)
+        self.batcher = MicroBatcher(self.model, self.metrics, self.max_batch_size, self.max_wait_ms,
+                                    self.max_queue_size, self.model_workers)
+        self.batcher.start()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # no Python 3.13, wait_closed aguarda todos os handlers, inclusive as conexões
+            # keep-alive ociosas em read_request (InferenceClient sempre mantém uma aberta)
+            self.server.close_clients()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+        if self.prediction_cache is not None:
+            self.prediction_cache.close()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f'Servidor escutando em http://{self.host}:{self.port}')
+        async with self.server:
+            await self.server.serve_forever()
+
+    def decode_image(self, body : bytes):
+        '''
+        Decodifica a página e, se necessário, a reduz para max_side. Retorna (imagem, largura, altura, escala).
+        '''
+        try:
+            with Image.open(io.BytesIO(body)) as image:
+                image = image.convert('RGB')
+        except Exception:
+            raise HTTPError(400, 'Corpo da requisição não é uma imagem válida')
+
+        width, height = image.size
+        scale = 1.0
+        if self.max_side is not None and max(width, height) > self.max_side:
+            scale = self.max_side / max(width, height)
+            image = image.resize((round(width * scale), round(height * scale)))
+
+        return np.asarray(image), width, height, scale
+
+    async def predict(self, body : bytes):
+        if self.prediction_cache is not None:
+            # a chave usa os bytes recebidos: páginas repetidas não são nem decodificadas
+            key = make_key(hash_bytes(body), self.cache_namespace)
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                detections, metadata = cached
+                return {'width': metadata['width'], 'height': metadata['height'], 'detections': detections.to_dict()}
+
+        loop = asyncio.get_running_loop()
+        image, width, height, scale = await loop.run_in_executor(None, self.decode_image, body)
+
+        try:
+            future = self.batcher.submit(image)
+        except Overloaded:
+            self.metrics.counters['rejected'] += 1
+            raise HTTPError(503, 'Fila cheia, tente novamente', {'Retry-After': '1'})
+
+        detections = scale_detections(await future, scale)
+        if self.prediction_cache is not None:
+            self.prediction_cache.put(key, detections, {'width': width, 'height': height})
+        return {'width': width, 'height': height, 'detections': detections.to_dict()}
+
+    async def route(self, method : str, target : str, body : bytes):
+        url = urlsplit(target)
+
+        if url.path == '/predict':
+            if method != 'POST':
+                raise HTTPError(405, 'Use POST')
+            self.metrics.counters['requests'] += 1
+            return 'application/json', json.dumps(await self.predict(body)).encode()
+
+        if url.path == '/metrics':
+            if parse_qs(url.query).get('format') == ['prometheus']:
+                return 'text/plain; version=0.0.4', self.metrics.to_prometheus(self.batcher.queue.qsize()).encode()
+            return 'application/json', json.dumps(self.metrics.snapshot(self.batcher.queue.qsize())).encode()
+
+        if url.path == '/health':
+            return 'application/json', b'{"status": "ok"}'
+
+        raise HTTPError(404, f'Caminho desconhecido: {url.path}')
+
+    async def read_request(self, reader : asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        try:
+            method, target, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, 'Linha de requisição inválida')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        content_length = int(headers.get('content-length', 0))
+        if content_length > self.max_body_bytes:
+            raise HTTPError(413, 'Imagem maior que o limite do servidor')
+        body = await reader.readexactly(content_length) if content_length else b''
+
+        return method, target, headers, body
+
+    async def write_response(self, writer : asyncio.StreamWriter, status : int, content_type : str, body : bytes,
+                             headers : dict = None, keep_alive : bool = True):
+        header_lines = [f'HTTP/1.1 {status} {STATUS_REASONS.get(status, "")}',
+                        f'Content-Type: {content_type}',
+                        f'Content-Length: {len(body)}',
+                        f'Connection: {"keep-alive" if keep_alive else "close"}']
+        header_lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        writer.write(('\r\n'.join(header_lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as error:
+                    await self.write_response(writer, error.status, 'application/json',
+                                              json.dumps({'error': str(error)}).encode(), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                start = time.perf_counter()
+
+                async with self.concurrency:
+                    try:
+                        content_type, response_body = await self.route(method, target, body)
+                        status, response_headers = 200, {}
+                    except HTTPError as error:
+                        status, response_headers = error.status, error.headers
+                        content_type, response_body = 'application/json', json.dumps({'error': str(error)}).encode()
+                    except Exception as error:
+                        self.metrics.counters['errors'] += 1
+                        status, response_headers = 500, {}
+                        content_type, response_body = 'application/json', json.dumps({'error': repr(error)}).encode()
+
+                if target.startswith('/predict') and status == 200:
+                    self.metrics.request_latency_ms.observe((time.perf_counter() - start) * 1000)
+
+                await self.write_response(writer, status, content_type, response_body, response_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# ---------------------------------------------------------------------------------------
+# Cliente local
+# ---------------------------------------------------------------------------------------
+
+class InferenceClient:
+
+    def __init__(self, host : str = '127.0.0.1', port : int = 8080, timeout : float = 60.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_connection(self):
+        # uma conexão persistente por thread
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, method : str, path : str, body : bytes = None):
+        connection = self.get_connection()
+        try:
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            content = response.read()
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+
+        if response.status != 200:
+            raise RuntimeError(f'HTTP {response.status}: {content.decode(errors="replace")}')
+        return content
+
+    def predict(self, image : str | Path | bytes):
+        body = Path(image).read_bytes() if isinstance(image, (str, Path)) else image
+        return json.loads(self.request('POST', '/predict', body))
+
+    def metrics(self):
+        return json.loads(self.request('GET', '/metrics'))
+
+    def load_test(self, images : List[str | Path | bytes], concurrency : int = 8, repeat : int = 1):
+        '''
+        Envia as imagens com concurrency requisições simultâneas e retorna (latências em ms, falhas).
+        '''
+        bodies = [Path(image).read_bytes() if isinstance(image, (str, Path)) else image for image in images] * repeat
+
+        def send(body):
+            start = time.perf_counter()
+            try:
+                self.predict(body)
+                return (time.perf_counter() - start) * 1000, None
+            except Exception as error:
+                return None, error
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, bodies))
+
+        latencies = np.array([latency for latency, error in results if error is None])
+        failures = [error for _, error in results if error is not None]
+        return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serviço HTTP de inferência com micro-lotes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--weights', default=None, help='pesos YOLO; omitido com --stub')
+    serve_parser.add_argument('--stub', action='store_true', help='usa o StubModel no lugar do YOLO')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--max-batch-size', type=int, default=8)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    serve_parser.add_argument('--max-queue-size', type=int, default=64)
+    serve_parser.add_argument('--max-concurrency', type=int, default=128)
+    serve_parser.add_argument('--max-side', type=int, default=None, help='reduz páginas maiores antes do modelo')
+    serve_parser.add_argument('--imgsz', type=int, default=640)
+    serve_parser.add_argument('--device', default=None)
+    serve_parser.add_argument('--cache-memory-mb', type=float, default=0, help='habilita o cache de predições (0 desabilita)')
+    serve_parser.add_argument('--cache-dir', default=None, help='nível em disco do cache de predições')
+    serve_parser.add_argument('--cache-disk-mb', type=float, default=None)
+
+    client_parser = subparsers.add_parser('client')
+    client_parser.add_argument('images', nargs='+')
+    client_parser.add_argument('--host', default='127.0.0.1')
+    client_parser.add_argument('--port', type=int, default=8080)
+    client_parser.add_argument('--concurrency', type=int, default=8)
+    client_parser.add_argument('--repeat', type=int, default=1)
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if args.stub:
+            model = StubModel()
+            cache_namespace = make_namespace('stub')
+        elif args.weights is not None:
+            from .tiled import UltralyticsTileModel
+            model = UltralyticsTileModel(args.weights, imgsz=args.imgsz, device=args.device)
+            cache_namespace = make_namespace(hash_file(args.weights), {'imgsz': args.imgsz})
+        else:
+            parser.error('informe --weights ou --stub')
+
+        prediction_cache = None
+        if args.cache_memory_mb > 0 or args.cache_dir is not None:
+            prediction_cache = PredictionCache(int(args.cache_memory_mb * 2**20), args.cache_dir,
+                                               int(args.cache_disk_mb * 2**20) if args.cache_disk_mb is not None else None)
+
+        server = InferenceServer(model, args.host, args.port, args.max_batch_size, args.max_wait_ms,
+                                 args.max_queue_size, args.max_concurrency, args.max_side,
+                                 prediction_cache=prediction_cache, cache_namespace=cache_namespace)
+        try:
+            asyncio.run(server.serve_forever())
+        finally:
+            if prediction_cache is not None:
+                prediction_cache.close()
+    else:
+        client = InferenceClient(args.host, args.port)
+        start = time.perf_counter()
+        latencies, failures = client.load_test(args.images, args.concurrency, args.repeat)
+        elapsed = time.perf_counter() - start
+
+        print(f'{len(latencies)} respostas e {len(failures)} falhas em {elapsed:.2f} s ({len(latencies) / elapsed:.1f} páginas/s)')
+        if len(latencies):
+            print(f'Latência: p50 {np.percentile(latencies, 50):.1f} ms | p90 {np.percentile(latencies, 90):.1f} ms | '
+                  f'p99 {np.percentile(latencies, 99):.1f} ms')
+        print(f'Tamanho médio dos lotes: {client.metrics()["batch_size"]["sum"] / max(client.metrics()["batch_size"]["count"], 1):.2f}')
+
+
+if __name__ == '__main__':
+    main()
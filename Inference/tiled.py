@@ -0,0 +1,376 @@
+'''
+Inferência em blocos (tiles) sobre páginas na resolução original.
+
+Em vez de reduzir páginas de vários megapixels para 640 x 640, o que apaga as células pequenas, a
+página é percorrida em tiles de 640 x 640 com sobreposição. Os tiles são gerados em lotes sobre um
+buffer pré-alocado (a memória do gerador não depende do tamanho da página; com um ImageCache ou
+outro np.memmap como fonte, a página também não é carregada inteira em memória), passam pelo
+modelo em lote, as detecções são deslocadas para as coordenadas da página de forma vetorizada e as
+duplicatas das regiões de sobreposição são eliminadas por NMS vetorizado.
+
+O modelo é qualquer função que recebe uma lista de tiles RGB (altura, largura, 3) e retorna uma
+lista de Detections nas coordenadas do tile; UltralyticsTileModel adapta um modelo YOLO.
+
+Uso:
+    python -m Inference.tiled runs/segment/train/weights/best.pt dataset/test/*.jpg --overlap 128 --output predictions.json
+'''
+
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Tuple
+from tqdm import tqdm
+
+from Instrumentation.spans import span
+
+
+@dataclass
+class Detections:
+    '''
+    boxes: (n, 4) xmin, ymin, xmax, ymax; scores: (n,); class_ids: (n,);
+    polygons: lista com um array (k, 2) por detecção, ou None para modelos de detecção.
+    '''
+    boxes : np.ndarray = field(default_factory=lambda: np.zeros((0, 4), dtype=np.float32))
+    scores : np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    class_ids : np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    polygons : List[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def select(self, indices : np.ndarray):
+        polygons = [self.polygons[index] for index in indices] if self.polygons is not None else None
+        return Detections(self.boxes[indices], self.scores[indices], self.class_ids[indices], polygons)
+
+    @staticmethod
+    def concatenate(detections : List['Detections']):
+        if not detections:
+            return Detections()
+
+        with_polygons = all(detection.polygons is not None for detection in detections)
+        return Detections(np.concatenate([detection.boxes for detection in detections]).astype(np.float32),
+                          np.concatenate([detection.scores for detection in detections]).astype(np.float32),
+                          np.concatenate([detection.class_ids for detection in detections]).astype(np.int32),
+                          [polygon for detection in detections for polygon in detection.polygons] if with_polygons else None)
+
+    def to_dict(self):
+        return {
+            'boxes': self.boxes.round(2).tolist(),
+            'scores': self.scores.round(4).tolist(),
+            'class_ids': self.class_ids.tolist(),
+            'polygons': [polygon.round(2).tolist() for polygon in self.polygons] if self.polygons is not None else None
+        }
+
+
+def get_tile_offsets(width : int, height : int, tile_size : int = 640, overlap : int = 128):
+    '''
+    Deslocamentos (x, y) do canto superior esquerdo de cada tile, cobrindo a página inteira. O último
+    tile de cada eixo é alinhado à borda da página, de modo que só páginas menores que o tile precisam
+    de preenchimento.
+    '''
+    stride = tile_size - overlap
+    if stride <= 0:
+        raise ValueError('overlap deve ser menor que tile_size')
+
+    def axis_offsets(length):
+        last = max(length - tile_size, 0)
+        offsets = np.arange(0, last + 1, stride)
+        return offsets if offsets[-1] == last else np.append(offsets, last)
+
+    xs, ys = np.meshgrid(axis_offsets(width), axis_offsets(height))
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
+def to_tile_source(image : str | Path | Image.Image | np.ndarray):
+    '''
+    Arrays (inclusive visões de ImageCache/np.memmap) são recortados sem cópia; caminhos e imagens
+    PIL são decodificados uma vez em RGB.
+    '''
+    if isinstance(image, (str, Path)):
+        with Image.open(image) as opened_image:
+            image = opened_image.convert('RGB')
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert('RGB'))
+    if image.ndim == 2:
+        image = image[..., None]
+    return image
+
+
+def iterate_tiles(image : np.ndarray, tile_size : int = 640, overlap : int = 128, batch_size : int = 8):
+    '''
+    Gera lotes (deslocamentos (b, 2), tiles (b, tile_size, tile_size, 3)). O buffer dos tiles é
+    reutilizado entre os lotes: o consumidor deve processar (ou copiar) cada lote antes de pedir o
+    próximo. Tiles na borda de páginas menores que tile_size são preenchidos com branco.
+    '''
+    height, width = image.shape[:2]
+    offsets = get_tile_offsets(width, height, tile_size, overlap)
+    buffer = np.empty((batch_size, tile_size, tile_size, 3), dtype=np.uint8)
+
+    for start in range(0, len(offsets), batch_size):
+        batch_offsets = offsets[start:start + batch_size]
+        for position, (x, y) in enumerate(batch_offsets):
+            tile = image[y:y + tile_size, x:x + tile_size]
+            tile_height, tile_width = tile.shape[:2]
+            if tile_height < tile_size or tile_width < tile_size:
+                buffer[position] = 255
+            # imagens em tons de cinza são replicadas nos três canais
+            buffer[position, :tile_height, :tile_width] = tile
+
+        yield batch_offsets, buffer[:len(batch_offsets)]
+
+
+def shift_detections(tile_detections : List[Detections], offsets : np.ndarray, tile_size : int,
+                     page_size : Tuple[int, int], margin : float = 2.0):
+    '''
+    Desloca as detecções de cada tile pelo deslocamento do tile, em uma única operação por array.
+    Retorna também quais detecções tocam uma borda do tile interna à página (provavelmente cortadas).
+    '''
+    detections = Detections.concatenate(tile_detections)
+    counts = np.array([len(detection) for detection in tile_detections])
+    box_offsets = np.repeat(offsets, counts, axis=0)
+
+    width, height = page_size
+    boxes = detections.boxes
+    truncated = (((boxes[:, 0] <= margin) & (box_offsets[:, 0] > 0)) |
+                 ((boxes[:, 1] <= margin) & (box_offsets[:, 1] > 0)) |
+                 ((boxes[:, 2] >= tile_size - margin) & (box_offsets[:, 0] + tile_size < width)) |
+                 ((boxes[:, 3] >= tile_size - margin) & (box_offsets[:, 1] + tile_size < height)))
+
+    detections.boxes += np.tile(box_offsets, 2)
+
+    if detections.polygons is not None and len(detections.polygons):
+        point_counts = np.array([len(polygon) for polygon in detections.polygons])
+        points = np.concatenate(detections.polygons).astype(np.float32) + np.repeat(box_offsets, point_counts, axis=0)
+        detections.polygons = np.split(points, np.cumsum(point_counts)[:-1])
+
+    return detections, truncated
+
+
+def compute_overlaps(box : np.ndarray, boxes : np.ndarray, metric : str = 'ios'):
+    '''
+    Sobreposição de uma caixa com várias: 'iou' (interseção sobre união) ou 'ios' (interseção sobre a
+    menor área), mais adequada a células cortadas na borda de um tile, contidas na célula completa.
+    '''
+    xmin = np.maximum(box[0], boxes[:, 0])
+    ymin = np.maximum(box[1], boxes[:, 1])
+    xmax = np.minimum(box[2], boxes[:, 2])
+    ymax = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(xmax - xmin, 0, None) * np.clip(ymax - ymin, 0, None)
+
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    denominator = np.minimum(area, areas) if metric == 'ios' else area + areas - intersection
+
+    return intersection / np.maximum(denominator, 1e-9)
+
+
+def non_maximum_suppression(boxes : np.ndarray, scores : np.ndarray, class_ids : np.ndarray,
+                            threshold : float = 0.5, metric : str = 'ios', truncated : np.ndarray = None):
+    '''
+    NMS por classe. Retorna (índices mantidos, grupo de cada detecção), em que grupo é o índice da
+    detecção mantida que a suprimiu (ou ela mesma). Detecções truncated são consideradas depois das
+    demais, para que a versão completa de uma célula suprima os seus pedaços.
+    '''
+    # desloca as caixas de cada classe para regiões disjuntas, tornando o NMS independente por classe
+    shift = (boxes.max() + 1) if len(boxes) else 0
+    shifted_boxes = boxes + (class_ids.astype(np.float32) * shift)[:, None]
+
+    truncated = truncated if truncated is not None else np.zeros(len(boxes), dtype=bool)
+    order = np.lexsort((-scores, truncated))
+    groups = np.full(len(boxes), -1, dtype=np.int64)
+    keep = []
+
+    while len(order):
+        current, order = order[0], order[1:]
+        keep.append(current)
+        groups[current] = current
+        if not len(order):
+            break
+        suppressed = compute_overlaps(shifted_boxes[current], shifted_boxes[order], metric) > threshold
+        groups[order[suppressed]] = current
+        order = order[~suppressed]
+
+    return np.array(keep, dtype=np.int64), groups
+
+
+def merge_detections(detections : Detections, threshold : float = 0.5, metric : str = 'ios', mode : str = 'union',
+                     truncated : np.ndarray = None):
+    '''
+    Remove as duplicatas das regiões de sobreposição. mode='nms' mantém a detecção escolhida pelo NMS
+    em cada grupo; mode='union' usa a caixa que envolve todo o grupo e o polígono da detecção de maior
+    área (a célula menos cortada pelas bordas dos tiles).
+    '''
+    if len(detections) == 0:
+        return detections
+
+    keep, groups = non_maximum_suppression(detections.boxes, detections.scores, detections.class_ids,
+                                           threshold, metric, truncated)
+    if mode == 'nms':
+        return detections.select(keep)
+
+    boxes = detections.boxes
+    union_boxes = boxes[keep].copy()
+    position = np.empty(len(boxes), dtype=np.int64)
+    position[keep] = np.arange(len(keep))
+    group_positions = position[groups]
+
+    np.minimum.at(union_boxes[:, 0], group_positions, boxes[:, 0])
+    np.minimum.at(union_boxes[:, 1], group_positions, boxes[:, 1])
+    np.maximum.at(union_boxes[:, 2], group_positions, boxes[:, 2])
+    np.maximum.at(union_boxes[:, 3], group_positions, boxes[:, 3])
+
+    merged = detections.select(keep)
+    merged.boxes = union_boxes
+
+    if detections.polygons is not None:
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        # ordena por grupo e área: o último elemento de cada grupo é o de maior área
+        order = np.lexsort((areas, group_positions))
+        last_of_group = np.append(group_positions[order][1:] != group_positions[order][:-1], True)
+        largest = np.empty(len(keep), dtype=np.int64)
+        largest[group_positions[order][last_of_group]] = order[last_of_group]
+        merged.polygons = [detections.polygons[index] for index in largest]
+
+    return merged
+
+
+class UltralyticsTileModel:
+    '''
+    Adapta um modelo YOLO da Ultralytics (detecção ou segmentação) para a inferência em tiles.
+    '''
+
+    def __init__(self, weights : str | Path, imgsz : int = 640, conf : float = 0.25, iou : float = 0.7,
+                 device : str = None, max_det : int = 1000):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights)
+        self.predict_params = {'imgsz': imgsz, 'conf': conf, 'iou': iou, 'max_det': max_det, 'verbose': False}
+        if device is not None:
+            self.predict_params['device'] = device
+
+    def __call__(self, tiles : np.ndarray):
+        # a Ultralytics espera arrays numpy em BGR
+        results = self.model.predict([tile[..., ::-1] for tile in tiles], **self.predict_params)
+
+        detections = []
+        for result in results:
+            polygons = [np.asarray(polygon, dtype=np.float32) for polygon in result.masks.xy] if result.masks is not None else None
+            detections.append(Detections(result.boxes.xyxy.cpu().numpy().astype(np.float32),
+                                         result.boxes.conf.cpu().numpy().astype(np.float32),
+                                         result.boxes.cls.cpu().numpy().astype(np.int32),
+                                         polygons))
+        return detections
+
+
+class TiledInference:
+
+    def __init__(self,
+                 model : Callable[[np.ndarray], List[Detections]],
+                 tile_size : int = 640,
+                 overlap : int = 128,
+                 batch_size : int = 8,
+                 merge_threshold : float = 0.5,
+                 merge_metric : str = 'ios',
+                 merge_mode : str = 'union'):
+
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.merge_threshold = merge_threshold
+        self.merge_metric = merge_metric
+        self.merge_mode = merge_mode
+        self.statistics = {'pages': 0, 'tiles': 0, 'megapixels': 0.0, 'seconds': 0.0}
+
+    def predict(self, image : str | Path | Image.Image | np.ndarray):
+        '''
+        Retorna as detecções da página inteira, em coordenadas da página.
+        '''
+        start = time.perf_counter()
+        image = to_tile_source(image)
+        height, width = image.shape[:2]
+
+        with span('tiled_inference.predict') as predict_span:
+            detections, truncated, n_tiles = [], [], 0
+            for offsets, tiles in iterate_tiles(image, self.tile_size, self.overlap, self.batch_size):
+                batch_detections, batch_truncated = shift_detections(self.model(tiles), offsets, self.tile_size,
+                                                                     (width, height))
+                detections.append(batch_detections)
+                truncated.append(batch_truncated)
+                n_tiles += len(offsets)
+
+            merged = merge_detections(Detections.concatenate(detections), self.merge_threshold, self.merge_metric,
+                                      self.merge_mode, np.concatenate(truncated))
+            predict_span.add(items=n_tiles)
+
+        self.statistics['pages'] += 1
+        self.statistics['tiles'] += n_tiles
+        self.statistics['megapixels'] += width * height / 1e6
+        self.statistics['seconds'] += time.perf_counter() - start
+
+        return merged
+
+    def predict_many(self, images : Iterable[str | Path | Image.Image | np.ndarray]):
+        for image in images:
+            yield self.predict(image)
+
+    def get_throughput(self):
+        seconds = max(self.statistics['seconds'], 1e-9)
+        return self.statistics | {
+            'megapixels_per_second': self.statistics['megapixels'] / seconds,
+            'seconds_per_megapixel': seconds / max(self.statistics['megapixels'], 1e-9),
+            'tiles_per_second': self.statistics['tiles'] / seconds
+        }
+
+    def print_throughput(self):
+        throughput = self.get_throughput()
+        print(f'\nPáginas: {throughput["pages"]} | tiles: {throughput["tiles"]} | '
+              f'megapixels: {throughput["megapixels"]:.1f} | tempo: {throughput["seconds"]:.1f} s')
+        print(f'{throughput["megapixels_per_second"]:.2f} MP/s | {throughput["seconds_per_megapixel"] * 1000:.1f} ms/MP | '
+              f'{throughput["tiles_per_second"]:.1f} tiles/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inferência em tiles sobre páginas na resolução original.')
+    parser.add_argument('weights')
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--image-cache', default=None, help='ImageCache (DataExtractor.image_cache) usado como fonte')
+    parser.add_argument('--tile-size', type=int, default=640)
+    parser.add_argument('--overlap', type=int, default=128)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--merge-threshold', type=float, default=0.5)
+    parser.add_argument('--merge-metric', choices=['ios', 'iou'], default='ios')
+    parser.add_argument('--merge-mode', choices=['union', 'nms'], default='union')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--output', default=None, help='JSON com as detecções de cada página')
+    args = parser.parse_args()
+
+    model = UltralyticsTileModel(args.weights, imgsz=args.tile_size, conf=args.conf, device=args.device)
+    engine = TiledInference(model, args.tile_size, args.overlap, args.batch,
+                            args.merge_threshold, args.merge_metric, args.merge_mode)
+
+    if args.image_cache is not None:
+        from DataExtractor.image_cache import ImageCache
+        cache = ImageCache(args.image_cache)
+        sources = [(path, cache[position]) for position, path in enumerate(cache.paths)]
+    else:
+        sources = [(path, path) for path in args.images]
+
+    predictions = {}
+    for name, image in tqdm(sources, desc='Inferência em tiles'):
+        predictions[str(name)] = engine.predict(image).to_dict()
+
+    engine.print_throughput()
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'predictions': predictions, 'throughput': engine.get_throughput()}, file)
+
+
+if __name__ == '__main__':
+    main()
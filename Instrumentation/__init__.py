@@ -0,0 +1,9 @@
+'''
+Instrumentação por etapas (spans) e importação preguiçosa dos pacotes.
+'''
+
+from .lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'spans': ['span', 'instrumented', 'enable', 'disable', 'is_enabled'],
+})
@@ -0,0 +1,45 @@
+'''
+Importação preguiçosa dos nomes públicos dos pacotes (PEP 562).
+
+O __init__.py de cada pacote declara os seus submódulos e os nomes exportados por cada um; o
+submódulo só é importado no primeiro acesso (DataExtractor.YOLOConverter ou
+from DataExtractor import YOLOConverter). Assim, importar um pacote, ou apenas um dos seus
+submódulos, não carrega as dependências dos demais (pandas, albumentations, matplotlib, torch).
+
+Uso, no __init__.py do pacote:
+    from Instrumentation.lazy_imports import attach
+
+    __getattr__, __dir__, __all__ = attach(__name__, {
+        'yolo_converter': ['YOLOConverter', 'ICDARYOLOConverter'],
+        ...
+    })
+'''
+
+import sys
+import importlib
+from typing import Dict, Iterable
+
+
+def attach(package_name : str, submodule_attributes : Dict[str, Iterable[str]]):
+    '''
+    Retorna (__getattr__, __dir__, __all__) do pacote. Os submódulos também são acessíveis como
+    atributos (DataExtractor.yolo_converter) sem importação explícita.
+    '''
+    attributes = {attribute: submodule for submodule, names in submodule_attributes.items() for attribute in names}
+
+    def __getattr__(name : str):
+        if name in submodule_attributes:
+            return importlib.import_module(f'{package_name}.{name}')
+
+        if name in attributes:
+            value = getattr(importlib.import_module(f'{package_name}.{attributes[name]}'), name)
+            # os próximos acessos não passam mais por __getattr__
+            setattr(sys.modules[package_name], name, value)
+            return value
+
+        raise AttributeError(f'module {package_name!r} has no attribute {name!r}')
+
+    def __dir__():
+        return sorted(set(submodule_attributes) | set(attributes))
+
+    return __getattr__, __dir__, sorted(attributes)
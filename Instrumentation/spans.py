@@ -0,0 +1,453 @@
+'''
+Instrumentação por etapas (spans) do pipeline de ETL.
+
+Um span mede o tempo de parede e de CPU, a quantidade de itens processados, os bytes lidos e
+escritos e a memória de um trecho de código: o crescimento do pico de RSS do processo durante o
+span (rss_growth_bytes), o pico do processo até o fim do span (process_peak_rss_bytes) e,
+opcionalmente, o pico do tracemalloc no span.
+A instrumentação é desativada por padrão: nesse caso span() retorna um objeto nulo e o
+decorador instrumented apenas repassa a chamada, com custo de uma verificação de flag.
+
+Ativação:
+    - no código: spans.enable(trace_dir='trace/')
+    - por variável de ambiente: OCR_TABLE_TRACE=1 (e OCR_TABLE_TRACE_DIR=trace/)
+
+Os eventos de cada processo são gravados em <trace_dir>/spans-<pid>.jsonl, o que permite agregar
+os spans executados por processos trabalhadores (ProcessPoolExecutor, multiprocessing) e
+exportá-los no formato de trace do Chrome (chrome://tracing, Perfetto) e no formato texto do Prometheus:
+
+    python -m Instrumentation.spans export trace/ --chrome trace.json --prometheus metrics.prom
+'''
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import tempfile
+import threading
+import functools
+import tracemalloc
+import multiprocessing.util
+from pathlib import Path
+from typing import Callable, Iterable
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+ENV_ENABLED = 'OCR_TABLE_TRACE'
+ENV_TRACE_DIR = 'OCR_TABLE_TRACE_DIR'
+ENV_TRACE_MEMORY = 'OCR_TABLE_TRACE_MEMORY'
+
+# quantidade de eventos acumulados em memória antes da gravação em disco
+FLUSH_EVENTS = 10_000
+
+
+class _State:
+    enabled = False
+    trace_dir = None
+    trace_memory = False
+    events = []
+    local = threading.local()
+
+
+def get_max_rss_bytes():
+    '''
+    Pico de memória residente do processo desde o seu início (ru_maxrss, que não pode ser zerado).
+    '''
+    if resource is None:
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def get_stack():
+    stack = getattr(_State.local, 'stack', None)
+    if stack is None:
+        stack = _State.local.stack = []
+    return stack
+
+
+class Span:
+
+    __slots__ = ('name', 'attributes', 'items', 'bytes_read', 'bytes_written',
+                 'start_ns', 'wall_start_ns', 'cpu_start_ns', 'rss_start_bytes', 'child_traced_peak')
+
+    def __init__(self, name : str, items : int = 0, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.items = items or 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.child_traced_peak = 0
+
+    def add(self, items : int = 0, bytes_read : int = 0, bytes_written : int = 0):
+        self.items += items
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def __enter__(self):
+        stack = get_stack()
+
+        if _State.trace_memory and tracemalloc.is_tracing():
+            # preserva o pico observado até aqui pelo span pai antes de zerar o pico para este span
+            if stack:
+                stack[-1].child_traced_peak = max(stack[-1].child_traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        stack.append(self)
+        self.rss_start_bytes = get_max_rss_bytes()
+        self.start_ns = time.time_ns()
+        self.wall_start_ns = time.perf_counter_ns()
+        self.cpu_start_ns = time.process_time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_ns = time.perf_counter_ns() - self.wall_start_ns
+        cpu_ns = time.process_time_ns() - self.cpu_start_ns
+
+        stack = get_stack()
+        stack.pop()
+
+        traced_peak = 0
+        if _State.trace_memory and tracemalloc.is_tracing():
+            traced_peak = max(tracemalloc.get_traced_memory()[1], self.child_traced_peak)
+            if stack:
+                stack[-1].child_traced_peak = max(stack[-1].child_traced_peak, traced_peak)
+
+        # ru_maxrss é o pico do processo desde o seu início: o do span é o quanto ele subiu durante o span
+        process_peak_rss = get_max_rss_bytes()
+        wall_seconds = wall_ns / 1e9
+        event = {
+            'name': self.name,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'start_us': self.start_ns / 1e3,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_ns / 1e9,
+            'items': self.items,
+            'items_per_second': self.items / wall_seconds if wall_seconds > 0 else 0.0,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'process_peak_rss_bytes': process_peak_rss,
+            'rss_growth_bytes': process_peak_rss - self.rss_start_bytes,
+            'peak_traced_bytes': traced_peak,
+            'error': exc_type.__name__ if exc_type is not None else None
+        }
+        if self.attributes:
+            event['attributes'] = self.attributes
+
+        _State.events.append(event)
+        if len(_State.events) >= FLUSH_EVENTS:
+            flush()
+
+        return False
+
+
+class _NullSpan:
+    '''
+    Span utilizado com a instrumentação desativada: não mede nem registra nada.
+    '''
+
+    __slots__ = ()
+
+    def add(self, items : int = 0, bytes_read : int = 0, bytes_written : int = 0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def is_enabled():
+    return _State.enabled
+
+
+def enable(trace_dir : str | Path = None, trace_memory : bool = False):
+    '''
+    Ativa a instrumentação neste processo e, via variáveis de ambiente, nos processos filhos.
+    Sem trace_dir, os eventos são gravados em um diretório temporário (ver get_trace_dir()).
+    '''
+
+    trace_dir = Path(trace_dir) if trace_dir is not None else Path(tempfile.mkdtemp(prefix='ocr_table_trace_'))
+    trace_dir.mkdir(parents=True, exist_ok=True)
+
+    _State.enabled = True
+    _State.trace_dir = trace_dir
+    _State.trace_memory = trace_memory
+
+    os.environ[ENV_ENABLED] = '1'
+    os.environ[ENV_TRACE_DIR] = str(trace_dir)
+    os.environ[ENV_TRACE_MEMORY] = '1' if trace_memory else '0'
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    return trace_dir
+
+
+def disable():
+    flush()
+    _State.enabled = False
+    os.environ.pop(ENV_ENABLED, None)
+
+
+def get_trace_dir():
+    return _State.trace_dir
+
+
+def span(name : str, items : int = 0, **attributes):
+    '''
+    Context manager que mede um trecho de código:
+
+        with span('yolo.write_labels') as current_span:
+            ...
+            current_span.add(items=1, bytes_written=len(content))
+    '''
+    if not _State.enabled:
+        return _NULL_SPAN
+
+    return Span(name, items, **attributes)
+
+
+def current_span():
+    '''
+    Span mais interno ativo na thread atual (ou o span nulo).
+    '''
+    if not _State.enabled:
+        return _NULL_SPAN
+
+    stack = get_stack()
+    return stack[-1] if stack else _NULL_SPAN
+
+
+def add_bytes_read(n_bytes : int):
+    current_span().add(bytes_read=n_bytes)
+
+
+def add_bytes_written(n_bytes : int):
+    current_span().add(bytes_written=n_bytes)
+
+
+def instrumented(name : str = None, items : Callable = None):
+    '''
+    Decorador que envolve a função em um span. items, se informado, recebe o retorno da
+    função e devolve a quantidade de itens processados (ex.: items=len).
+    '''
+
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _State.enabled:
+                return function(*args, **kwargs)
+
+            with Span(span_name) as current:
+                result = function(*args, **kwargs)
+                if items is not None:
+                    current.add(items=items(result))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def flush():
+    '''
+    Grava os eventos acumulados em <trace_dir>/spans-<pid>.jsonl.
+    '''
+    if not _State.events or _State.trace_dir is None:
+        return
+
+    events, _State.events = _State.events, []
+    path = Path(_State.trace_dir)/f'spans-{os.getpid()}.jsonl'
+    with open(path, 'a') as file:
+        file.write(''.join(json.dumps(event) + '\n' for event in events))
+
+
+def _reset_after_fork():
+    # os eventos herdados pertencem ao processo pai e já serão gravados por ele
+    _State.events = []
+    _State.local = threading.local()
+
+
+def _configure_from_environment():
+    if os.environ.get(ENV_ENABLED, '0') not in ('', '0'):
+        enable(os.environ.get(ENV_TRACE_DIR) or None, os.environ.get(ENV_TRACE_MEMORY, '0') == '1')
+
+
+def _register_process_finalizer(_ = None):
+    # os processos do multiprocessing descartam os finalizadores herdados e encerram com os._exit,
+    # portanto a gravação final é registrada novamente em cada processo filho
+    multiprocessing.util.Finalize(None, flush, exitpriority=100)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+multiprocessing.util.register_after_fork(_State, _register_process_finalizer)
+atexit.register(flush)
+_configure_from_environment()
+
+# com os métodos spawn e forkserver o módulo costuma ser importado pelo filho só ao desserializar
+# a tarefa, depois da inicialização do processo, e register_after_fork não é executado: o
+# finalizador é registrado aqui. O filho só é instrumentado se OCR_TABLE_TRACE estiver no ambiente
+# herdado, o que enable() garante quando chamado antes de criar o pool. Processos encerrados com
+# terminate() (por exemplo, ao sair de um bloco with multiprocessing.Pool) perdem os eventos
+# ainda não gravados; use close() e join() antes.
+if multiprocessing.parent_process() is not None:
+    _register_process_finalizer()
+
+
+# ---------------------------------------------------------------------------------------
+# Agregação e exportação
+# ---------------------------------------------------------------------------------------
+
+def collect_events(trace_dir : str | Path = None):
+    '''
+    Lê os eventos gravados por todos os processos em trace_dir (por padrão, o do processo atual).
+    '''
+    if trace_dir is None or Path(trace_dir) == _State.trace_dir:
+        flush()
+        trace_dir = _State.trace_dir
+
+    events = []
+    for path in sorted(Path(trace_dir).glob('spans-*.jsonl')):
+        with open(path, 'r') as file:
+            events.extend(json.loads(line) for line in file if line.strip())
+
+    return events
+
+
+def summarize(events : Iterable[dict]):
+    '''
+    Agrega os eventos por nome de span.
+    '''
+    summary = {}
+    for event in events:
+        entry = summary.setdefault(event['name'], {
+            'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'items': 0,
+            'bytes_read': 0, 'bytes_written': 0, 'process_peak_rss_bytes': 0, 'rss_growth_bytes': 0, 'peak_traced_bytes': 0,
+            'errors': 0, 'pids': set()
+        })
+        entry['count'] += 1
+        entry['wall_seconds'] += event['wall_seconds']
+        entry['cpu_seconds'] += event['cpu_seconds']
+        entry['items'] += event['items']
+        entry['bytes_read'] += event['bytes_read']
+        entry['bytes_written'] += event['bytes_written']
+        entry['process_peak_rss_bytes'] = max(entry['process_peak_rss_bytes'], event['process_peak_rss_bytes'])
+        entry['rss_growth_bytes'] = max(entry['rss_growth_bytes'], event['rss_growth_bytes'])
+        entry['peak_traced_bytes'] = max(entry['peak_traced_bytes'], event['peak_traced_bytes'])
+        entry['errors'] += event['error'] is not None
+        entry['pids'].add(event['pid'])
+
+    for entry in summary.values():
+        entry['items_per_second'] = entry['items'] / entry['wall_seconds'] if entry['wall_seconds'] > 0 else 0.0
+        entry['processes'] = len(entry.pop('pids'))
+
+    return summary
+
+
+def export_chrome_trace(events : Iterable[dict], path : str | Path):
+    '''
+    Exporta os eventos como "complete events" (ph = X) do formato de trace do Chrome.
+    '''
+    trace_events = []
+    for event in events:
+        args = {key: event[key] for key in ('cpu_seconds', 'items', 'items_per_second', 'bytes_read',
+                                            'bytes_written', 'process_peak_rss_bytes', 'rss_growth_bytes',
+                                            'peak_traced_bytes', 'error')}
+        args.update(event.get('attributes', {}))
+        trace_events.append({
+            'name': event['name'],
+            'cat': event['name'].split('.')[0],
+            'ph': 'X',
+            'ts': event['start_us'],
+            'dur': event['wall_seconds'] * 1e6,
+            'pid': event['pid'],
+            'tid': event['tid'],
+            'args': args
+        })
+
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file)
+
+
+PROMETHEUS_METRICS = [
+    ('count', 'ocr_table_span_count_total', 'counter', 'Quantidade de execuções do span.'),
+    ('wall_seconds', 'ocr_table_span_wall_seconds_total', 'counter', 'Tempo de parede acumulado.'),
+    ('cpu_seconds', 'ocr_table_span_cpu_seconds_total', 'counter', 'Tempo de CPU acumulado.'),
+    ('items', 'ocr_table_span_items_total', 'counter', 'Itens processados.'),
+    ('items_per_second', 'ocr_table_span_items_per_second', 'gauge', 'Vazão média em itens por segundo.'),
+    ('bytes_read', 'ocr_table_span_bytes_read_total', 'counter', 'Bytes lidos.'),
+    ('bytes_written', 'ocr_table_span_bytes_written_total', 'counter', 'Bytes escritos.'),
+    ('process_peak_rss_bytes', 'ocr_table_span_process_peak_rss_bytes', 'gauge',
+     'Maior pico de memória residente do processo (acumulado desde o início do processo).'),
+    ('rss_growth_bytes', 'ocr_table_span_rss_growth_bytes', 'gauge',
+     'Maior crescimento do pico de memória residente durante um span.'),
+    ('peak_traced_bytes', 'ocr_table_span_peak_traced_bytes', 'gauge', 'Maior pico de memória do tracemalloc.'),
+    ('errors', 'ocr_table_span_errors_total', 'counter', 'Execuções encerradas com exceção.'),
+]
+
+
+def export_prometheus(events : Iterable[dict], path : str | Path):
+    '''
+    Exporta o resumo por span no formato texto do Prometheus (node_exporter textfile collector).
+    '''
+    summary = summarize(events)
+
+    lines = []
+    for key, metric, metric_type, description in PROMETHEUS_METRICS:
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for name, entry in sorted(summary.items()):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{metric}{{span="{label}"}} {entry[key]}')
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def print_summary(events : Iterable[dict]):
+    for name, entry in sorted(summarize(events).items(), key=lambda item: -item[1]['wall_seconds']):
+        print(f"{name:<60} {entry['count']:>7}x {entry['wall_seconds']:>10.3f} s "
+              f"{entry['items_per_second']:>12,.1f} itens/s  crescimento RSS {entry['rss_growth_bytes'] / 2**20:,.0f} MiB")
+
+
+def main(argv : Iterable[str] = None):
+
+    parser = argparse.ArgumentParser(description='Exporta os spans gravados pela instrumentação.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('trace_dir')
+    export_parser.add_argument('--chrome', default=None, help='arquivo JSON no formato de trace do Chrome')
+    export_parser.add_argument('--prometheus', default=None, help='arquivo texto no formato do Prometheus')
+
+    args = parser.parse_args(argv)
+
+    events = collect_events(args.trace_dir)
+    print_summary(events)
+
+    if args.chrome:
+        export_chrome_trace(events, args.chrome)
+        print(f'\nTrace do Chrome salvo em: {args.chrome}')
+
+    if args.prometheus:
+        export_prometheus(events, args.prometheus)
+        print(f'Métricas do Prometheus salvas em: {args.prometheus}')
+
+
+if __name__ == '__main__':
+    main()
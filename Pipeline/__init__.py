@@ -0,0 +1,11 @@
+'''
+Execução dos pipelines de geração de dados descritos em YAML.
+
+Os submódulos são importados apenas no primeiro acesso aos seus nomes (ver Instrumentation.lazy_imports).
+'''
+
+from Instrumentation.lazy_imports import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'runner': ['PipelineRunner', 'PipelineError', 'register_stage'],
+})
@@ -0,0 +1,31 @@
+import sys
+import argparse
+from typing import Iterable
+
+from .runner import PipelineRunner
+# registra as etapas disponíveis
+from . import stages
+
+
+def main(argv : Iterable[str] = None):
+
+    parser = argparse.ArgumentParser(prog='python -m Pipeline',
+                                     description='Executa um pipeline de geração de dados descrito em YAML.')
+    parser.add_argument('config')
+    parser.add_argument('--dry-run', action='store_true', help='apenas valida e exibe a ordem das etapas')
+    args = parser.parse_args(argv)
+
+    runner = PipelineRunner.from_yaml(args.config)
+
+    if args.dry_run:
+        for name in runner.order:
+            stage = runner.stages[name]
+            print(f'{name} ({stage.type}) <- {", ".join(stage.inputs) or "-"}')
+        return 0
+
+    runner.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
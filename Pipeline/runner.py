@@ -0,0 +1,304 @@
+'''
+Executor declarativo de pipelines em grafo acíclico (DAG) para a geração dos conjuntos de dados.
+
+Cada etapa declara o seu tipo (registrado em Pipeline.stages), os seus parâmetros e as etapas
+das quais depende. As etapas executam em threads próprias e os itens (dicionários com os metadados
+de cada imagem) fluem entre elas por filas limitadas, de modo que nenhuma etapa precisa materializar
+o conjunto completo em disco ou em memória antes da próxima começar. Etapas independentes, como
+os ramos de treino e de teste, executam concorrentemente.
+
+Exemplo de configuração YAML:
+
+    queue_size: 64
+    stages:
+      - name: annotations
+        type: icdar_annotations
+        params: {images_path: dataset/training/TRACKB1/ground_truth, labels_path: dataset/training/TRACKB1/ground_truth}
+      - name: resize
+        type: resize
+        inputs: [annotations]
+        workers: 4
+        params: {width: 640, height: 640, output_dir: dataset_completo/train/images}
+
+Uso:
+    python -m Pipeline Pipeline/configs/icdar_folds.yaml
+    python -m Pipeline Pipeline/configs/icdar_folds.yaml --dry-run
+'''
+
+import time
+import queue
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+
+import yaml
+
+from Instrumentation.spans import span
+
+
+STAGE_REGISTRY : Dict[str, 'StageType'] = {}
+
+# sinaliza o fim do fluxo de itens em uma fila
+_END = object()
+
+# intervalo de verificação do cancelamento em operações bloqueantes das filas
+_POLL_SECONDS = 0.1
+
+
+class PipelineError(Exception):
+    pass
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+@dataclass
+class StageType:
+    '''
+    function recebe (inputs, **params) no caso kind='stream', em que inputs é a lista de iteradores
+    das etapas de entrada, ou (item, **params) no caso kind='map', em que a função é aplicada item a
+    item e pode retornar um item, uma lista de itens ou None (descarta o item).
+    '''
+    name : str
+    function : Callable
+    kind : str = 'stream'
+
+
+@dataclass
+class StageConfig:
+    name : str
+    type : str
+    inputs : List[str] = field(default_factory=list)
+    params : Dict[str, Any] = field(default_factory=dict)
+    workers : int = 1
+
+
+def register_stage(name : str, kind : str = 'stream'):
+    '''
+    Registra um tipo de etapa para uso nas configurações.
+    '''
+    if kind not in ('stream', 'map'):
+        raise ValueError(f'Tipo de etapa inválido: {kind}')
+
+    def decorator(function):
+        STAGE_REGISTRY[name] = StageType(name, function, kind)
+        return function
+
+    return decorator
+
+
+def iterate_items(*inputs : Iterable):
+    '''
+    Itera sequencialmente sobre os itens de todas as entradas de uma etapa.
+    '''
+    for stage_input in inputs:
+        yield from stage_input
+
+
+def map_items(function : Callable, items : Iterable, workers : int = 1, **params):
+    '''
+    Aplica uma etapa do tipo map preservando a ordem dos itens. Com workers > 1 os itens são
+    processados por um pool de threads com no máximo 2 * workers itens em andamento.
+    '''
+
+    def emit(result):
+        if result is None:
+            return []
+        if isinstance(result, list):
+            return result
+        return [result]
+
+    if workers <= 1:
+        for item in items:
+            yield from emit(function(item, **params))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for item in items:
+            pending.append(executor.submit(function, item, **params))
+            if len(pending) >= 2 * workers:
+                yield from emit(pending.pop(0).result())
+
+        for future in pending:
+            yield from emit(future.result())
+
+
+class PipelineRunner:
+
+    def __init__(self, stages : Iterable[StageConfig], queue_size : int = 64):
+        self.stages = {stage.name: stage for stage in stages}
+        self.queue_size = queue_size
+        self.cancelled = threading.Event()
+        self.errors = []
+        self.counts = {}
+
+        self.validate()
+
+    @staticmethod
+    def from_config(config : dict):
+        stages = [StageConfig(name=stage['name'],
+                              type=stage['type'],
+                              inputs=list(stage.get('inputs', [])),
+                              params=dict(stage.get('params') or {}),
+                              workers=int(stage.get('workers', 1)))
+                  for stage in config['stages']]
+
+        return PipelineRunner(stages, queue_size=int(config.get('queue_size', 64)))
+
+    @staticmethod
+    def from_yaml(path : str | Path):
+        with open(path, 'r') as file:
+            return PipelineRunner.from_config(yaml.safe_load(file))
+
+    def validate(self):
+        for stage in self.stages.values():
+            if stage.type not in STAGE_REGISTRY:
+                raise PipelineError(f'Etapa {stage.name}: tipo desconhecido {stage.type}')
+            for input_name in stage.inputs:
+                if input_name not in self.stages:
+                    raise PipelineError(f'Etapa {stage.name}: entrada desconhecida {input_name}')
+            if STAGE_REGISTRY[stage.type].kind == 'map' and len(stage.inputs) == 0:
+                raise PipelineError(f'Etapa {stage.name}: etapas do tipo map precisam de ao menos uma entrada')
+
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        '''
+        Ordenação topológica (algoritmo de Kahn), usada para validar a ausência de ciclos.
+        '''
+        in_degree = {name: len(stage.inputs) for name, stage in self.stages.items()}
+        consumers = {name: [] for name in self.stages}
+        for stage in self.stages.values():
+            for input_name in stage.inputs:
+                consumers[input_name].append(stage.name)
+
+        ready = [name for name, degree in in_degree.items() if degree == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for consumer in consumers[name]:
+                in_degree[consumer] -= 1
+                if in_degree[consumer] == 0:
+                    ready.append(consumer)
+
+        if len(order) != len(self.stages):
+            cycle = sorted(set(self.stages) - set(order))
+            raise PipelineError(f'O pipeline contém um ciclo envolvendo as etapas: {cycle}')
+
+        return order
+
+    # -----------------------------------------------------------------------------------
+    # Filas
+    # -----------------------------------------------------------------------------------
+
+    def put(self, output_queue : queue.Queue, item):
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                output_queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def iterate_queue(self, input_queue : queue.Queue, n_producers : int):
+        '''
+        Itera sobre a fila de entrada de uma etapa, compartilhada por todas as etapas de entrada,
+        até receber o sinal de fim de cada uma delas. Os itens são consumidos na ordem de chegada,
+        de modo que um ramo lento não bloqueia os demais.
+        '''
+        finished = 0
+        while finished < n_producers:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                item = input_queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if item is _END:
+                finished += 1
+                continue
+            yield item
+
+    # -----------------------------------------------------------------------------------
+    # Execução
+    # -----------------------------------------------------------------------------------
+
+    def run_stage(self, stage : StageConfig, input_queue : queue.Queue, output_queues : List[queue.Queue]):
+
+        stage_type = STAGE_REGISTRY[stage.type]
+        inputs = [self.iterate_queue(input_queue, len(stage.inputs))] if stage.inputs else []
+        count = 0
+
+        try:
+            with span(f'pipeline.{stage.name}', stage_type=stage.type) as stage_span:
+                if stage_type.kind == 'map':
+                    outputs = map_items(stage_type.function, iterate_items(*inputs), stage.workers, **stage.params)
+                else:
+                    outputs = stage_type.function(inputs, **stage.params)
+
+                for item in outputs or []:
+                    for output_queue in output_queues:
+                        self.put(output_queue, item)
+                    count += 1
+
+                # consome entradas não utilizadas pela etapa (ex.: dependências apenas de ordem)
+                for stage_input in inputs:
+                    for _ in stage_input:
+                        pass
+
+                stage_span.add(items=count)
+
+            for output_queue in output_queues:
+                self.put(output_queue, _END)
+
+        except PipelineCancelled:
+            pass
+        except BaseException as error:
+            self.errors.append((stage.name, error))
+            self.cancelled.set()
+        finally:
+            self.counts[stage.name] = count
+
+    def run(self):
+
+        # cada etapa possui uma única fila de entrada, alimentada por todas as etapas das quais depende
+        queues = {name: queue.Queue(maxsize=self.queue_size) for name in self.stages}
+
+        threads = []
+        for name in self.order:
+            stage = self.stages[name]
+            output_queues = [queues[consumer.name] for consumer in self.stages.values() if name in consumer.inputs]
+
+            thread = threading.Thread(target=self.run_stage, args=(stage, queues[name], output_queues),
+                                      name=f'pipeline-{name}', daemon=True)
+            threads.append(thread)
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=_POLL_SECONDS)
+        except KeyboardInterrupt:
+            self.cancelled.set()
+            raise
+
+        elapsed = time.perf_counter() - start
+
+        if self.errors:
+            stage_name, error = self.errors[0]
+            raise PipelineError(f'Falha na etapa {stage_name}: {error!r}') from error
+
+        print(f'\nPipeline finalizado em {elapsed:.1f} s.')
+        for name in self.order:
+            print(f'\t{name}: {self.counts.get(name, 0)} itens')
+
+        return self.counts
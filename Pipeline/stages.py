@@ -0,0 +1,462 @@
+'''
+Etapas disponíveis para os pipelines de geração dos conjuntos de dados, equivalentes às células
+de dataset_generation_icdar.ipynb: download, extração das anotações, redimensionamento, geração
+dos rótulos YOLO, divisão em folds, exportação no formato da Ultralytics e aumento de dados.
+
+Os itens trafegados entre as etapas são dicionários com as mesmas colunas dos CSVs dos notebooks
+(image_path, label_path, image_width, image_height, xy, yolo_xy, yolo_txt_path, split, fold).
+'''
+
+import os
+import csv
+import json
+import shutil
+import functools
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from .runner import register_stage, iterate_items
+
+
+def link_or_copy(source : str | Path, destination : str | Path):
+    '''
+    Cria um hard link (sem custo de cópia) e recorre à cópia quando o sistema de arquivos não permite.
+    '''
+    try:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.link(source, destination)
+    except OSError:
+        shutil.copy(source, destination)
+
+
+def build_albumentations_transforms(transforms : Iterable[dict]):
+    '''
+    Constrói as transformações do albumentations a partir de [{'name': 'GaussianBlur', 'params': {...}}, ...].
+    '''
+    import albumentations as A
+
+    built_transforms = []
+    for transform in transforms:
+        params = dict(transform.get('params') or {})
+        # listas do YAML são convertidas em tuplas, como esperado pelos limites do albumentations
+        params = {key: tuple(value) if isinstance(value, list) else value for key, value in params.items()}
+        built_transforms.append(getattr(A, transform['name'])(**params))
+
+    return built_transforms
+
+
+def build_encoding_options(encoding : dict = None):
+    '''
+    Opções de codificação das imagens a partir de {'format': 'jpg', 'quality': 90, ...}; None mantém o padrão do Pillow.
+    '''
+    from DataAugmentation.image_encoding import EncodingOptions
+
+    return EncodingOptions(**encoding) if encoding else None
+
+
+@functools.lru_cache(maxsize=None)
+def open_image_cache(path : str = None):
+    from DataExtractor.image_cache import ImageCache
+
+    return ImageCache(path) if path is not None else None
+
+
+@register_stage('download')
+def download_stage(inputs : List[Iterator], workdir : str = '.'):
+    from DataExtractor.downloader import download_dataset
+
+    for _ in iterate_items(*inputs):
+        pass
+
+    current_dir = os.getcwd()
+    try:
+        os.chdir(workdir)
+        download_dataset()
+    finally:
+        os.chdir(current_dir)
+
+    return []
+
+
+@register_stage('validate_annotations')
+def validate_annotations_stage(inputs : List[Iterator], labels_path : str, images_path : str = None, fix : str = None,
+                               output_dir : str = None, report_path : str = None, tolerance : float = 1.0,
+                               workers : int = 8):
+    '''
+    Aguarda as etapas de entrada e valida os XMLs de labels_path. Com fix ('clip' ou 'drop'), as
+    anotações corrigidas são gravadas em output_dir, que deve então ser o labels_path da etapa seguinte.
+    '''
+    from DataExtractor.annotation_validator import AnnotationValidator
+
+    for _ in iterate_items(*inputs):
+        pass
+
+    report = AnnotationValidator.validate(labels_path, images_path, fix, output_dir, tolerance, workers)
+    AnnotationValidator.print_report(report)
+    if report_path is not None:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        AnnotationValidator.save_report(report, report_path)
+
+    return []
+
+
+@register_stage('icdar_annotations')
+def icdar_annotations_stage(inputs : List[Iterator],
+                            images_path : str,
+                            labels_path : str,
+                            class_id : int = 0,
+                            class_label : str = 'cell',
+                            split : str = None):
+    '''
+    Emite, para cada par imagem/XML, as dimensões da imagem e os polígonos das células (coluna xy).
+    Aguarda as etapas de entrada (ex.: download) antes de procurar os arquivos.
+    '''
+    from DataExtractor.dataset_to_dataframe import ConvertICDARDatasetToDataframe
+
+    for _ in iterate_items(*inputs):
+        pass
+
+    converter = ConvertICDARDatasetToDataframe(images_path=images_path, labels_path=labels_path,
+                                               class_id=class_id, class_label=class_label)
+
+    for image_path, label_path in converter.pairs_image_label:
+        image_width, image_height = converter.get_image_shape(image_path)
+        split_values = {'split': split} if split is not None else {}
+        yield split_values | {
+            'image_path': image_path,
+            'label_path': label_path,
+            'image_width': image_width,
+            'image_height': image_height,
+            'class_id': class_id,
+            'class_label': class_label,
+            'xy': converter.get_xy_annotations_from_xml(label_path)
+        }
+
+
+@register_stage('resize', kind='map')
+def resize_stage(item : dict, width : int, height : int, output_dir : str, encoding : dict = None,
+                 image_cache : str = None, grayscale : bool | str = False):
+    '''
+    Com grayscale 'auto', as páginas cinzas na prática são redimensionadas e gravadas em L (um canal).
+    '''
+    from DataAugmentation.augmentation import Augmentation
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = Path(output_dir)/os.path.basename(item['image_path'])
+
+    cache = open_image_cache(image_cache)
+    image = Augmentation.load_image(item['image_path'], cache, grayscale)
+    resized_image, _ = Augmentation.resize_image(image, width, height)
+
+    # as imagens do cache já estão redimensionadas: os polígonos (em pixels da imagem original)
+    # são escalados a partir das dimensões originais registradas no índice do cache
+    if cache is not None and item['image_path'] in cache:
+        original_width, original_height = cache.get_original_size(item['image_path'])
+    elif Augmentation.is_pil_image(image):
+        original_width, original_height = image.size
+    else:
+        original_height, original_width = image.shape[:2]
+    resized_masks = Augmentation.resize_masks(item['xy'], original_width, width, original_height, height)
+
+    Augmentation.save_image(resized_image, output_path, build_encoding_options(encoding))
+
+    return item | {'original_image_path': item['image_path'],
+                   'image_path': output_path.as_posix(),
+                   'image_width': width,
+                   'image_height': height,
+                   'xy': resized_masks}
+
+
+@register_stage('simplify_polygons')
+def simplify_polygons_stage(inputs : List[Iterator], tolerance : float = 1.0, snap : str = None,
+                            batch_size : int = 64, measure_iou : bool = True, report_path : str = None):
+    '''
+    Simplifica os polígonos da coluna xy (tolerância em pixels da imagem do item) em lotes de
+    batch_size páginas por chamada vetorizada e, ao final, imprime o relatório de redução.
+    '''
+    from DataExtractor.polygon_simplification import SimplificationReport, simplify_pages
+
+    report = SimplificationReport()
+
+    def flush(batch):
+        pages = simplify_pages([item['xy'] for item in batch], tolerance, snap, report, measure_iou)
+        return [item | {'xy': masks} for item, masks in zip(batch, pages)]
+
+    batch = []
+    for item in iterate_items(*inputs):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield from flush(batch)
+            batch = []
+    if batch:
+        yield from flush(batch)
+
+    report.print_report()
+    if report_path is not None:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        report.save(report_path)
+
+
+@register_stage('yolo_labels', kind='map')
+def yolo_labels_stage(item : dict, labels_dir : str = None):
+    '''
+    Gera o rótulo YOLO de segmentação no diretório labels_dir ou, se omitido, ao lado da imagem.
+    '''
+    from DataExtractor.yolo_converter import ICDARYOLOConverter
+
+    image_path = Path(item['image_path'])
+    output_dir = Path(labels_dir) if labels_dir is not None else image_path.parent
+    os.makedirs(output_dir, exist_ok=True)
+    txt_path = output_dir/f'{image_path.stem}.txt'
+
+    yolo_normalized_masks = ICDARYOLOConverter.process_masks(item['xy'], item['image_width'], item['image_height'], txt_path)
+
+    return item | {'yolo_xy': yolo_normalized_masks, 'yolo_txt_path': txt_path.as_posix()}
+
+
+@register_stage('filter', kind='map')
+def filter_stage(item : dict, key : str, values : list):
+    return item if item.get(key) in values else None
+
+
+@register_stage('deduplicate')
+def deduplicate_stage(inputs : List[Iterator], threshold : int = 6, method : str = 'phash', drop : bool = False,
+                      workers : int = 8, hashes_path : str = None):
+    '''
+    Barreira: agrupa as imagens quase duplicadas (e as variantes de uma mesma página) na coluna
+    duplicate_group, com o peso de amostragem 1 / tamanho do grupo em duplicate_weight. Com
+    drop=True, apenas o primeiro item de cada grupo segue adiante. Use group_column: duplicate_group
+    na etapa kfold para manter as duplicatas no mesmo fold.
+    '''
+    from DataSplitter.dedup import PerceptualHasher, assign_duplicate_groups, get_representatives, get_sample_weights
+
+    items = list(iterate_items(*inputs))
+    if not items:
+        return
+
+    image_paths = [item['image_path'] for item in items]
+    hashes = PerceptualHasher.hash_images(image_paths, workers=workers)
+    if hashes_path is not None:
+        os.makedirs(os.path.dirname(hashes_path) or '.', exist_ok=True)
+        PerceptualHasher.save(hashes, hashes_path)
+
+    groups = assign_duplicate_groups(image_paths, threshold, method, hashes=hashes)
+    weights = get_sample_weights(groups)
+    positions = get_representatives(groups) if drop else range(len(items))
+
+    print(f'\n{len(items)} imagens em {groups.max() + 1} grupos de duplicatas')
+    for position in positions:
+        yield items[position] | {'duplicate_group': int(groups[position]), 'duplicate_weight': float(weights[position])}
+
+
+@register_stage('kfold')
+def kfold_stage(inputs : List[Iterator], n_splits : int = 5, shuffle : bool = True, random_state : int = 42,
+                mode : str = 'kfold', group_column : str = None):
+    '''
+    Barreira: a divisão em folds depende de todos os itens, mas apenas os metadados (e não as imagens)
+    são mantidos em memória. Os folds são percorridos pelos índices, sem copiar o DataFrame por fold.
+    mode: kfold, group (variantes de uma página no mesmo fold) ou stratified_group.
+    '''
+    import pandas as pd
+    from DataSplitter.kfold import DataFrameKFoldSplitter
+
+    items = list(iterate_items(*inputs))
+    if not items:
+        return
+
+    splitter = DataFrameKFoldSplitter(pd.DataFrame(items), n_splits=n_splits, shuffle=shuffle,
+                                      random_state=random_state, mode=mode, group_column=group_column)
+
+    for index, fold in enumerate(splitter.split_indices()):
+        for split in ['train', 'val']:
+            for position in fold[split]:
+                yield items[position] | {'fold': index + 1, 'split': split}
+
+
+class FoldExporter:
+    '''
+    Exporta os itens para dataset_folds/fold_k/{train,val}/{images,labels}, com o dataset.yaml e o
+    dataset.csv de cada fold escritos de forma incremental.
+    '''
+
+    columns = ['image_path', 'label_path', 'split', 'fold', 'image_width', 'image_height', 'xy', 'yolo_xy']
+
+    def __init__(self, output_dir : str | Path):
+        self.output_dir = Path(output_dir)
+        self.metadata_files = {}
+
+    def prepare_fold(self, fold : int):
+        from DataExtractor.yolo_converter import YOLOConverter, ICDARYOLOConverter
+
+        fold_path = self.output_dir/f'fold_{fold}'
+        YOLOConverter.create_folders(fold_path)
+        ICDARYOLOConverter.create_yaml(output_dir=fold_path.as_posix() + '/', train_fold_path='train/', val_fold_path='val/')
+
+        file = open(fold_path/'dataset.csv', 'w', newline='')
+        writer = csv.DictWriter(file, fieldnames=self.columns)
+        writer.writeheader()
+        self.metadata_files[fold] = (file, writer)
+
+    def export(self, item : dict):
+        fold, split = item['fold'], item['split']
+        if fold not in self.metadata_files:
+            self.prepare_fold(fold)
+
+        split_path = self.output_dir/f'fold_{fold}'/split
+        image_path = split_path/'images'/os.path.basename(item['image_path'])
+        label_path = split_path/'labels'/os.path.basename(item['yolo_txt_path'])
+
+        link_or_copy(item['image_path'], image_path)
+        link_or_copy(item['yolo_txt_path'], label_path)
+
+        new_item = item | {'image_path': image_path.as_posix(), 'label_path': label_path.as_posix(),
+                           'yolo_txt_path': label_path.as_posix()}
+
+        _, writer = self.metadata_files[fold]
+        writer.writerow({column: json.dumps(new_item[column]) if column in ('xy', 'yolo_xy') else new_item[column]
+                         for column in self.columns})
+
+        return new_item
+
+    def close(self):
+        for file, _ in self.metadata_files.values():
+            file.close()
+
+
+@register_stage('export_folds')
+def export_folds_stage(inputs : List[Iterator], output_dir : str):
+    exporter = FoldExporter(output_dir)
+    try:
+        for item in iterate_items(*inputs):
+            yield exporter.export(item)
+    finally:
+        exporter.close()
+
+
+@register_stage('augment', kind='map')
+def augment_stage(item : dict, transforms : list, splits : list = ('train',), encoding : dict = None,
+                  image_cache : str = None, grayscale : bool | str = False):
+    '''
+    Gera as variantes _var_N das imagens dos splits indicados, copiando o respectivo rótulo.
+    Emite o item original seguido das variantes. Com image_cache, as imagens presentes no cache
+    (DataExtractor.image_cache) não são decodificadas novamente. Imagens em L (ou cinzas na
+    prática, com grayscale 'auto') são transformadas como arrays 2D e gravadas com um canal.
+    '''
+    from DataAugmentation.augmentation import Augmentation
+
+    if item.get('split') not in splits:
+        return item
+
+    image_path = Path(item['image_path'])
+    label_path = Path(item['yolo_txt_path'])
+
+    image = Augmentation.load_image(image_path, open_image_cache(image_cache), grayscale)
+
+    items = [item]
+    for index, transform in enumerate(build_albumentations_transforms(transforms)):
+        new_image = Augmentation.apply_albumentation_tranform(image, transform)['image']
+        new_image_path = image_path.with_name(f'{image_path.stem}_var_{index + 1}{image_path.suffix}')
+        new_label_path = label_path.with_name(f'{label_path.stem}_var_{index + 1}.txt')
+
+        Augmentation.save_image(new_image, new_image_path, build_encoding_options(encoding))
+        shutil.copy(label_path, new_label_path)
+
+        items.append(item | {'image_path': new_image_path.as_posix(), 'label_path': new_label_path.as_posix(),
+                             'yolo_txt_path': new_label_path.as_posix(), 'variant': index + 1})
+
+    return items
+
+
+@register_stage('geometric_augment')
+def geometric_augment_stage(inputs : List[Iterator], variants : int = 2, splits : list = ('train',), options : dict = None,
+                            seed : int = 42, encoding : dict = None, grayscale : bool | str = False,
+                            batch_size : int = 16, workers : int = 4):
+    '''
+    Gera variants variantes geométricas _geo_N (DataAugmentation.geometric) das páginas dos splits
+    indicados, com os rótulos YOLO e a coluna xy transformados pela mesma matriz da imagem. As
+    páginas são processadas em lotes de batch_size por workers processos; cada item é emitido
+    seguido das suas variantes.
+    '''
+    from DataAugmentation.geometric import GeometricOptions, augment_files
+
+    geometric_options = GeometricOptions(**{key: tuple(value) if isinstance(value, list) else value
+                                            for key, value in (options or {}).items()})
+
+    def flush(batch):
+        selected = [item for item in batch if item.get('split') in splits]
+        pairs = [(item['image_path'], item['yolo_txt_path']) for item in selected]
+        results = augment_files(pairs, variants, geometric_options, seed, build_encoding_options(encoding),
+                                grayscale, batch_size, workers)
+        variants_by_image = {item['image_path']: result for item, result in zip(selected, results)}
+
+        for item in batch:
+            yield item
+            for index, (image_path, label_path, yolo_xy, xy) in enumerate(variants_by_image.get(item['image_path'], [])):
+                yield item | {'image_path': image_path, 'label_path': label_path, 'yolo_txt_path': label_path,
+                              'yolo_xy': yolo_xy, 'xy': xy, 'geometric_variant': index + 1}
+
+    batch = []
+    for item in iterate_items(*inputs):
+        batch.append(item)
+        if len(batch) >= batch_size * max(workers, 1):
+            yield from flush(batch)
+            batch = []
+    if batch:
+        yield from flush(batch)
+
+
+@register_stage('write_metadata')
+def write_metadata_stage(inputs : List[Iterator], path : str, columns : list = None):
+    '''
+    Escreve os metadados dos itens em CSV, linha a linha. Listas são serializadas em JSON.
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    with open(path, 'w', newline='') as file:
+        writer = None
+        for item in iterate_items(*inputs):
+            if writer is None:
+                writer = csv.DictWriter(file, fieldnames=columns or list(item.keys()), extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow({key: json.dumps(value) if isinstance(value, (list, tuple)) else value
+                             for key, value in item.items()})
+            yield item
+
+
+@register_stage('yolo_yaml')
+def yolo_yaml_stage(inputs : List[Iterator], output_dir : str, train_path : str = 'train/', val_path : str = None,
+                    test_path : str = None, class_ids : list = (0,), class_labels : list = ('cell',),
+                    task : str = 'segment'):
+    from DataExtractor.yolo_converter import YOLOConverter
+
+    for _ in iterate_items(*inputs):
+        pass
+
+    os.makedirs(output_dir, exist_ok=True)
+    yaml_content = YOLOConverter.create_yaml_content(output_dir=f'{Path(output_dir).as_posix()}/',
+                                                     train_fold_path=train_path, val_fold_path=val_path,
+                                                     test_fold_path=test_path, class_ids=class_ids,
+                                                     class_labels=class_labels, task=task)
+    YOLOConverter.save_file(yaml_content, Path(output_dir)/'dataset.yaml')
+
+    return []
+
+
+@register_stage('label_cache')
+def label_cache_stage(inputs : List[Iterator], workers : int = 8, ultralytics : bool = False):
+    '''
+    Repassa os itens exportados e, ao final, gera o cache binário dos rótulos de cada split
+    (diretório pai de images/) encontrado nos itens.
+    '''
+    from DataExtractor.label_cache import LabelCacheExporter
+
+    split_paths = []
+    for item in iterate_items(*inputs):
+        split_path = Path(item['image_path']).parent.parent
+        if split_path not in split_paths:
+            split_paths.append(split_path)
+        yield item
+
+    for split_path in split_paths:
+        LabelCacheExporter.export(split_path, workers=workers, ultralytics=ultralytics)